@@ -0,0 +1,157 @@
+"""
+Questions-réponses par lot sur un PDF, hors Streamlit (contrôles QA nocturnes,
+extraction en masse).
+
+Même pipeline que le chat (extraction, chunking, retrieval hybride FAISS + BM25,
+reranking, contexte sous budget de tokens, Mistral), mais par lot :
+  - toutes les questions sont encodées en un seul model.encode
+  - une seule recherche FAISS pour toutes les questions
+  - les appels Mistral partent en parallèle via le pool (concurrence bornée, retries)
+
+Questions : fichier texte (une par ligne, # = commentaire) ou JSONL
+({"id": ..., "question": ...}). Sortie JSONL : une ligne par question avec
+la réponse et les pages sources.
+
+    python batch_qa.py rapport.pdf questions.txt --output reponses.jsonl
+    MISTRAL_FAKE=1 python batch_qa.py rapport.pdf questions.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import lecteur
+
+
+def load_questions(path: str) -> list:
+    """[(id, question)] dans l'ordre du fichier."""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                questions.append((item.get("id", n), item["question"]))
+            else:
+                questions.append((n, line))
+    return questions
+
+
+def get_batch_client(fake: bool):
+    if fake or os.getenv("MISTRAL_FAKE") == "1":
+        return lecteur.get_llm_pool("fake", fake=True)
+    api_key = os.getenv("MISTRAL_API_KEY")
+    if not api_key:
+        return None
+    return lecteur.get_llm_pool(api_key, lecteur.MISTRAL_SERVER_URL)
+
+
+def answer_batch(doc: dict, doc_key: str, questions: list, client, model, reranker,
+                 top_k: int = 10, context_budget: int = lecteur.CONTEXT_TOKEN_BUDGET) -> list:
+    """Une entrée {id, question, answer, pages, context_tokens, tokens_saved, error} par question."""
+    texts = [q for _, q in questions]
+
+    # Même pipeline que prepare_rag_context : top-k, reranking, contexte sous budget de tokens
+    retrieved = lecteur.retrieve_hybrid_faiss_batch(
+        doc["chunks"], texts, top_k=top_k, model=model, file_key=doc_key,
+        bm25_index=doc["bm25"], emb_matrix=doc["embeddings"], with_scores=True
+    )
+
+    jobs, pages, stats = [], [], []
+    for question, (_, _, candidates, fused_scores) in zip(texts, retrieved):
+        if not candidates:
+            # Aucun terme commun et pas d'embeddings : début du document, dans l'ordre
+            candidates, fused_scores = list(doc["chunks"][:top_k]), None
+        ranked = lecteur.rerank_chunks(
+            candidates, question, reranker, top_k=len(candidates), fused_scores=fused_scores, doc_key=doc_key
+        )
+        context, selected, context_stats = lecteur.pack_context(ranked, context_budget)
+        jobs.append((context, question))
+        pages.append(sorted({p for c in selected for p in c["pages"]}))
+        stats.append(context_stats)
+
+    def progress(done, total):
+        print(f"\r  {done}/{total} réponses", end="", file=sys.stderr)
+
+    answers = lecteur.ask_mistral_many(client, jobs, progress_callback=progress)
+    print(file=sys.stderr)
+
+    return [
+        {
+            "id": qid,
+            "question": question,
+            "answer": answer,
+            "pages": source_pages,
+            "context_tokens": context_stats["tokens"],
+            "tokens_saved": context_stats["saved"],
+            "error": answer.startswith("Erreur Mistral"),
+        }
+        for (qid, question), answer, source_pages, context_stats in zip(questions, answers, pages, stats)
+    ]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Questions-réponses par lot sur un PDF")
+    parser.add_argument("pdf", help="PDF à interroger")
+    parser.add_argument("questions", help="Fichier de questions (.txt ou .jsonl)")
+    parser.add_argument("--output", help="Fichier JSONL de sortie (stdout par défaut)")
+    parser.add_argument("--top-k", type=int, default=10, help="Chunks candidats avant reranking")
+    parser.add_argument("--context-budget", type=int, default=lecteur.CONTEXT_TOKEN_BUDGET,
+                        help="Budget de tokens du contexte envoyé au LLM")
+    parser.add_argument("--no-embeddings", action="store_true", help="BM25 seul (pas d'encodage ni FAISS)")
+    parser.add_argument("--no-reranker", action="store_true")
+    parser.add_argument("--fake", action="store_true", help="Client Mistral factice (aucun appel réseau)")
+    args = parser.parse_args(argv)
+
+    client = get_batch_client(args.fake)
+    if client is None:
+        print("⚠️ Clé API Mistral manquante (MISTRAL_API_KEY).", file=sys.stderr)
+        return 2
+
+    questions = load_questions(args.questions)
+    if not questions:
+        print("⚠️ Aucune question.", file=sys.stderr)
+        return 2
+
+    # Modèles chargés en parallèle (et préchauffés) avant le lot
+    startup = lecteur.warm_up_models(embeddings=not args.no_embeddings, reranker=not args.no_reranker)
+    print(f"▶ Modèles prêts en {startup['total_s']:.1f}s : "
+          + ", ".join(f"{name} {m['load_s']}s" for name, m in startup["models"].items()), file=sys.stderr)
+    model = None if args.no_embeddings else lecteur.load_embedding_model()
+    reranker = None if args.no_reranker else lecteur.load_reranker()
+
+    start = time.perf_counter()
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+    # Même clé que l'application : un cache sans embeddings ne doit pas masquer le document complet
+    doc_key = lecteur.compute_doc_key(pdf_bytes, model_name=lecteur.embedding_cache_name(model))
+    doc, from_cache = lecteur.ingest_pdf(pdf_bytes, doc_key, emb_model=model)
+    if doc is None:
+        print("⚠️ Impossible d'extraire le texte de ce PDF.", file=sys.stderr)
+        return 2
+    print(f"▶ {os.path.basename(args.pdf)} : {len(doc['chunks'])} chunks"
+          f"{' (cache)' if from_cache else ''}, {len(questions)} questions", file=sys.stderr)
+
+    results = answer_batch(doc, doc_key, questions, client, model, reranker,
+                           top_k=args.top_k, context_budget=args.context_budget)
+
+    lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(lines)
+    else:
+        sys.stdout.write(lines)
+
+    errors = sum(r["error"] for r in results)
+    print(f"✅ {len(results)} réponses en {time.perf_counter() - start:.1f}s "
+          f"({errors} erreurs) • contexte : {sum(r['context_tokens'] for r in results)} tokens, "
+          f"{sum(r['tokens_saved'] for r in results)} économisés • pool : {client.stats}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
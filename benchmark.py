@@ -0,0 +1,644 @@
+"""
+Benchmark hors Streamlit du pipeline d'ingestion et de retrieval.
+
+Mesure, par document (InsightPDF_Pro.pdf + PDF synthétiques de 10, 100 et 1000 pages) :
+  - temps mural et pic de RSS de chaque étape
+    (extraction, chunking, encodage, index BM25, index FAISS, retrieval, reranking, LLM stub)
+  - reranking sans cache, puis cache froid / chaud avec early exit (hits, early exits)
+  - avec --faiss-report / --faiss-vectors : recall@10 et latence de chaque type
+    d'index FAISS (flat, SQ8, HNSW, IVF, IVF-SQ8, IVF-PQ) face à l'index exact
+  - débit de retrieval (QPS) et latences p50 / p95
+  - avec --revision-pages : réingestion d'une version révisée (quelques pages
+    modifiées), pipeline complet face à la réingestion incrémentale
+  - avec --dedup-pages : en-têtes / pieds de page retirés, chunks en double et
+    embeddings évités sur un PDF à mentions répétées (pages des doublons couvertes)
+  - avec --sessions-pages : mémoire Python par session quand --sessions sessions
+    ouvrent le même document (chunks en dicts, stockage par session, registre partagé)
+  - avec --backends : débit d'encodage (chunks/s) de chaque backend d'embeddings
+    (lots adaptatifs face au batch_size fixe de 32) et parité avec le premier
+    (cosinus minimal) ; code 1 si un backend sort de la tolérance
+
+Sortie JSON (stdout ou --output). Avec --baseline, compare à un run précédent
+et retourne un code 1 si une étape régresse au-delà de --tolerance.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --pages 10,100 --baseline bench.json
+    python benchmark.py --pdf '' --pages '' --no-reranker --faiss-vectors 50000,300000
+    python benchmark.py --pdf '' --pages '' --no-reranker --revision-pages 100,1000
+    python benchmark.py --pdf '' --pages '' --no-reranker --backends torch,onnx_int8
+    python benchmark.py --pdf '' --pages '' --no-reranker --dedup-pages 100
+    python benchmark.py --pdf '' --pages '' --no-reranker --sessions-pages 100 --sessions 50
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+from fpdf import FPDF
+
+import lecteur
+from fake_mistral import FakeMistralClient
+
+DEFAULT_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "InsightPDF_Pro.pdf")
+
+VOCABULAIRE = (
+    "analyse rapport financier croissance marché stratégie risque client produit "
+    "innovation équipe projet budget résultat trimestre objectif performance données "
+    "processus qualité contrat fournisseur investissement revenu coût marge audit "
+    "conformité sécurité infrastructure déploiement recherche développement énergie"
+).split()
+
+
+# Mention légale longue (un chunk à elle seule), répétée sur chaque page
+AVERTISSEMENT = " ".join([
+    "Ce document est confidentiel et destine exclusivement a ses destinataires.",
+    "Les informations qu'il contient ne constituent ni une offre, ni une sollicitation, ni un conseil en investissement.",
+    "Toute reproduction ou diffusion, totale ou partielle, sans autorisation ecrite prealable est interdite.",
+    "Les chiffres presentes sont provisoires, non audites et susceptibles d'etre revises sans preavis.",
+    "Les performances passees ne prejugent pas des performances futures.",
+    "Les projections reposent sur des hypotheses qui peuvent ne pas se realiser ; les resultats effectifs",
+    "peuvent differer sensiblement des objectifs annonces en raison de facteurs economiques, reglementaires",
+    "ou concurrentiels echappant au controle de la societe.",
+    "La societe ne prend aucun engagement de mise a jour de ces informations, sauf obligation legale.",
+    "Les donnees de marche proviennent de sources externes reputees fiables dont l'exactitude n'est pas garantie.",
+    "Ni la societe, ni ses dirigeants, ni ses conseils ne sauraient etre tenus responsables de l'utilisation",
+    "qui pourrait etre faite de ce document ou de son contenu.",
+    "Le destinataire s'engage a respecter la confidentialite des informations et a ne pas les communiquer a des tiers.",
+    "Ce document ne peut etre distribue dans les juridictions ou sa diffusion ferait l'objet de restrictions.",
+    "Les termes definis dans le rapport annuel s'appliquent au present document.",
+    "Pour toute question, contacter la direction de la communication financiere.",
+    "Les montants sont exprimes en millions d'euros, sauf mention contraire, et les arrondis peuvent",
+    "entrainer de legers ecarts dans les totaux.",
+])
+
+
+def make_synthetic_pdf(n_pages: int, seed: int = 0, revised_pages=(), boilerplate: bool = False) -> bytes:
+    """
+    PDF déterministe : titres + paragraphes de vocabulaire métier.
+    revised_pages : pages auxquelles une phrase est ajoutée (révision mineure, le reste identique).
+    boilerplate : en-tête, pied de page numéroté et avertissement répétés sur chaque page.
+    """
+    rng = random.Random(seed)
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=False)
+    for page in range(1, n_pages + 1):
+        pdf.add_page()
+        if boilerplate:
+            pdf.set_font("Helvetica", "I", 8)
+            pdf.cell(0, 5, "Rapport annuel 2025 - Direction financiere", new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font("Helvetica", "B", 13)
+        pdf.cell(0, 8, f"SECTION {page}", new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font("Helvetica", "", 10)
+        for _ in range(4):
+            words = [rng.choice(VOCABULAIRE) for _ in range(70)]
+            text = " ".join(words).encode("latin-1", errors="replace").decode("latin-1")
+            pdf.multi_cell(0, 5, text.capitalize() + ".")
+            pdf.ln(3)
+        if page in revised_pages:
+            pdf.multi_cell(0, 5, f"Mise a jour de la section {page} : chiffres revus.")
+        if boilerplate:
+            pdf.set_font("Helvetica", "B", 9)
+            pdf.cell(0, 6, "AVERTISSEMENT", new_x="LMARGIN", new_y="NEXT")
+            pdf.set_font("Helvetica", "", 8)
+            pdf.multi_cell(0, 4, AVERTISSEMENT)
+            pdf.set_y(-15)
+            pdf.cell(0, 5, f"Page {page} / {n_pages}", align="C")
+    return bytes(pdf.output())
+
+
+def make_queries(chunks, n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        words = lecteur.tokenize(chunks[rng.randrange(len(chunks))]["text"])
+        queries.append("Que dit le document sur " + " ".join(rng.sample(words, min(4, len(words)))) + " ?")
+    return queries
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss : Ko sous Linux, octets sous macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name: str, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.stages[name] = {
+            "wall_s": round(time.perf_counter() - start, 6),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        return result
+
+
+def load_models(use_embeddings: bool, use_reranker: bool) -> tuple:
+    """Modèles optionnels : un échec (pas installé, hors ligne) désactive l'étape."""
+    model = reranker = None
+    if use_embeddings:
+        try:
+            model = lecteur.load_embedding_model()
+        except Exception as e:
+            print(f"embeddings désactivés : {e}", file=sys.stderr)
+    if use_reranker:
+        try:
+            reranker = lecteur.load_reranker()
+        except Exception as e:
+            print(f"reranker désactivé : {e}", file=sys.stderr)
+    return model, reranker
+
+
+def bench_document(name: str, pdf_bytes: bytes, model, reranker, n_queries: int,
+                   faiss_report: bool = False, min_recall: float = 0.9) -> dict:
+    timer = StageTimer()
+    doc_key = f"bench_{name}_{lecteur.compute_doc_key(pdf_bytes)}"
+
+    extract_stats = {}
+    pages_text = timer.run("extract_pdf_data", lecteur.extract_pdf_data, BytesIO(pdf_bytes), stats=extract_stats)
+    chunks = timer.run(
+        "semantic_chunk", lecteur.semantic_chunk, pages_text,
+        max_chunk_size=lecteur.CHUNK_SIZE, overlap=lecteur.CHUNK_OVERLAP
+    )
+    chunks, dedup = timer.run("dedup_chunks", lecteur.dedup_chunks, chunks)
+    dedup["margin_lines"] = extract_stats.get("margin_lines", 0)
+    bm25_index = timer.run("build_bm25_index", lecteur.build_bm25_index, chunks)
+
+    emb_matrix = None
+    if model is not None:
+        chunks = timer.run("encode_chunks", lecteur.encode_chunks, chunks, model)
+        emb_matrix = lecteur.build_embedding_matrix(chunks)
+        timer.run("build_faiss_index", lecteur.build_faiss_index, chunks, doc_key, emb_matrix)
+
+    queries = make_queries(chunks, n_queries)
+    latencies = []
+    candidates = []
+    fused = []
+
+    def retrieve_all():
+        for q in queries:
+            start = time.perf_counter()
+            _, _, selected, scores = lecteur.retrieve_hybrid_faiss(
+                chunks, q, top_k=10, model=model, file_key=doc_key if model else "",
+                bm25_index=bm25_index, emb_matrix=emb_matrix, with_scores=True
+            )
+            latencies.append(time.perf_counter() - start)
+            candidates.append(selected)
+            fused.append(scores)
+
+    timer.run("retrieve_hybrid_faiss", retrieve_all)
+
+    rerank = None
+    if reranker is not None:
+        # Sans cache ni early exit, puis comme l'application : 1er passage (froid), 2e (cache chaud)
+        timer.run("rerank_chunks", lambda: [
+            lecteur.rerank_chunks(c, q, reranker, top_k=3) for q, c in zip(queries, candidates)
+        ])
+
+        def rerank_app():
+            return [
+                lecteur.rerank_chunks(c, q, reranker, top_k=3, fused_scores=f, doc_key=doc_key)
+                for q, c, f in zip(queries, candidates, fused)
+            ]
+
+        cache = lecteur.get_rerank_cache()
+        before = cache.stats()
+        timer.run("rerank_chunks_cold", rerank_app)
+        timer.run("rerank_chunks_warm", rerank_app)
+        after = cache.stats()
+        rerank = {k: after[k] - before[k] for k in after}
+
+    client = FakeMistralClient(token_delay=0)
+    timer.run("ask_mistral_stub", lambda: [
+        lecteur.ask_mistral(client, "\n\n".join(c["text"] for c in sel[:3]), q)
+        for q, sel in zip(queries, candidates)
+    ])
+
+    faiss_rows = None
+    if faiss_report and emb_matrix is not None:
+        faiss_rows = faiss_recall_report(
+            np.asarray(emb_matrix), model.encode(queries, show_progress_bar=False), min_recall=min_recall
+        )
+
+    total = sum(latencies)
+    return {
+        "name": name,
+        "pages": len(pages_text),
+        "chunks": len(chunks),
+        "stages": timer.stages,
+        "retrieval": {
+            "queries": len(queries),
+            "qps": round(len(queries) / total, 2) if total else None,
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3) if latencies else None,
+            "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3) if latencies else None,
+        },
+        "dedup": dedup,
+        "rerank": rerank,
+        "faiss": faiss_rows,
+    }
+
+
+FAISS_REPORT_TYPES = ("flat", "sq8", "hnsw", "ivf", "ivf_sq8", "ivf_pq")
+
+
+def make_clustered_vectors(n: int, dim: int = 384, seed: int = 0) -> np.ndarray:
+    """Vecteurs synthétiques regroupés en thèmes (plus réalistes qu'un bruit uniforme)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 200), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def faiss_recall_report(vectors: np.ndarray, queries: np.ndarray, k: int = 10, min_recall: float = 0.9) -> dict:
+    """
+    Recall@k et latence de chaque type d'index FAISS face à l'index exact (flat).
+    Le type que choisirait l'application pour cette taille de corpus est signalé (« auto »).
+    """
+    import faiss
+
+    n, dim = vectors.shape
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    faiss.normalize_L2(queries)
+    truth = None
+    rows = []
+    for kind in FAISS_REPORT_TYPES:
+        spec = lecteur.faiss_index_spec(kind, n, dim)
+        if spec["type"] != kind:
+            continue  # corpus trop petit pour ce type
+        start = time.perf_counter()
+        index = lecteur.create_faiss_index(vectors, spec)
+        build_s = time.perf_counter() - start
+
+        latencies, found = [], []
+        for q in queries:
+            start = time.perf_counter()
+            _, ids = index.search(q[None, :], k)
+            latencies.append(time.perf_counter() - start)
+            found.append(ids[0])
+        found = np.array(found)
+        if truth is None:
+            truth = found  # flat en premier : vérité terrain
+        recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+        rows.append({
+            "type": kind,
+            "factory": spec["factory"],
+            "params": {p: spec[p] for p in ("nprobe", "efSearch") if p in spec},
+            "build_s": round(build_s, 3),
+            "bytes_per_vector": round(lecteur.FaissIndexRegistry._estimate_size(index, None) / n, 1),
+            f"recall@{k}": round(recall, 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 4),
+            "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 4),
+            "acceptable": recall >= min_recall,
+        })
+    return {
+        "vectors": n,
+        "dim": dim,
+        "queries": len(queries),
+        "auto": lecteur.choose_faiss_index_type(n, "auto"),
+        "indexes": rows,
+    }
+
+
+def revision_report(n_pages: int, n_changed: int, model) -> dict:
+    """
+    Réingestion d'une version révisée (n_changed pages modifiées) : pipeline complet
+    face à la réingestion incrémentale (pages inchangées reprises, révision du corpus).
+    """
+    rng = random.Random(n_pages)
+    revised = set(rng.sample(range(1, n_pages + 1), min(n_changed, n_pages)))
+    v1, v2 = make_synthetic_pdf(n_pages, seed=3), make_synthetic_pdf(n_pages, seed=3, revised_pages=revised)
+    key1, key2 = lecteur.compute_doc_key(v1), lecteur.compute_doc_key(v2)
+    corpus = lecteur.Corpus(tempfile.mkdtemp(prefix="corpus_", dir=lecteur.CACHE_DIR))
+
+    timer = StageTimer()
+    doc1, _ = timer.run("ingest_v1", lecteur.ingest_pdf, v1, key1, model)
+    corpus.add_document(key1, "rapport.pdf", doc1)
+    timer.run("ingest_v2_full", lecteur.ingest_pdf, v2, f"full_{key2}", model)
+    doc2, _ = timer.run("ingest_v2_incremental", lecteur.ingest_pdf, v2, key2, model, previous_key=key1)
+    update = timer.run("corpus_revision", corpus.replace_document, key1, key2, "rapport.pdf", doc2)
+
+    full_s = timer.stages["ingest_v2_full"]["wall_s"]
+    incremental_s = timer.stages["ingest_v2_incremental"]["wall_s"] + timer.stages["corpus_revision"]["wall_s"]
+    return {
+        "pages": n_pages,
+        "changed_pages": len(update["changed_pages"]),
+        "chunks": len(doc2["chunks"]),
+        "reencoded_chunks": doc2["revision"]["new_chunks"],
+        "reused_chunks": doc2["revision"]["reused_chunks"],
+        "tombstones": update["removed_chunks"],
+        "speedup": round(full_s / incremental_s, 1) if incremental_s else None,
+        "stages": timer.stages,
+    }
+
+
+def dedup_report(n_pages: int, model) -> dict:
+    """
+    Dédoublonnage sur un PDF à en-tête, pied de page et mention légale répétés :
+    extraction brute face à l'extraction sans marges, chunks et embeddings évités,
+    et vérification que chaque page d'un doublon retiré reste citée par un chunk gardé.
+    """
+    pdf_bytes = make_synthetic_pdf(n_pages, seed=7, boilerplate=True)
+    timer = StageTimer()
+    strip = lecteur.STRIP_PAGE_MARGINS
+    try:
+        lecteur.STRIP_PAGE_MARGINS = False
+        raw_pages = timer.run("extract_raw", lecteur.extract_pdf_data, BytesIO(pdf_bytes))
+        lecteur.STRIP_PAGE_MARGINS = True
+        extract_stats = {}
+        pages_text = timer.run("extract_stripped", lecteur.extract_pdf_data, BytesIO(pdf_bytes), stats=extract_stats)
+    finally:
+        lecteur.STRIP_PAGE_MARGINS = strip
+
+    raw_chunks = lecteur.semantic_chunk(raw_pages, max_chunk_size=lecteur.CHUNK_SIZE, overlap=lecteur.CHUNK_OVERLAP)
+    chunks = lecteur.semantic_chunk(pages_text, max_chunk_size=lecteur.CHUNK_SIZE, overlap=lecteur.CHUNK_OVERLAP)
+    kept, dedup = timer.run("dedup_chunks", lecteur.dedup_chunks, chunks)
+    if model is not None:
+        timer.run("encode_raw", lecteur.encode_chunks, raw_chunks, model)
+        timer.run("encode_dedup", lecteur.encode_chunks, kept, model)
+
+    return {
+        "pages": len(raw_pages),
+        "margin_lines": extract_stats.get("margin_lines", 0),
+        "chunks_raw": len(raw_chunks),
+        "chunks_before_dedup": len(chunks),
+        "chunks": len(kept),
+        "duplicates": dedup["duplicates"],
+        "embeddings_saved": len(raw_chunks) - len(kept),
+        "pages_covered": {p for c in kept for p in c["pages"]} == {p for c in chunks for p in c["pages"]},
+        "stages": timer.stages,
+    }
+
+
+def session_memory_report(n_pages: int, n_sessions: int, model) -> dict:
+    """
+    Mémoire Python par session quand n_sessions ouvrent le même document (tracemalloc ;
+    les pages mmap du cache, partagées par le cache OS, ne sont pas comptées) :
+      - dict_chunks : pages en dict, texte complet, chunks en dicts avec leur embedding
+      - store_per_session : stockage colonnaire, mais BM25, pages et texte complet par session
+      - shared : la session ne garde que la clé, le document vient du registre partagé
+    """
+    pdf_bytes = make_synthetic_pdf(n_pages, seed=11)
+    doc_key = lecteur.compute_doc_key(pdf_bytes)
+    doc, _ = lecteur.ingest_pdf(pdf_bytes, doc_key, model)
+    path = lecteur.get_cache_path(doc_key)
+
+    def dict_chunks_session():
+        stored = lecteur.load_chunk_store(path)
+        pages = dict(stored["pages_text"].items())
+        embeddings = stored["embeddings"]
+        chunks = []
+        for i, chunk in enumerate(stored["chunks"]):
+            if embeddings is not None:
+                chunk["embedding"] = np.array(embeddings[i])
+            chunks.append(chunk)
+        return {"pdf_pages": pages, "full_text": "\n".join(t for _, t in sorted(pages.items())),
+                "chunks": chunks, "bm25_index": stored["bm25"]}
+
+    def store_per_session():
+        stored = lecteur.load_chunk_store(path)
+        pages = dict(stored["pages_text"].items())
+        return {"pdf_pages": pages, "full_text": "\n".join(t for _, t in sorted(pages.items())),
+                "chunks": stored["chunks"], "bm25_index": stored["bm25"], "emb_matrix": stored["embeddings"]}
+
+    registry = lecteur.DocumentRegistry(int(lecteur.DOC_REGISTRY_MAX_MB * 1024 * 1024))
+
+    def shared_session():
+        registry.get(doc_key)
+        return {"doc_key": doc_key, "loaded_file": "rapport.pdf", "doc_ready": True}
+
+    def traced(fn, n):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            kept = [fn() for _ in range(n)]
+            gc.collect()
+            used = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        del kept
+        return used
+
+    layouts = {}
+    for name, fn in (("dict_chunks", dict_chunks_session), ("store_per_session", store_per_session),
+                     ("shared", shared_session)):
+        print(f"  {name}", file=sys.stderr)
+        once = traced(fn, 1) if name == "shared" else 0  # chargement unique du registre
+        used = traced(fn, n_sessions)
+        layouts[name] = {
+            "per_session_kb": round(used / n_sessions / 1024, 1),
+            "total_mb": round((once + used) / 1e6, 2),
+            "shared_once_mb": round(once / 1e6, 2),
+        }
+
+    baseline = layouts["dict_chunks"]["total_mb"]
+    for row in layouts.values():
+        row["total_vs_dict_chunks"] = round(row["total_mb"] / baseline, 3) if baseline else None
+    return {
+        "pages": len(doc["pages_text"]),
+        "chunks": len(doc["chunks"]),
+        "embeddings": doc["embeddings"] is not None,
+        "sessions": n_sessions,
+        "layouts": layouts,
+    }
+
+
+def backend_report(texts: list, backends: list, min_cosine: float = 0.99) -> dict:
+    """
+    Débit d'encodage de chaque backend d'embeddings et parité avec le premier disponible
+    (cosinus entre les embeddings d'un même chunk). Un backend indisponible est signalé.
+    """
+    reference = reference_name = None
+    rows = []
+    for name in backends:
+        try:
+            backend = lecteur.create_embedding_backend(name)
+        except Exception as e:
+            rows.append({"backend": name, "available": False, "error": str(e)})
+            continue
+        backend.encode(texts[:8])  # chauffe
+
+        start = time.perf_counter()
+        embeddings = np.asarray(backend.encode(texts), dtype=np.float32)
+        adaptive_s = time.perf_counter() - start
+        start = time.perf_counter()
+        backend.model.encode(texts, batch_size=32, show_progress_bar=False)
+        fixed_s = time.perf_counter() - start
+
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        if reference is None:
+            reference, reference_name = embeddings, backend.name
+        cosines = np.sum(embeddings * reference, axis=1)
+        rows.append({
+            "backend": backend.name,
+            "available": True,
+            "chunks_per_s": round(len(texts) / adaptive_s, 1),
+            "chunks_per_s_batch32": round(len(texts) / fixed_s, 1),
+            "batches": len(lecteur.token_budget_batches(backend.token_lengths(texts))),
+            "min_cosine": round(float(cosines.min()), 5),
+            "mean_cosine": round(float(cosines.mean()), 5),
+            "parity": bool(cosines.min() >= min_cosine),
+        })
+    return {
+        "chunks": len(texts),
+        "reference": reference_name,
+        "min_cosine": min_cosine,
+        "batch_tokens": lecteur.EMBEDDING_BATCH_TOKENS,
+        "backends": rows,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Liste des régressions : (document, étape, avant, après)."""
+    before = {d["name"]: d for d in baseline.get("documents", [])}
+    regressions = []
+    for doc in report["documents"]:
+        old = before.get(doc["name"])
+        if not old:
+            continue
+        for stage, values in doc["stages"].items():
+            old_stage = old["stages"].get(stage)
+            # Ignore le bruit sur les étapes très courtes (< 5 ms)
+            if old_stage and values["wall_s"] > 0.005 and values["wall_s"] > old_stage["wall_s"] * (1 + tolerance):
+                regressions.append((doc["name"], stage, old_stage["wall_s"], values["wall_s"]))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark du pipeline Insight PDF Pro")
+    parser.add_argument("--pdf", default=DEFAULT_PDF, help="PDF réel à mesurer ('' pour l'ignorer)")
+    parser.add_argument("--pages", default="10,100,1000", help="Tailles des PDF synthétiques")
+    parser.add_argument("--queries", type=int, default=50, help="Questions de retrieval par document")
+    parser.add_argument("--no-embeddings", action="store_true", help="BM25 seul (pas d'encodage ni FAISS)")
+    parser.add_argument("--no-reranker", action="store_true")
+    parser.add_argument("--output", help="Fichier JSON de sortie (stdout par défaut)")
+    parser.add_argument("--baseline", help="Rapport JSON précédent à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Régression tolérée (0.2 = +20 %%)")
+    parser.add_argument("--faiss-report", action="store_true",
+                        help="Recall@10 / latence de chaque type d'index FAISS face au flat (documents encodés)")
+    parser.add_argument("--faiss-vectors", default="",
+                        help="Tailles de corpus synthétiques pour le rapport FAISS, ex. 50000,300000")
+    parser.add_argument("--min-recall", type=float, default=0.9, help="Recall@10 minimal jugé acceptable")
+    parser.add_argument("--revision-pages", default="",
+                        help="Tailles de PDF pour le rapport de réingestion incrémentale (ex. 100,1000)")
+    parser.add_argument("--revision-changed", type=int, default=3, help="Pages modifiées par la révision")
+    parser.add_argument("--dedup-pages", default="",
+                        help="Tailles de PDF à mentions répétées pour le rapport de dédoublonnage (ex. 100)")
+    parser.add_argument("--sessions-pages", default="",
+                        help="Tailles des PDF ouverts par plusieurs sessions (mémoire par session)")
+    parser.add_argument("--sessions", type=int, default=50, help="Sessions ouvrant le même document")
+    parser.add_argument("--backends", default="",
+                        help="Backends d'embeddings à comparer, le premier sert de référence (ex. torch,onnx_int8)")
+    parser.add_argument("--backend-pages", type=int, default=100, help="Pages du PDF synthétique encodé par backend")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Cosinus minimal jugé à parité")
+    args = parser.parse_args(argv)
+
+    # Caches isolés : chaque run mesure le pipeline à froid
+    lecteur.CACHE_DIR = tempfile.mkdtemp(prefix="insight_bench_")
+
+    model, reranker = load_models(not args.no_embeddings, not args.no_reranker)
+    documents = []
+    if args.pdf and os.path.exists(args.pdf):
+        with open(args.pdf, "rb") as f:
+            documents.append((os.path.basename(args.pdf), f.read()))
+    for n in [int(p) for p in args.pages.split(",") if p.strip()]:
+        documents.append((f"synthetic_{n}p", make_synthetic_pdf(n)))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "embedding_model": lecteur.EMBEDDING_MODEL_NAME if model is not None else None,
+            "embedding_backend": model.name if model is not None else None,
+            "reranker": reranker is not None,
+        },
+        "documents": [],
+    }
+    for name, pdf_bytes in documents:
+        print(f"▶ {name}", file=sys.stderr)
+        report["documents"].append(bench_document(
+            name, pdf_bytes, model, reranker, args.queries,
+            faiss_report=args.faiss_report, min_recall=args.min_recall
+        ))
+
+    # Rapport FAISS à grande échelle, sans modèle (vecteurs synthétiques)
+    faiss_sizes = [int(n) for n in args.faiss_vectors.split(",") if n.strip()]
+    if faiss_sizes:
+        report["faiss"] = []
+        for n in faiss_sizes:
+            print(f"▶ FAISS {n} vecteurs", file=sys.stderr)
+            vectors = make_clustered_vectors(n + args.queries)
+            report["faiss"].append(faiss_recall_report(
+                vectors[args.queries:], vectors[:args.queries], min_recall=args.min_recall
+            ))
+
+    # Réingestion d'une révision mineure : pages modifiées seulement
+    revision_sizes = [int(n) for n in args.revision_pages.split(",") if n.strip()]
+    if revision_sizes:
+        report["revision"] = []
+        for n in revision_sizes:
+            print(f"▶ Révision {n} pages ({args.revision_changed} modifiées)", file=sys.stderr)
+            report["revision"].append(revision_report(n, args.revision_changed, model))
+
+    # En-têtes, pieds de page et mentions répétées : chunks et embeddings évités
+    dedup_sizes = [int(n) for n in args.dedup_pages.split(",") if n.strip()]
+    if dedup_sizes:
+        report["dedup"] = []
+        for n in dedup_sizes:
+            print(f"▶ Dédoublonnage {n} pages", file=sys.stderr)
+            report["dedup"].append(dedup_report(n, model))
+
+    # Même document ouvert par plusieurs sessions : mémoire par session
+    session_sizes = [int(n) for n in args.sessions_pages.split(",") if n.strip()]
+    if session_sizes:
+        report["sessions"] = []
+        for n in session_sizes:
+            print(f"▶ Mémoire par session {n} pages ({args.sessions} sessions)", file=sys.stderr)
+            report["sessions"].append(session_memory_report(n, args.sessions, model))
+
+    # Débit et parité des backends d'embeddings sur les mêmes chunks
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if backends:
+        print(f"▶ Backends d'embeddings : {', '.join(backends)}", file=sys.stderr)
+        pages_text = lecteur.extract_pdf_data(BytesIO(make_synthetic_pdf(args.backend_pages, seed=5)))
+        chunks = lecteur.semantic_chunk(pages_text, max_chunk_size=lecteur.CHUNK_SIZE, overlap=lecteur.CHUNK_OVERLAP)
+        report["backends"] = backend_report([c["text"] for c in chunks], backends, args.min_cosine)
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+    status = 0
+    for row in report.get("backends", {}).get("backends", []):
+        if row["available"] and not row["parity"]:
+            print(f"⚠️ parité {row['backend']} : cosinus min {row['min_cosine']} < {args.min_cosine}", file=sys.stderr)
+            status = 1
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, stage, before, after in regressions:
+            print(f"⚠️ régression {name} / {stage} : {before:.4f}s → {after:.4f}s", file=sys.stderr)
+        return 1 if regressions else status
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Client Mistral factice, 100 % local (aucun appel réseau).
+
+Reproduit la forme des réponses du SDK mistralai utilisée par lecteur.py :
+  - client.chat.complete(...).choices[0].message.content
+  - for event in client.chat.stream(...): event.data.choices[0].delta.content
+  - await client.chat.complete_async(...)
+
+Activé dans l'application avec MISTRAL_FAKE=1 (tests hors ligne, démo, benchmarks).
+"""
+
+import asyncio
+import os
+import re
+import time
+from types import SimpleNamespace
+
+
+class _FakeChat:
+    def __init__(self, token_delay: float, answer_fn, latency: float = 0.0):
+        self.token_delay = token_delay
+        self.latency = latency
+        self.answer_fn = answer_fn
+        self.calls = 0
+
+    def _answer(self, messages: list) -> str:
+        self.calls += 1
+        return self.answer_fn(messages)
+
+    def complete(self, model: str = None, messages: list = None, **kwargs):
+        content = self._answer(messages or [])
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+        )
+
+    async def complete_async(self, model: str = None, messages: list = None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.complete(model=model, messages=messages, **kwargs)
+
+    def stream(self, model: str = None, messages: list = None, **kwargs):
+        content = self._answer(messages or [])
+        # Découpe en "tokens" (mots + espaces) comme un flux SSE
+        for token in re.findall(r"\S+\s*|\s+", content):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            delta = SimpleNamespace(role="assistant", content=token)
+            choice = SimpleNamespace(index=0, delta=delta, finish_reason=None)
+            yield SimpleNamespace(data=SimpleNamespace(model=model, choices=[choice]))
+
+
+def default_answer(messages: list) -> str:
+    """Réponse déterministe : rappelle la question et cite le début du contexte."""
+    user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    context, _, question = user.rpartition("QUESTION:")
+    context = context.replace("CONTEXTE:", "").strip()
+    excerpt = " ".join(context.split()[:30])
+    return (
+        f"Réponse simulée à : {question.strip() or user[:200]}\n\n"
+        f"D'après le document : \"{excerpt}\""
+    )
+
+
+class FakeMistralClient:
+    def __init__(self, token_delay: float = None, answer_fn=default_answer, latency: float = 0.0):
+        if token_delay is None:
+            token_delay = float(os.getenv("MISTRAL_FAKE_TOKEN_DELAY", "0.02"))
+        self.chat = _FakeChat(token_delay, answer_fn, latency)
@@ -0,0 +1,37 @@
+"""
+Synthèse vocale factice, 100 % locale (aucun appel réseau).
+
+Même interface que gTTS pour ce qu'utilise lecteur.py :
+  - FakeTTS(text=..., lang=...).write_to_fp(fp)
+
+Produit un MP3 valide (trames MPEG-1 Layer III silencieuses) dont la durée
+suit la longueur du texte, avec une latence simulée par appel.
+
+Activé dans l'application avec TTS_FAKE=1 (tests hors ligne, démo, benchmarks).
+"""
+
+import os
+import time
+
+# Trame MPEG-1 Layer III, 32 kbit/s (comme gTTS), 44,1 kHz, mono : 104 octets, ~26 ms
+_FRAME_HEADER = bytes([0xFF, 0xFB, 0x10, 0xC4])
+_FRAME = _FRAME_HEADER + bytes(104 - len(_FRAME_HEADER))
+_FRAME_SECONDS = 1152 / 44100
+_CHARS_PER_SECOND = 15  # débit de lecture approximatif
+
+
+class FakeTTS:
+    def __init__(self, text: str, lang: str = "fr", latency: float = None, **kwargs):
+        if not text or not text.strip():
+            raise AssertionError("No text to speak")  # comme gTTS
+        if latency is None:
+            latency = float(os.getenv("TTS_FAKE_DELAY", "0.2"))
+        self.text = text
+        self.lang = lang
+        self.latency = latency
+
+    def write_to_fp(self, fp):
+        if self.latency:
+            time.sleep(self.latency)
+        seconds = len(self.text) / _CHARS_PER_SECOND
+        fp.write(_FRAME * max(1, round(seconds / _FRAME_SECONDS)))
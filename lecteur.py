@@ -4,7 +4,14 @@ import re
 import os
 import hashlib
 import pickle
-from collections import Counter
+import shutil
+import threading
+import time
+import multiprocessing
+import zlib
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from io import BytesIO
 
@@ -16,13 +23,16 @@ from pptx.dml.color import RGBColor
 from mistralai import Mistral
 from fpdf import FPDF
 
+from fake_mistral import FakeMistralClient
+from llm_pool import MistralPool
+from pdf_extraction import count_pages, extract_page_range, init_worker
+from tracing import Tracer, activate, span
+
 # ============================================================
 # CONFIGURATION
 # ============================================================
 
-st.set_page_config(page_title="Insight PDF Pro", page_icon="✨", layout="wide")
-
-st.markdown("""
+PAGE_CSS = """
 <style>
 @import url('https://fonts.googleapis.com/css2?family=Google+Sans:wght@400;500;700&display=swap');
 html, body, [class*="css"] { font-family: 'Google Sans', sans-serif; }
@@ -43,7 +53,7 @@ html, body, [class*="css"] { font-family: 'Google Sans', sans-serif; }
     padding: 4px 8px;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # ============================================================
 # PROMPT ANTI-HALLUCINATION
@@ -62,84 +72,576 @@ SYSTEM_PROMPT = (
 CACHE_DIR = ".embedding_cache"
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# Modèle d'embeddings (fait partie de la clé des caches et des index FAISS)
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Paramètres du chunker (font partie de la clé du cache document)
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+STRIP_PAGE_MARGINS = os.getenv("STRIP_PAGE_MARGINS", "1") == "1"          # en-têtes / pieds de page répétés
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.85"))  # similarité MinHash ; 0 = désactivé
+
+# Budget mémoire du registre d'index FAISS partagé (en Mo)
+FAISS_REGISTRY_MAX_MB = float(os.getenv("FAISS_REGISTRY_MAX_MB", "512"))
+
+# Budget mémoire du registre de documents partagé entre sessions (en Mo)
+DOC_REGISTRY_MAX_MB = float(os.getenv("DOC_REGISTRY_MAX_MB", "1024"))
+
 # ============================================================
 # AMÉLIORATION 1 — PARSING : pdfplumber (remplace PyPDF2)
 # Meilleur sur PDF complexes (tableaux, colonnes, mise en page)
+# Extraction parallèle par plages de pages (pool de processus)
 # ============================================================
 
-def extract_pdf_data(pdf_file) -> dict:
+# En dessous de ce nombre de pages, le coût de démarrage du pool n'est pas rentable
+EXTRACT_PARALLEL_MIN_PAGES = 40
+EXTRACT_PAGES_PER_TASK = 10
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", os.cpu_count() or 1))
+
+
+def extract_pdf_data(pdf_file, progress_callback=None, stats: dict = None) -> dict:
     """
     Extraction robuste avec pdfplumber.
-    Fallback automatique vers PyPDF2 si pdfplumber échoue.
+    Fallback automatique vers PyPDF2 si pdfplumber échoue (par plage de pages).
+    Les gros PDF sont découpés en plages extraites en parallèle
+    dans un pool de processus ; progress_callback(pages_faites, total).
+    En-têtes et pieds de page répétés retirés (cf. strip_page_margins) ;
+    stats, si fourni, reçoit margin_lines (lignes retirées).
     """
     pdf_bytes = pdf_file.read()
+    n_pages = count_pages(pdf_bytes)
+    if n_pages == 0:
+        return {}
 
-    # Tentative pdfplumber (meilleure qualité)
-    try:
-        import pdfplumber
-        pages_text = {}
-        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
-            for i, page in enumerate(pdf.pages):
-                text = page.extract_text()
-                if text and text.strip():
-                    pages_text[i + 1] = text
-        if pages_text:
-            return pages_text
-    except ImportError:
-        st.warning("⚠️ pdfplumber non installé. Fallback PyPDF2. `pip install pdfplumber` recommandé.")
-    except Exception as e:
-        st.warning(f"⚠️ pdfplumber a échoué ({e}), fallback PyPDF2.")
+    workers = min(EXTRACT_MAX_WORKERS, max(1, n_pages // EXTRACT_PAGES_PER_TASK))
+    # Plusieurs plages par worker pour équilibrer la charge (pages de coût inégal)
+    per_task = max(EXTRACT_PAGES_PER_TASK, -(-n_pages // (workers * 4)))
+    ranges = [(s, min(s + per_task, n_pages)) for s in range(0, n_pages, per_task)]
 
-    # Fallback PyPDF2
-    import PyPDF2
-    reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
     pages_text = {}
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text()
-        if text and text.strip():
-            pages_text[i + 1] = text
+    warnings = set()
+    done = 0
+
+    def collect(result, start, end):
+        nonlocal done
+        texts, _, warning = result
+        pages_text.update(texts)
+        if warning:
+            warnings.add(warning)
+        done += end - start
+        if progress_callback:
+            progress_callback(done, n_pages)
+
+    if n_pages < EXTRACT_PARALLEL_MIN_PAGES or workers <= 1:
+        for start, end in ranges:
+            collect(extract_page_range(start, end, pdf_bytes), start, end)
+    else:
+        # spawn : pas de fork d'un processus Streamlit multi-threadé
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(pdf_bytes,),
+        ) as pool:
+            futures = {pool.submit(extract_page_range, s, e): (s, e) for s, e in ranges}
+            for future in as_completed(futures):
+                collect(future.result(), *futures[future])
+
+    for warning in sorted(warnings):
+        st.warning(warning)
+
+    # Ordre des pages conservé quel que soit l'ordre de fin des workers
+    pages_text = dict(sorted(pages_text.items()))
+    removed = 0
+    if STRIP_PAGE_MARGINS:
+        pages_text, removed = strip_page_margins(pages_text)
+    if stats is not None:
+        stats["margin_lines"] = removed
     return pages_text
 
 
 # ============================================================
-# AMÉLIORATION 2 — CACHE EMBEDDINGS PERSISTANTS (disque)
-# Évite le recalcul à chaque upload du même fichier
+# AMÉLIORATION 2 — CACHE DOCUMENT PERSISTANT (disque, adressé par contenu)
+# Clé = hash des octets du PDF + paramètres du pipeline (pas le nom du fichier)
+# Un PDF déjà vu est rechargé sans extraction, découpage ni encodage
 # ============================================================
 
-def get_cache_path(file_key: str) -> str:
-    h = hashlib.md5(file_key.encode()).hexdigest()
-    return os.path.join(CACHE_DIR, f"{h}.pkl")
+def get_pdf_parser_name() -> str:
+    try:
+        import pdfplumber
+        return "pdfplumber"
+    except ImportError:
+        return "PyPDF2"
+
+
+def compute_doc_key(pdf_bytes: bytes, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                    parser: str = None, model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    """
+    Clé de cache du document : blake2b (rapide) des octets du PDF
+    + paramètres du chunker (dont le dédoublonnage), parser et modèle d'embeddings.
+    Deux PDF homonymes ont des clés différentes ; un même PDF renommé garde la sienne.
+    """
+    h = hashlib.blake2b(pdf_bytes, digest_size=16)
+    h.update(f"|{chunk_size}|{overlap}|{parser or get_pdf_parser_name()}|{model_name}".encode())
+    h.update(f"|margins{int(STRIP_PAGE_MARGINS)}|dedup{CHUNK_DEDUP_THRESHOLD}".encode())
+    return h.hexdigest()
+
 
+def get_cache_path(doc_key: str) -> str:
+    return os.path.join(CACHE_DIR, f"doc_{doc_key}")
 
-def load_cached_embeddings(file_key: str):
-    path = get_cache_path(file_key)
-    if os.path.exists(path):
+
+def load_cached_document(doc_key: str):
+    path = get_cache_path(doc_key)
+    if os.path.isdir(path):
         try:
-            with open(path, "rb") as f:
-                return pickle.load(f)
+            return load_chunk_store(path)
         except Exception:
             return None
     return None
 
 
-def save_cached_embeddings(file_key: str, chunks: list):
-    path = get_cache_path(file_key)
+def save_cached_document(doc_key: str, doc: dict):
+    path = get_cache_path(doc_key)
     try:
-        with open(path, "wb") as f:
-            pickle.dump(chunks, f)
+        save_chunk_store(path, doc)
     except Exception as e:
         st.warning(f"⚠️ Impossible de sauvegarder le cache : {e}")
 
 
+# ============================================================
+# AMÉLIORATION 11 — STOCKAGE COLONNAIRE MEMORY-MAPPED
+# Embeddings = une matrice .npy ouverte en mmap, textes = un blob indexé
+# par offsets, pages = tableaux d'entiers. Chargement quasi instantané,
+# pages mémoire partagées (cache OS) entre sessions concurrentes
+# ============================================================
+
+class ChunkStore:
+    """
+    Séquence de chunks en lecture seule, adossée à des tableaux (mmap).
+    store[i] → {"text": ..., "pages": [...]}, décodé à la demande.
+    """
+
+    __slots__ = ("text_blob", "text_offsets", "pages_flat", "page_offsets", "embeddings")
+
+    def __init__(self, text_blob, text_offsets, pages_flat, page_offsets, embeddings=None):
+        self.text_blob = text_blob
+        self.text_offsets = text_offsets
+        self.pages_flat = pages_flat
+        self.page_offsets = page_offsets
+        self.embeddings = embeddings
+
+    def __len__(self) -> int:
+        return len(self.text_offsets) - 1
+
+    def text(self, i: int) -> str:
+        start, end = self.text_offsets[i], self.text_offsets[i + 1]
+        return self.text_blob[start:end].tobytes().decode("utf-8")
+
+    def pages(self, i: int) -> list:
+        return self.pages_flat[self.page_offsets[i]:self.page_offsets[i + 1]].tolist()
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return {"text": self.text(i), "pages": self.pages(i)}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.text_blob.nbytes + self.pages_flat.nbytes)
+
+
+def save_chunk_store(path: str, doc: dict):
+    """
+    Écrit le document en colonnes dans un dossier temporaire puis le renomme
+    (une session concurrente ne voit jamais un cache partiel).
+    """
+    chunks = doc["chunks"]
+    texts = [c["text"].encode("utf-8") for c in chunks]
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in texts], out=text_offsets[1:])
+    page_lists = [c["pages"] for c in chunks]
+    page_offsets = np.zeros(len(page_lists) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in page_lists], out=page_offsets[1:])
+    pages_flat = np.array([p for pages in page_lists for p in pages], dtype=np.int32)
+
+    tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    np.save(os.path.join(tmp_path, "texts.npy"), np.frombuffer(b"".join(texts), dtype=np.uint8))
+    np.save(os.path.join(tmp_path, "text_offsets.npy"), text_offsets)
+    np.save(os.path.join(tmp_path, "pages.npy"), pages_flat)
+    np.save(os.path.join(tmp_path, "page_offsets.npy"), page_offsets)
+    embeddings = doc.get("embeddings")
+    if embeddings is not None:
+        np.save(os.path.join(tmp_path, "embeddings.npy"), np.ascontiguousarray(embeddings, dtype=np.float32))
+    pages = doc["pages_text"]
+    if not isinstance(pages, PageStore):
+        pages = PageStore.from_pages(pages)
+    np.save(os.path.join(tmp_path, "page_texts.npy"), pages.text_blob)
+    np.save(os.path.join(tmp_path, "page_numbers.npy"), pages.page_numbers)
+    np.save(os.path.join(tmp_path, "page_spans.npy"), pages.spans)
+    with open(os.path.join(tmp_path, "bm25.pkl"), "wb") as f:
+        pickle.dump(doc["bm25"], f)
+    with open(os.path.join(tmp_path, "page_hashes.json"), "w", encoding="utf-8") as f:
+        json.dump({str(k): v for k, v in page_hashes(doc["pages_text"]).items()}, f)
+    with open(os.path.join(tmp_path, "analytics.json"), "w", encoding="utf-8") as f:
+        json.dump(doc.get("analytics") or compute_document_analytics(doc["pages_text"]), f, ensure_ascii=False)
+    if doc.get("dedup") is not None:
+        with open(os.path.join(tmp_path, "dedup.json"), "w", encoding="utf-8") as f:
+            json.dump(doc["dedup"], f)
+
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Déjà écrit par une autre session : on garde la version existante
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_chunk_store(path: str) -> dict:
+    def mmap(name):
+        return np.load(os.path.join(path, name), mmap_mode="r")
+
+    emb_path = os.path.join(path, "embeddings.npy")
+    store = ChunkStore(
+        mmap("texts.npy"), mmap("text_offsets.npy"),
+        mmap("pages.npy"), mmap("page_offsets.npy"),
+        embeddings=np.load(emb_path, mmap_mode="r") if os.path.exists(emb_path) else None,
+    )
+    if os.path.exists(os.path.join(path, "page_texts.npy")):
+        pages_text = PageStore(mmap("page_texts.npy"), mmap("page_numbers.npy"), mmap("page_spans.npy"))
+    else:
+        # Cache antérieur au buffer de pages : même représentation, construite en mémoire
+        with open(os.path.join(path, "pages_text.json"), encoding="utf-8") as f:
+            pages_text = PageStore.from_pages({int(k): v for k, v in json.load(f).items()})
+    with open(os.path.join(path, "bm25.pkl"), "rb") as f:
+        bm25 = pickle.load(f)
+    hashes_path = os.path.join(path, "page_hashes.json")
+    if os.path.exists(hashes_path):
+        with open(hashes_path, encoding="utf-8") as f:
+            hashes = {int(k): v for k, v in json.load(f).items()}
+    else:
+        hashes = page_hashes(pages_text)  # cache antérieur aux empreintes par page
+    analytics_path = os.path.join(path, "analytics.json")
+    if os.path.exists(analytics_path):
+        with open(analytics_path, encoding="utf-8") as f:
+            analytics = json.load(f)
+    else:
+        # Cache antérieur à l'analyse précalculée : calculée une fois puis enregistrée
+        analytics = compute_document_analytics(pages_text)
+        try:
+            with open(analytics_path, "w", encoding="utf-8") as f:
+                json.dump(analytics, f, ensure_ascii=False)
+        except OSError:
+            pass
+
+    dedup_path = os.path.join(path, "dedup.json")
+    dedup = None
+    if os.path.exists(dedup_path):
+        with open(dedup_path, encoding="utf-8") as f:
+            dedup = json.load(f)
+
+    return {
+        "pages_text": pages_text,
+        "page_hashes": hashes,
+        "analytics": analytics,
+        "dedup": dedup,
+        "chunks": store,
+        "bm25": bm25,
+        "embeddings": store.embeddings,
+    }
+
+
+# ============================================================
+# AMÉLIORATION 26 — DOCUMENT PARTAGÉ EN LECTURE SEULE
+# Texte des pages = un buffer UTF-8 + spans (offset, longueur), comme
+# les chunks : plus de dict de pages ni de texte complet recopiés dans
+# chaque session. Le document est chargé une fois par processus ;
+# la session n'en garde que la clé (cf. session_document)
+# ============================================================
+
+class PageStore(Mapping):
+    """
+    Pages en lecture seule : store[page] → texte, décodé à la demande.
+    Les pages sont jointes par "\n" dans le buffer : full_text le décode d'un bloc.
+    """
+
+    __slots__ = ("text_blob", "page_numbers", "spans", "_char_count")
+
+    def __init__(self, text_blob, page_numbers, spans):
+        self.text_blob = text_blob
+        self.page_numbers = page_numbers
+        self.spans = spans
+        self._char_count = None
+
+    @classmethod
+    def from_pages(cls, pages_text: dict) -> "PageStore":
+        items = sorted(pages_text.items())
+        encoded = [text.encode("utf-8") for _, text in items]
+        lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+        offsets = np.zeros(len(encoded), dtype=np.int64)
+        np.cumsum(lengths[:-1] + 1, out=offsets[1:])
+        arrays = (
+            np.frombuffer(b"\n".join(encoded), dtype=np.uint8),
+            np.array([page for page, _ in items], dtype=np.int32),
+            np.stack([offsets, lengths], axis=1),
+        )
+        for a in arrays:
+            a.flags.writeable = False
+        return cls(*arrays)
+
+    def __getitem__(self, page) -> str:
+        i = int(np.searchsorted(self.page_numbers, page))
+        if i == len(self.page_numbers) or self.page_numbers[i] != page:
+            raise KeyError(page)
+        offset, length = self.spans[i]
+        return self.text_blob[offset:offset + length].tobytes().decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self.page_numbers)
+
+    def __iter__(self):
+        return iter(self.page_numbers.tolist())
+
+    @property
+    def full_text(self) -> str:
+        return self.text_blob.tobytes().decode("utf-8")
+
+    @property
+    def char_count(self) -> int:
+        # Caractères = octets hors continuations UTF-8 (10xxxxxx), sans décoder
+        if self._char_count is None:
+            self._char_count = int(np.count_nonzero((self.text_blob & 0xC0) != 0x80))
+        return self._char_count
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.text_blob.nbytes + self.page_numbers.nbytes + self.spans.nbytes)
+
+
+class DocumentRegistry:
+    """
+    Documents ingérés partagés par toutes les sessions Streamlit.
+    - Clé : doc_key (cache disque adressé par contenu, donc immuable)
+    - Chargement unique par clé depuis le cache (pages et chunks en mmap, BM25 en mémoire)
+    - Éviction LRU au-delà du budget ; une session évincée recharge via get()
+    Les documents servis ne doivent pas être modifiés.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # doc_key → (document, taille en octets)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    @staticmethod
+    def _estimate_size(doc_key: str) -> int:
+        # Taille du cache sur disque : BM25 désérialisé + pages mmap une fois lues
+        path = get_cache_path(doc_key)
+        return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+
+    def get(self, doc_key: str):
+        """Document partagé, ou None s'il n'est pas (encore) dans le cache disque."""
+        with self._lock:
+            entry = self._entries.get(doc_key)
+            if entry is not None:
+                self._entries.move_to_end(doc_key)
+                return entry[0]
+            load_lock = self._load_locks.setdefault(doc_key, threading.Lock())
+
+        with load_lock:
+            try:
+                with self._lock:
+                    entry = self._entries.get(doc_key)
+                    if entry is not None:
+                        self._entries.move_to_end(doc_key)
+                        return entry[0]
+
+                doc = load_cached_document(doc_key)
+                if doc is None:
+                    return None
+
+                size = self._estimate_size(doc_key)
+                with self._lock:
+                    self._entries[doc_key] = (doc, size)
+                    self.total_bytes += size
+                    self._evict()
+                return doc
+            finally:
+                # Document pas encore en cache (ingestion en cours) : verrou retiré quand même
+                with self._lock:
+                    self._load_locks.pop(doc_key, None)
+
+    def _evict(self):
+        # Garde toujours au moins le document le plus récent
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"documents": len(self._entries), "bytes": self.total_bytes}
+
+
+@st.cache_resource
+def get_document_registry() -> DocumentRegistry:
+    return DocumentRegistry(int(DOC_REGISTRY_MAX_MB * 1024 * 1024))
+
+
+# ============================================================
+# AMÉLIORATION 24 — BACKEND D'EMBEDDINGS (PyTorch / ONNX Runtime int8)
+# Même interface encode(texts) pour tous les backends ; lots
+# dimensionnés par longueur en tokens (beaucoup de chunks courts par
+# lot, peu de longs) au lieu d'un batch_size fixe de 32
+# Parité et débit de chaque backend : benchmark.py --backends
+# ============================================================
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # torch | onnx | onnx_int8
+EMBEDDING_ONNX_QUANT = os.getenv("EMBEDDING_ONNX_QUANT", "avx2")  # arm64 | avx2 | avx512 | avx512_vnni
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "8192"))  # tokens (padding compris) par lot
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "128"))
+
+
+def token_budget_batches(lengths: list, max_tokens: int = EMBEDDING_BATCH_TOKENS,
+                         max_batch: int = EMBEDDING_MAX_BATCH) -> list:
+    """
+    Lots d'indices, textes triés du plus long au plus court : un lot grandit tant que
+    taille × plus longue séquence (= coût avec padding) tient dans max_tokens.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches, current = [], []
+    for i in order:
+        # Le premier du lot est le plus long : il fixe la longueur paddée
+        if current and ((len(current) + 1) * lengths[current[0]] > max_tokens or len(current) >= max_batch):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingBackend:
+    """Encodeur local : un SentenceTransformer chargé sur un runtime donné."""
+
+    name = "base"
+
+    def __init__(self, model):
+        self.model = model
+
+    def token_lengths(self, texts: list) -> list:
+        max_len = getattr(self.model, "max_seq_length", None) or 512
+        try:
+            ids = self.model.tokenizer(texts, truncation=True, max_length=max_len, verbose=False)["input_ids"]
+            return [len(x) for x in ids]
+        except Exception:
+            return [min(max_len, -(-len(t) // 4) + 2) for t in texts]
+
+    def encode(self, texts, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """Comme SentenceTransformer.encode ; batch_size éventuel ignoré (lots adaptatifs)."""
+        if isinstance(texts, str):
+            return self.encode([texts], **kwargs)[0]
+        texts = list(texts)
+        kwargs.pop("batch_size", None)
+        if not texts:
+            return self.model.encode(texts, show_progress_bar=False, **kwargs)
+        embeddings = None
+        for batch in token_budget_batches(self.token_lengths(texts)):
+            encoded = self.model.encode(
+                [texts[i] for i in batch], batch_size=len(batch), show_progress_bar=False,
+                convert_to_numpy=True, **kwargs
+            )
+            if embeddings is None:
+                embeddings = np.empty((len(texts), encoded.shape[1]), dtype=encoded.dtype)
+            embeddings[batch] = encoded
+        return embeddings
+
+
+class TorchEmbeddingBackend(EmbeddingBackend):
+    name = "torch"
+
+    @classmethod
+    def load(cls):
+        from sentence_transformers import SentenceTransformer
+        return cls(SentenceTransformer(EMBEDDING_MODEL_NAME))
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """
+    ONNX Runtime (sentence-transformers[onnx]). En int8, quantification dynamique
+    des poids faite une fois puis conservée dans .embedding_cache/onnx/.
+    """
+
+    name = "onnx"
+
+    @classmethod
+    def load(cls, quantize: bool = False):
+        from sentence_transformers import SentenceTransformer
+        if not quantize:
+            return cls(SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx"))
+
+        path = os.path.join(CACHE_DIR, "onnx", EMBEDDING_MODEL_NAME.replace("/", "__"))
+        suffix = f"int8_{EMBEDDING_ONNX_QUANT}"
+        file_name = f"onnx/model_{suffix}.onnx"
+        if not os.path.exists(os.path.join(path, file_name)):
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            base = SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx")
+            base.save(path)
+            export_dynamic_quantized_onnx_model(base, EMBEDDING_ONNX_QUANT, path, file_suffix=suffix)
+        backend = cls(SentenceTransformer(path, backend="onnx", model_kwargs={"file_name": file_name}))
+        backend.name = "onnx_int8"
+        return backend
+
+
+EMBEDDING_BACKENDS = {
+    "torch": TorchEmbeddingBackend.load,
+    "onnx": lambda: OnnxEmbeddingBackend.load(quantize=False),
+    "onnx_int8": lambda: OnnxEmbeddingBackend.load(quantize=True),
+}
+
+
+def create_embedding_backend(name: str) -> EmbeddingBackend:
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Backend d'embeddings inconnu : {name} ({', '.join(EMBEDDING_BACKENDS)})")
+    return EMBEDDING_BACKENDS[name]()
+
+
+def embedding_cache_name(model) -> str:
+    """
+    Nom du modèle dans les clés de cache (documents, questions) : les vecteurs ONNX
+    int8 diffèrent de ceux de PyTorch, chaque backend a ses propres entrées.
+    « none » sans modèle (BM25 seul) ; PyTorch garde le nom nu des caches existants.
+    """
+    if model is None:
+        return "none"
+    backend = getattr(model, "name", "torch")
+    return EMBEDDING_MODEL_NAME if backend == "torch" else f"{EMBEDDING_MODEL_NAME}@{backend}"
+
+
 # ============================================================
 # MODÈLES (mis en cache Streamlit)
 # ============================================================
 
 @st.cache_resource(show_spinner="Chargement du modèle d'embeddings…")
-def load_embedding_model():
+def load_embedding_model(backend: str = None):
+    backend = backend or EMBEDDING_BACKEND
+    if backend != "torch":
+        try:
+            return create_embedding_backend(backend)
+        except Exception as e:
+            # onnxruntime / optimum absents, export impossible… : PyTorch
+            st.warning(f"⚠️ Backend d'embeddings {backend} indisponible ({e}). Fallback sur PyTorch.")
+            return load_embedding_model("torch")
     try:
-        from sentence_transformers import SentenceTransformer
-        return SentenceTransformer("all-MiniLM-L6-v2")
+        return create_embedding_backend("torch")
     except ImportError:
         st.warning("⚠️ sentence-transformers non installé. Fallback sur BM25.")
         return None
@@ -149,38 +651,204 @@ def load_embedding_model():
 def load_reranker():
     try:
         from sentence_transformers import CrossEncoder
-        return CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+        return CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2", max_length=RERANK_MAX_LENGTH)
     except ImportError:
         return None
 
 
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-    return float(np.dot(a, b) / (norm_a * norm_b))
+# ============================================================
+# AMÉLIORATION 21 — CACHE D'EMBEDDINGS DE QUESTIONS + PRÉCHAUFFAGE
+# Une question déjà vue (même texte normalisé, même modèle et backend) n'est pas
+# ré-encodée ; les modèles sont chargés en parallèle et préchauffés
+# dès le démarrage, la première question ne paie plus leur chargement
+# ============================================================
+
+QUERY_EMB_CACHE_SIZE = int(os.getenv("QUERY_EMB_CACHE_SIZE", "4096"))
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+
+
+class QueryEmbeddingCache:
+    """LRU (modèle et backend, question normalisée) → embedding, partagé entre sessions."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            emb = self._entries.get(key)
+            if emb is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return emb
+
+    def put(self, key: tuple, emb: np.ndarray) -> np.ndarray:
+        emb = np.array(emb, dtype=np.float32)
+        emb.setflags(write=False)  # partagé : aucun appelant ne doit le modifier
+        with self._lock:
+            self._entries[key] = emb
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return emb
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
 
 
-def encode_chunks(chunks: list, model, file_key: str) -> list:
+@st.cache_resource
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    return QueryEmbeddingCache(QUERY_EMB_CACHE_SIZE)
+
+
+def encode_queries(model, questions: list) -> list:
     """
-    Encode les chunks avec cache persistant.
-    Si déjà calculé pour ce fichier → charge depuis le disque.
+    Embeddings des questions ; seules celles absentes du cache sont encodées, en un appel.
+    Le texte encodé est la forme normalisée (clé du cache) : all-MiniLM-L6-v2 ignore
+    la casse, le vecteur est le même.
     """
-    cached = load_cached_embeddings(file_key)
-    if cached is not None:
-        st.info("⚡ Embeddings chargés depuis le cache (aucun recalcul).")
-        return cached
+    cache = get_query_embedding_cache()
+    keys = [(embedding_cache_name(model), normalize_question(q)) for q in questions]
+    embs = [cache.get(k) for k in keys]
+    missing = list(dict.fromkeys(k for k, e in zip(keys, embs) if e is None))
+    if missing:
+        # Vecteurs de cet appel gardés à part : le LRU a pu déjà les évincer
+        encoded = model.encode([text for _, text in missing], show_progress_bar=False)
+        fresh = {key: cache.put(key, emb) for key, emb in zip(missing, encoded)}
+        embs = [e if e is not None else fresh[k] for k, e in zip(keys, embs)]
+    return embs
+
+
+def encode_query(model, question: str) -> np.ndarray:
+    return encode_queries(model, [question])[0]
+
+
+def warm_up_models(embeddings: bool = True, reranker: bool = True) -> dict:
+    """
+    Charge en parallèle modèle d'embeddings, reranker et tokenizer, puis fait une
+    inférence de chauffe sur chacun. Retourne le rapport de démarrage (temps par modèle).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def timed(load, warm):
+        start = time.perf_counter()
+        try:
+            obj = load()
+            loaded = time.perf_counter()
+            if obj is not None:
+                warm(obj)
+        except Exception as e:
+            return {"loaded": False, "error": str(e), "load_s": round(time.perf_counter() - start, 3)}
+        return {
+            "loaded": obj is not None,
+            "load_s": round(loaded - start, 3),
+            "warmup_s": round(time.perf_counter() - loaded, 3),
+        }
 
+    jobs = {"tokenizer": (load_tokenizer, lambda t: count_tokens(["Préchauffage du tokenizer."]))}
+    if embeddings:
+        jobs["embeddings"] = (load_embedding_model, lambda m: m.encode(["Préchauffage du modèle."]))
+    if reranker:
+        jobs["reranker"] = (load_reranker, lambda r: r.predict([("Préchauffage ?", "Passage de chauffe.")]))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="warmup") as pool:
+        futures = {name: pool.submit(timed, *job) for name, job in jobs.items()}
+        models = {name: f.result() for name, f in futures.items()}
+    return {"total_s": round(time.perf_counter() - start, 3), "models": models}
+
+
+@st.cache_resource
+def start_model_warm_up() -> dict:
+    """
+    Préchauffage lancé une fois par processus, en arrière-plan : la première page
+    s'affiche sans attendre, et une question posée entre-temps attend le chargement
+    en cours (verrou de st.cache_resource) au lieu de le refaire.
+    """
+    report = {"status": "running"}
+
+    def run():
+        report.update(warm_up_models())
+        report["status"] = "done"
+
+    threading.Thread(target=run, name="model-warmup", daemon=True).start()
+    return report
+
+
+def format_startup_report(report: dict) -> str:
+    if report.get("status") != "done":
+        return "🚀 Démarrage : préchauffage des modèles en cours…"
+    parts = [
+        f"{name} {m['load_s'] + m.get('warmup_s', 0):.1f}s" + ("" if m["loaded"] else " ⚠️")
+        for name, m in report["models"].items()
+    ]
+    return f"🚀 Démarrage : modèles prêts en {report['total_s']:.1f}s ({' • '.join(parts)})"
+
+
+ENCODE_PROGRESS_STEP = 256  # chunks encodés entre deux mises à jour de progression
+
+def encode_chunks(chunks: list, model, progress_callback=None) -> list:
+    """
+    Encode les chunks (le cache est géré au niveau du document, cf. ingest_pdf).
+    Avec progress_callback(faits, total), l'encodage avance par tranches de ENCODE_PROGRESS_STEP.
+    Taille des lots : cf. EmbeddingBackend.encode (selon la longueur en tokens).
+    """
     texts = [c["text"] for c in chunks]
-    embeddings = model.encode(texts, batch_size=32, show_progress_bar=False)
+    if progress_callback is None:
+        embeddings = model.encode(texts, show_progress_bar=False)
+    else:
+        embeddings = []
+        for start in range(0, len(texts), ENCODE_PROGRESS_STEP):
+            embeddings.extend(model.encode(texts[start:start + ENCODE_PROGRESS_STEP], show_progress_bar=False))
+            progress_callback(min(start + ENCODE_PROGRESS_STEP, len(texts)), len(texts))
     for chunk, emb in zip(chunks, embeddings):
         chunk["embedding"] = emb
-
-    save_cached_embeddings(file_key, chunks)
     return chunks
 
 
+# ============================================================
+# AMÉLIORATION 10 — MATRICE D'EMBEDDINGS CONTIGUË (pré-normalisée)
+# Scoring sémantique = un seul produit matrice-vecteur + argpartition
+# au lieu d'un cosine_similarity Python par chunk
+# ============================================================
+
+def build_embedding_matrix(chunks: list):
+    """Matrice float32 contiguë, lignes normalisées L2 (None si pas d'embeddings)."""
+    if isinstance(chunks, ChunkStore):
+        return chunks.embeddings
+    if not chunks or not all("embedding" in c for c in chunks):
+        return None
+    matrix = np.ascontiguousarray(np.stack([c["embedding"] for c in chunks]), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def semantic_top_k(emb_matrix: np.ndarray, query_emb: np.ndarray, top_k: int,
+                   allowed: np.ndarray = None) -> list:
+    """Indices des top_k chunks par similarité cosinus, triés par score décroissant."""
+    query = np.asarray(query_emb, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return []
+    scores = emb_matrix @ (query / norm)
+    if allowed is not None:
+        scores[~allowed] = -np.inf
+        top_k = min(top_k, int(allowed.sum()))
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return []
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    return top[np.argsort(-scores[top], kind="stable")].tolist()
+
+
 # ============================================================
 # AMÉLIORATION 3 — SEMANTIC CHUNKING
 # Découpe par paragraphes/sections au lieu d'une taille fixe
@@ -241,15 +909,564 @@ def split_into_chunks(pages_text: dict, chunk_size: int = 2000, overlap: int = 2
 
 
 # ============================================================
-# BM25 SIMPLIFIÉ (conservé pour hybrid search)
+# AMÉLIORATION 25 — DÉDOUBLONNAGE À L'INGESTION
+# En-têtes / pieds de page répétés retirés à l'extraction ; chunks
+# quasi identiques (avertissements, mentions légales…) repérés par
+# MinHash + LSH avant l'encodage. Le chunk gardé hérite des pages
+# de ses doublons : chaque page reste citée comme source
 # ============================================================
 
-def bm25_score(chunk: dict, question: str) -> float:
-    q_words = set(re.findall(r'\b\w{3,}\b', question.lower()))
-    c_words = set(re.findall(r'\b\w{3,}\b', chunk["text"].lower()))
-    if not q_words:
+MARGIN_LINES = 2          # lignes non vides examinées en haut et en bas de chaque page
+MARGIN_MIN_PAGES = 3      # en dessous, pas de détection
+MARGIN_MIN_RATIO = 0.5    # part des pages où la ligne doit revenir
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16        # 16 bandes × 4 lignes : paire candidate à 99 % dès 0.75 de similarité
+MINHASH_SHINGLE = 3       # mots par shingle
+_MINHASH_PRIME = (1 << 31) - 1  # premier de Mersenne ; hash, a et b < 2^31 : (a·x + b) < 2^63 tient dans un uint64
+
+
+def margin_key(line: str) -> str:
+    """Forme normalisée d'une ligne de marge : « Page 3 / 12 » et « Page 4 / 12 » coïncident."""
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+
+def strip_page_margins(pages_text: dict) -> tuple:
+    """
+    Retire les lignes des MARGIN_LINES premières et dernières lignes de chaque page qui
+    reviennent (à la numérotation près) sur au moins MARGIN_MIN_RATIO des pages.
+    Retourne (pages_text, lignes retirées) ; une page vidée disparaît comme une page sans texte.
+    """
+    if len(pages_text) < MARGIN_MIN_PAGES:
+        return pages_text, 0
+
+    def margins(lines):
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        return {"top": filled[:MARGIN_LINES], "bottom": filled[-MARGIN_LINES:]}
+
+    page_lines = {p: text.split("\n") for p, text in pages_text.items()}
+    counts = Counter()
+    for lines in page_lines.values():
+        for side, idx in margins(lines).items():
+            counts.update({(side, margin_key(lines[i])) for i in idx})
+    min_pages = max(MARGIN_MIN_PAGES, MARGIN_MIN_RATIO * len(pages_text))
+    repeated = {key for key, n in counts.items() if n >= min_pages}
+    if not repeated:
+        return pages_text, 0
+
+    stripped, removed = {}, 0
+    for p, lines in page_lines.items():
+        drop = {i for side, idx in margins(lines).items() for i in idx if (side, margin_key(lines[i])) in repeated}
+        removed += len(drop)
+        text = "\n".join(line for i, line in enumerate(lines) if i not in drop).strip()
+        if text:
+            stripped[p] = text
+    return stripped, removed
+
+
+def minhash_signatures(texts: list) -> tuple:
+    """
+    Signatures MinHash (n, MINHASH_PERMUTATIONS) des shingles de mots, déterministes
+    d'un processus à l'autre (crc32, graine fixe). Retourne (signatures, valides) ;
+    un texte sans mot n'est pas valide (jamais dédoublonné).
+    """
+    rng = np.random.default_rng(0)
+    a = rng.integers(1, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    signatures = np.full((len(texts), MINHASH_PERMUTATIONS), np.iinfo(np.uint64).max, dtype=np.uint64)
+    valid = np.zeros(len(texts), dtype=bool)
+    for i, text in enumerate(texts):
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            continue
+        grams = {" ".join(words[j:j + MINHASH_SHINGLE]) for j in range(max(1, len(words) - MINHASH_SHINGLE + 1))}
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) & _MINHASH_PRIME for g in grams), dtype=np.uint64, count=len(grams))
+        signatures[i] = ((np.outer(hashes, a) + b) % _MINHASH_PRIME).min(axis=0)
+        valid[i] = True
+    return signatures, valid
+
+
+def numeric_tokens(text: str) -> tuple:
+    """Nombres du texte, dans l'ordre : « 12 millions » et « 47 millions » diffèrent."""
+    return tuple(re.findall(r"\d+(?:[.,]\d+)*", text))
+
+
+def dedup_chunks(chunks: list, threshold: float = CHUNK_DEDUP_THRESHOLD) -> tuple:
+    """
+    Retire les chunks répétitifs (avertissements, mentions légales…) : similarité MinHash
+    (Jaccard estimé) avec un chunk gardé au moins égale à threshold, mêmes nombres dans
+    le même ordre, et soit texte identique (à la casse et aux espaces près), soit groupe
+    répété sur au moins MARGIN_MIN_PAGES pages. Deux paragraphes qui ne diffèrent que par
+    un chiffre ne sont jamais fusionnés.
+    Paires candidates par LSH (MINHASH_BANDS bandes), puis vérifiées sur la signature
+    complète. Les chunks ayant déjà un embedding (réingestion) sont gardés en priorité ;
+    sinon le premier dans l'ordre du document.
+    Le chunk gardé garde sa page en tête (cf. chunk_first_pages) suivie de celles de ses doublons.
+    Retourne (chunks, {"chunks_before", "chunks", "duplicates", "embeddings_saved"}).
+    """
+    stats = {"chunks_before": len(chunks), "chunks": len(chunks), "duplicates": 0, "embeddings_saved": 0}
+    if threshold <= 0 or len(chunks) < 2:
+        return chunks, stats
+
+    signatures, valid = minhash_signatures([c["text"] for c in chunks])
+    numbers = [numeric_tokens(c["text"]) for c in chunks]
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    buckets = {}
+    duplicate_of = {}
+    for i in sorted(range(len(chunks)), key=lambda i: "embedding" not in chunks[i]):
+        if not valid[i]:
+            continue
+        keys = [(band, signatures[i, band * rows:(band + 1) * rows].tobytes()) for band in range(MINHASH_BANDS)]
+        candidates = {j for key in keys for j in buckets.get(key, ()) if numbers[j] == numbers[i]}
+        if candidates:
+            best = max(candidates, key=lambda j: (np.mean(signatures[i] == signatures[j]), -j))
+            if np.mean(signatures[i] == signatures[best]) >= threshold:
+                duplicate_of[i] = best
+                continue
+        for key in keys:
+            buckets.setdefault(key, []).append(i)
+
+    # Quasi-doublon sur trop peu de pages : contenu propre au document, gardé tel quel
+    members = {}
+    for i, kept in duplicate_of.items():
+        members.setdefault(kept, []).append(i)
+    for kept, group in members.items():
+        if len({chunks[j]["pages"][0] for j in [kept] + group}) >= MARGIN_MIN_PAGES:
+            continue
+        for i in group:
+            if margin_key(chunks[i]["text"]) != margin_key(chunks[kept]["text"]):
+                del duplicate_of[i]
+
+    extra_pages = {}
+    for i, kept in duplicate_of.items():
+        extra_pages.setdefault(kept, set()).update(chunks[i]["pages"])
+    result = []
+    for i, chunk in enumerate(chunks):
+        if i in duplicate_of:
+            continue
+        if i in extra_pages:
+            home = chunk["pages"][0]
+            chunk = dict(chunk, pages=[home] + sorted((set(chunk["pages"][1:]) | extra_pages[i]) - {home}))
+        result.append(chunk)
+
+    stats["chunks"] = len(result)
+    stats["duplicates"] = len(duplicate_of)
+    stats["embeddings_saved"] = sum(1 for i in duplicate_of if "embedding" not in chunks[i])
+    return result, stats
+
+
+def ingest_pdf(pdf_bytes: bytes, doc_key: str, emb_model=None, progress_callback=None,
+               on_readable=None, previous_key: str = None) -> tuple:
+    """
+    Pipeline d'ingestion complet avec cache adressé par contenu.
+    Retourne (doc, from_cache) ; doc = None si le PDF est illisible.
+    progress_callback(étape, faits, total) avec étape = "extraction" ou "encoding".
+    on_readable(doc) reçoit le document sans embeddings (pages, chunks, BM25) avant
+    l'encodage, pour le rendre consultable pendant que les vecteurs se calculent.
+    previous_key : version précédente du document ; ses pages inchangées sont reprises
+    telles quelles (chunks + embeddings), seules les pages modifiées sont recalculées.
+    """
+    cached = load_cached_document(doc_key)
+    if cached is not None:
+        return cached, True
+
+    def report(stage):
+        if progress_callback is None:
+            return None
+        return lambda done, total: progress_callback(stage, done, total)
+
+    extract_stats = {}
+    with span("extraction"):
+        pages_text = extract_pdf_data(
+            BytesIO(pdf_bytes), progress_callback=report("extraction"), stats=extract_stats
+        )
+    if not pages_text:
+        return None, False
+
+    previous = load_cached_document(previous_key) if previous_key else None
+    if previous is not None and (previous["embeddings"] is not None) != bool(emb_model):
+        previous = None  # embeddings absents d'un côté : rien de réutilisable
+    if previous is not None and page_overlap(previous["page_hashes"], page_hashes(pages_text)) < REVISION_MIN_OVERLAP:
+        previous = None  # trop peu de pages communes : pas une révision, rien n'est repris
+    revision = None
+    with span("chunking", incremental=previous is not None):
+        if previous is None:
+            chunks = semantic_chunk(pages_text, max_chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+        else:
+            chunks, revision = reuse_unchanged_pages(pages_text, previous)
+            revision["previous"] = previous_key
+    with span("dedup", chunks=len(chunks)) as sp:
+        chunks, dedup = dedup_chunks(chunks)
+        dedup["margin_lines"] = extract_stats.get("margin_lines", 0)
+        if sp is not None:
+            sp.attributes.update(duplicates=dedup["duplicates"], margin_lines=dedup["margin_lines"])
+    if revision is not None:
+        # Après dédoublonnage : chunks réellement à encoder
+        revision["new_chunks"] = sum(1 for c in chunks if "embedding" not in c)
+        revision["reused_chunks"] = len(chunks) - revision["new_chunks"]
+    with span("bm25_build"):
+        bm25 = build_bm25_index(chunks)
+    with span("analytics"):
+        analytics = compute_document_analytics(pages_text)
+    doc = {
+        "pages_text": PageStore.from_pages(pages_text),
+        "chunks": chunks,
+        "bm25": bm25,
+        "analytics": analytics,
+        "dedup": dedup,
+        "embeddings": None,
+    }
+    if on_readable:
+        on_readable(dict(doc))
+
+    if emb_model:
+        # En réingestion, seuls les chunks des pages modifiées n'ont pas encore d'embedding
+        pending = [c for c in chunks if "embedding" not in c]
+        with span("encoding", chunks=len(pending)):
+            encode_chunks(pending, emb_model, progress_callback=report("encoding"))
+        doc["embeddings"] = build_embedding_matrix(chunks)
+    with span("cache_write"):
+        save_cached_document(doc_key, doc)
+    # Relu depuis le disque : la session partage les pages mmap du cache
+    doc = load_cached_document(doc_key) or doc
+    if revision is not None:
+        doc["revision"] = revision
+    return doc, False
+
+
+# ============================================================
+# AMÉLIORATION 19 — RÉINGESTION INCRÉMENTALE (empreintes par page)
+# Une nouvelle version d'un document ne recalcule que ses pages
+# modifiées : le texte d'un chunk vient toujours d'une seule page
+# (la première de sa liste), ceux des pages inchangées sont repris
+# avec leurs embeddings
+# ============================================================
+
+# Part minimale de pages identiques pour traiter un PDF comme une révision
+REVISION_MIN_OVERLAP = float(os.getenv("REVISION_MIN_OVERLAP", "0.5"))
+
+def page_hashes(pages_text: dict) -> dict:
+    """Empreinte blake2b du texte de chaque page (stockée avec le cache document)."""
+    return {p: hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest() for p, text in pages_text.items()}
+
+
+def changed_pages(old_hashes: dict, new_hashes: dict) -> set:
+    """Pages ajoutées, supprimées ou dont le texte a changé."""
+    return {p for p in old_hashes.keys() | new_hashes.keys() if old_hashes.get(p) != new_hashes.get(p)}
+
+
+def page_overlap(old_hashes: dict, new_hashes: dict) -> float:
+    """Part des pages identiques entre deux versions (0 = aucune, 1 = document inchangé)."""
+    pages = old_hashes.keys() | new_hashes.keys()
+    if not pages:
         return 0.0
-    return len(q_words & c_words) / len(q_words)
+    return 1.0 - len(changed_pages(old_hashes, new_hashes)) / len(pages)
+
+
+def chunk_first_pages(chunks) -> np.ndarray:
+    """Page de chaque chunk (un chunk = une page, cf. semantic_chunk)."""
+    if isinstance(chunks, ChunkStore):
+        return np.asarray(chunks.pages_flat[chunks.page_offsets[:-1]])
+    return np.array([c["pages"][0] for c in chunks], dtype=np.int32)
+
+
+def linked_pages(chunks, pages: set) -> set:
+    """
+    pages + celles qui partagent un chunk dédoublonné avec elles (cf. dedup_chunks),
+    de proche en proche : une page modifiée entraîne les pages dont le doublon
+    avait été retiré à son profit, et inversement.
+    """
+    if isinstance(chunks, ChunkStore):
+        counts = np.diff(chunks.page_offsets)
+        shared = [set(chunks.pages(int(i))) for i in np.flatnonzero(counts > 1)]
+    else:
+        shared = [set(c["pages"]) for c in chunks if len(c["pages"]) > 1]
+    linked = set(pages)
+    grown = True
+    while grown:
+        grown = False
+        for group in shared:
+            if group & linked and not group <= linked:
+                linked |= group
+                grown = True
+    return linked
+
+
+def reuse_unchanged_pages(pages_text: dict, previous: dict) -> tuple:
+    """
+    Chunks de la nouvelle version : ceux des pages inchangées sont copiés depuis
+    previous (avec leur embedding), ceux des pages modifiées re-découpés. Les pages
+    liées par un doublon (cf. linked_pages) sont re-découpées avec elles ; un chunk
+    re-découpé au texte inchangé reprend l'embedding de l'ancienne version.
+    Retourne (chunks, {"changed_pages", "reused_chunks", "new_chunks"}).
+    """
+    changed = changed_pages(previous["page_hashes"], page_hashes(pages_text))
+    old_chunks = previous["chunks"]
+    old_embeddings = previous["embeddings"]
+    old_pages = chunk_first_pages(old_chunks)
+    relinked = linked_pages(old_chunks, changed)
+    old_rows_by_text = {}
+    if old_embeddings is not None:
+        for i in np.flatnonzero(np.isin(old_pages, sorted(relinked))):
+            old_rows_by_text[old_chunks[int(i)]["text"]] = int(i)
+
+    chunks, reused = [], 0
+    for page, text in sorted(pages_text.items()):
+        if page in relinked:
+            for chunk in semantic_chunk({page: text}, max_chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+                row = old_rows_by_text.get(chunk["text"])
+                if row is not None:
+                    chunk["embedding"] = np.asarray(old_embeddings[row])
+                    reused += 1
+                chunks.append(chunk)
+            continue
+        for i in np.flatnonzero(old_pages == page):
+            chunk = dict(old_chunks[int(i)])
+            if old_embeddings is not None:
+                chunk["embedding"] = np.asarray(old_embeddings[i])
+            chunks.append(chunk)
+            reused += 1
+    return chunks, {
+        "changed_pages": sorted(changed),
+        "reused_chunks": reused,
+        "new_chunks": len(chunks) - reused,
+    }
+
+
+# ============================================================
+# AMÉLIORATION 22 — ANALYSE PRÉCALCULÉE À L'INGESTION
+# Mots, mots-clés, termes par page et expressions clés TF-IDF sont
+# calculés une fois et stockés avec le cache document ; l'onglet
+# Analyse ne fait plus que les lire
+# ============================================================
+
+STOP_WORDS = {
+    "les", "des", "une", "que", "qui", "dans", "pour", "avec", "sur",
+    "par", "est", "sont", "this", "that", "from", "have", "been",
+    "will", "leur", "leurs", "mais", "donc", "comme", "plus", "aussi",
+    "tout", "tous", "très", "bien", "être", "avoir", "faire",
+    # Mots courts, écartés des bords des expressions clés
+    "le", "la", "de", "du", "et", "en", "un", "au", "aux", "ce", "ces", "se", "sa", "son", "ses",
+    "il", "elle", "ils", "on", "ne", "pas", "ou", "où", "à", "the", "and", "for", "with", "of",
+    "to", "in", "is", "are", "on", "by", "an", "as", "at", "or", "it",
+}
+ANALYTICS_TOP_KEYWORDS = 30
+ANALYTICS_TERMS_PER_PAGE = 15
+ANALYTICS_KEY_PHRASES = 15
+
+
+def is_keyword(word: str) -> bool:
+    return len(word) > 3 and word not in STOP_WORDS
+
+
+def page_phrases(words: list) -> Counter:
+    """Expressions de 2 à 3 mots sans mot vide ni nombre."""
+    phrases = Counter()
+    for n in (2, 3):
+        for i in range(len(words) - n + 1):
+            gram = words[i:i + n]
+            if all(len(w) > 2 and w not in STOP_WORDS and not w.isdigit() for w in gram):
+                phrases[" ".join(gram)] += 1
+    return phrases
+
+
+def compute_document_analytics(pages_text: dict) -> dict:
+    """
+    Statistiques de l'onglet Analyse, en un seul passage sur les pages :
+      - words / keywords : nombre de mots et mots-clés les plus fréquents
+      - page_terms       : termes les plus fréquents de chaque page
+      - key_phrases      : expressions de 2–3 mots classées par TF-IDF (une page = un document)
+    """
+    keywords = Counter()
+    phrase_tf = Counter()
+    phrase_df = Counter()
+    page_terms = {}
+    n_words = 0
+    for page, text in sorted(pages_text.items()):
+        words = re.findall(r'\b\w+\b', text.lower())
+        n_words += len(words)
+        counts = Counter(w for w in words if is_keyword(w))
+        keywords.update(counts)
+        page_terms[str(page)] = counts.most_common(ANALYTICS_TERMS_PER_PAGE)
+        phrases = page_phrases(words)
+        phrase_tf.update(phrases)
+        phrase_df.update(phrases.keys())
+
+    # TF-IDF : fréquentes dans le document, concentrées sur peu de pages
+    n_pages = max(1, len(pages_text))
+    scored = sorted(
+        ((tf * np.log(1 + n_pages / phrase_df[p]), p) for p, tf in phrase_tf.items() if tf >= 2),
+        reverse=True,
+    )
+    key_phrases = []
+    for score, phrase in scored:
+        # Une expression incluse dans une autre déjà retenue (ou l'inverse) est redondante
+        if any(phrase in kept or kept in phrase for kept, _ in key_phrases):
+            continue
+        key_phrases.append((phrase, round(float(score), 2)))
+        if len(key_phrases) == ANALYTICS_KEY_PHRASES:
+            break
+
+    return {
+        "words": n_words,
+        "keywords": keywords.most_common(ANALYTICS_TOP_KEYWORDS),
+        "page_terms": page_terms,
+        "key_phrases": key_phrases,
+    }
+
+
+# ============================================================
+# AMÉLIORATION 9 — INDEX BM25 INVERSÉ (construit à l'ingestion)
+# Vocabulaire, postings, df et longueurs calculés une seule fois ;
+# une question ne parcourt que les postings de ses propres termes
+# ============================================================
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list:
+    return re.findall(r'\b\w{3,}\b', text.lower())
+
+
+def build_bm25_index(chunks: list) -> dict:
+    """
+    Index inversé BM25 :
+      - vocab    : terme → id
+      - postings : par terme, (ids de chunks, fréquences) en tableaux numpy
+      - idf      : IDF BM25 par terme (dérivé des df)
+      - doc_len  : longueur (en tokens) de chaque chunk
+    """
+    vocab = {}
+    raw_postings = []
+    doc_len = np.zeros(len(chunks), dtype=np.float32)
+
+    for i, c in enumerate(chunks):
+        tokens = tokenize(c["text"])
+        doc_len[i] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            term_id = vocab.setdefault(term, len(vocab))
+            if term_id == len(raw_postings):
+                raw_postings.append(([], []))
+            raw_postings[term_id][0].append(i)
+            raw_postings[term_id][1].append(tf)
+
+    postings = [
+        (np.array(ids, dtype=np.int32), np.array(tfs, dtype=np.float32))
+        for ids, tfs in raw_postings
+    ]
+    n_docs = len(chunks)
+    df = np.array([len(ids) for ids, _ in postings], dtype=np.float32)
+    idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+    return {
+        "vocab": vocab,
+        "postings": postings,
+        "df": df,
+        "idf": idf,
+        "doc_len": doc_len,
+        "avgdl": float(doc_len.mean()) if n_docs else 0.0,
+        "n_docs": n_docs,
+    }
+
+
+class SegmentedBM25:
+    """
+    Index BM25 du corpus : un segment par document (son index du cache, partagé tel quel),
+    id global = offset du segment + id local. df, nombre de chunks vivants et longueur totale
+    sont tenus à jour à chaque ajout et à chaque tombstone (cf. remove), en temps proportionnel
+    aux seuls chunks concernés ; les scores sont ceux d'un index unique construit sur les
+    chunks vivants du corpus.
+    """
+
+    def __init__(self):
+        self.segments = []  # (offset, index) dans l'ordre des ids globaux
+        self.df = Counter()
+        self.n_docs = 0     # ids globaux attribués, tombstones compris
+        self.n_live = 0
+        self.total_len = 0.0
+
+    def add(self, index: dict):
+        for term, term_id in index["vocab"].items():
+            self.df[term] += len(index["postings"][term_id][0])
+        self.total_len += float(index["doc_len"].sum())
+        self.n_live += index["n_docs"]
+        self.segments.append((self.n_docs, index))
+        self.n_docs += index["n_docs"]
+
+    def remove(self, texts: list):
+        """Retire des statistiques les chunks devenus tombstones (leurs postings restent, masqués)."""
+        for text in texts:
+            tokens = tokenize(text)
+            self.df.subtract(set(tokens))
+            self.total_len -= len(tokens)
+        self.n_live -= len(texts)
+        self.df = +self.df  # termes qui n'apparaissent plus que dans des tombstones
+
+    def search(self, question: str, top_k: int = None, allowed: np.ndarray = None) -> list:
+        terms = {t for t in tokenize(question) if self.df.get(t)}
+        if not terms:
+            return []
+        n_docs = self.n_live
+        avgdl = self.total_len / n_docs if n_docs else 1.0
+        idf = {t: np.log(1.0 + (n_docs - self.df[t] + 0.5) / (self.df[t] + 0.5)) for t in terms}
+
+        ids_parts, score_parts = [], []
+        for offset, index in list(self.segments):
+            if allowed is not None and offset >= len(allowed):
+                continue  # segment ajouté après le calcul du masque
+            for term in terms:
+                term_id = index["vocab"].get(term)
+                if term_id is None:
+                    continue
+                ids, tfs = index["postings"][term_id]
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * index["doc_len"][ids] / (avgdl or 1.0))
+                score_parts.append(idf[term] * tfs * (BM25_K1 + 1.0) / (tfs + norm))
+                ids_parts.append(ids + offset)
+        if not ids_parts:
+            return []
+        return rank_bm25_scores(np.concatenate(ids_parts), np.concatenate(score_parts), top_k, allowed)
+
+
+def bm25_search(index: dict, question: str, top_k: int = None, allowed: np.ndarray = None) -> list:
+    """
+    Retourne [(score, idx_chunk)] triés par score décroissant.
+    Seuls les chunks contenant au moins un terme de la question sont scorés.
+    allowed : masque booléen des chunks autorisés (filtre par document du corpus).
+    """
+    if isinstance(index, SegmentedBM25):
+        return index.search(question, top_k, allowed)
+    vocab = index["vocab"]
+    term_ids = {vocab[t] for t in tokenize(question) if t in vocab}
+    if not term_ids:
+        return []
+
+    doc_len = index["doc_len"]
+    avgdl = index["avgdl"] or 1.0
+    ids_parts, score_parts = [], []
+    for term_id in term_ids:
+        ids, tfs = index["postings"][term_id]
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[ids] / avgdl)
+        score_parts.append(index["idf"][term_id] * tfs * (BM25_K1 + 1.0) / (tfs + norm))
+        ids_parts.append(ids)
+    return rank_bm25_scores(np.concatenate(ids_parts), np.concatenate(score_parts), top_k, allowed)
+
+
+def rank_bm25_scores(ids: np.ndarray, term_scores: np.ndarray, top_k: int = None,
+                     allowed: np.ndarray = None) -> list:
+    """Somme des scores par chunk (seuls les postings touchés), filtre allowed, puis top_k trié."""
+    matched, inverse = np.unique(ids, return_inverse=True)
+    scores = np.zeros(len(matched), dtype=np.float32)
+    np.add.at(scores, inverse, term_scores)
+    if allowed is not None:
+        keep = allowed[matched]
+        matched, scores = matched[keep], scores[keep]
+
+    if top_k is not None and top_k < len(scores):
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(float(scores[j]), int(matched[j])) for j in top]
 
 
 # ============================================================
@@ -260,24 +1477,33 @@ def rrf_score(rank: int, k: int = 60) -> float:
     return 1.0 / (k + rank + 1)
 
 
-def retrieve_hybrid(chunks: list, question: str, top_k: int = 4, model=None) -> tuple:
-    n = len(chunks)
+def retrieve_hybrid(chunks: list, question: str, top_k: int = 4, model=None, bm25_index: dict = None,
+                    emb_matrix: np.ndarray = None, query_emb: np.ndarray = None, with_scores: bool = False,
+                    allowed: np.ndarray = None) -> tuple:
+    """
+    (context, source_pages, selected) ; avec with_scores=True, ajoute les scores RRF
+    fusionnés alignés sur selected (utilisés par le early exit du reranking).
+    """
+    if bm25_index is None:
+        bm25_index = build_bm25_index(chunks)
+    if emb_matrix is None and model is not None:
+        emb_matrix = build_embedding_matrix(chunks)
 
-    # Classement BM25
-    bm25_scores = [(bm25_score(c, question), i) for i, c in enumerate(chunks)]
-    bm25_ranked = [i for _, i in sorted(bm25_scores, key=lambda x: -x[0])]
+    # Classement BM25 (index inversé : uniquement les chunks contenant un terme)
+    with span("bm25_search"):
+        bm25_ranked = [i for _, i in bm25_search(bm25_index, question, allowed=allowed)]
 
     # Classement sémantique
     # AMÉLIORATION 5 — fix cohérence : encode([question])[0] au lieu de encode(question)
-    if model is not None and all("embedding" in c for c in chunks):
-        query_emb = model.encode([question])[0]  # ← fix recommandé
-        sem_scores = [
-            (cosine_similarity(query_emb, c["embedding"]), i)
-            for i, c in enumerate(chunks)
-        ]
-        sem_ranked = [i for _, i in sorted(sem_scores, key=lambda x: -x[0])]
+    if model is not None and emb_matrix is not None and len(emb_matrix) == len(chunks):
+        if query_emb is None:
+            with span("query_encoding"):
+                query_emb = encode_query(model, question)
+        # Seuls les premiers rangs pèsent dans la RRF : pool de candidats borné
+        with span("semantic_search", chunks=len(chunks)):
+            sem_ranked = semantic_top_k(emb_matrix, query_emb, max(top_k * 10, 100), allowed)
     else:
-        sem_ranked = bm25_ranked  # fallback BM25
+        sem_ranked = []  # fallback BM25 seul (même classement, un seul retriever compté)
 
     # Fusion RRF
     rrf = {}
@@ -294,203 +1520,1775 @@ def retrieve_hybrid(chunks: list, question: str, top_k: int = 4, model=None) ->
     selected = [chunks[i] for i, _ in top_indices]
     context = "\n\n---\n\n".join(c["text"] for c in selected)
 
-    all_pages = []
-    for c in selected:
-        all_pages.extend(c["pages"])
-    source_pages = sorted(set(all_pages))
+    all_pages = []
+    for c in selected:
+        all_pages.extend(c["pages"])
+    source_pages = sorted(set(all_pages))
+
+    if with_scores:
+        return context, source_pages, selected, [score for _, score in top_indices]
+    return context, source_pages, selected
+
+
+# ============================================================
+# AMÉLIORATION 15 — RERANKING : CACHE DE SCORES + EARLY EXIT
+# Scores (question, chunk) mis en cache par document, predict par lots
+# avec longueur de séquence plafonnée, cross-encoder évité quand
+# BM25 et recherche sémantique désignent déjà le même meilleur chunk
+# ============================================================
+
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))      # ≥ top_k max : un seul forward
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))     # tokens (question + chunk)
+RERANK_EARLY_EXIT = os.getenv("RERANK_EARLY_EXIT", "1") == "1"
+RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "5000"))  # questions × documents
+
+
+class RerankScoreCache:
+    """
+    Scores du cross-encoder par (document, question normalisée) → {hash du chunk: score}.
+    Éviction LRU sur les couples (document, question) ; partagé entre les sessions.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.early_exits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def chunk_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+    def get(self, doc_key: str, question: str, chunk_keys: list) -> list:
+        """Score en cache (ou None) pour chaque chunk."""
+        key = (doc_key, normalize_question(question))
+        with self._lock:
+            scores = self._entries.get(key)
+            if scores is None:
+                found = [None] * len(chunk_keys)
+            else:
+                self._entries.move_to_end(key)
+                found = [scores.get(k) for k in chunk_keys]
+            hits = sum(f is not None for f in found)
+            self.hits += hits
+            self.misses += len(found) - hits
+            return found
+
+    def put(self, doc_key: str, question: str, new_scores: dict):
+        key = (doc_key, normalize_question(question))
+        with self._lock:
+            self._entries.setdefault(key, {}).update(new_scores)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_early_exit(self):
+        with self._lock:
+            self.early_exits += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "early_exits": self.early_exits}
+
+
+@st.cache_resource
+def get_rerank_cache() -> RerankScoreCache:
+    return RerankScoreCache(RERANK_CACHE_MAX_ENTRIES)
+
+
+def has_clear_winner(fused_scores: list) -> bool:
+    """Score RRF maximal : le même chunk est 1er en sémantique ET en BM25."""
+    return bool(fused_scores) and max(fused_scores) >= 2 * rrf_score(0)
+
+
+def rerank_chunks(chunks_selected: list, question: str, reranker, top_k: int = 3,
+                  fused_scores: list = None, doc_key: str = "") -> list:
+    """
+    Reranking cross-encoder des candidats.
+    - fused_scores (scores RRF alignés sur chunks_selected) : early exit si gagnant net,
+      les candidats sont alors ordonnés par score fusionné
+    - doc_key : active le cache de scores du document
+    """
+    if reranker is None or not chunks_selected:
+        return chunks_selected
+
+    cache = get_rerank_cache()
+    if RERANK_EARLY_EXIT and fused_scores is not None and has_clear_winner(fused_scores):
+        cache.record_early_exit()
+        order = sorted(range(len(chunks_selected)), key=lambda i: -fused_scores[i])
+        return [chunks_selected[i] for i in order[:top_k]]
+
+    keys = [RerankScoreCache.chunk_key(c["text"]) for c in chunks_selected]
+    scores = cache.get(doc_key, question, keys) if doc_key else [None] * len(keys)
+    missing = [i for i, sc in enumerate(scores) if sc is None]
+    if missing:
+        pairs = [(question, chunks_selected[i]["text"]) for i in missing]
+        predicted = reranker.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+        for i, sc in zip(missing, predicted):
+            scores[i] = float(sc)
+        if doc_key:
+            cache.put(doc_key, question, {keys[i]: scores[i] for i in missing})
+
+    reranked = sorted(zip(scores, chunks_selected), key=lambda x: -x[0])
+    return [c for _, c in reranked[:top_k]]
+
+
+# ============================================================
+# AMÉLIORATION 4 — VECTOR DB FAISS (persistante + scalable)
+# Remplace la recherche linéaire en mémoire
+# ============================================================
+
+FAISS_INDEX_PATH = os.path.join(CACHE_DIR, "faiss_index.pkl")
+
+
+# ============================================================
+# AMÉLIORATION 16 — TYPE D'INDEX FAISS SELON LA TAILLE DU CORPUS
+# Flat (exact) pour les petits corpus, HNSW pour les moyens,
+# IVF + int8 (SQ8, 4× plus compact) pour les grands ; IVF-PQ (~30×)
+# sur demande seulement, son recall étant nettement plus faible.
+# Paramètres persistés à côté de l'index (recall : benchmark.py --faiss-report)
+# ============================================================
+
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "auto")  # auto | flat | sq8 | hnsw | ivf | ivf_sq8 | ivf_pq
+FAISS_FLAT_MAX_VECTORS = int(os.getenv("FAISS_FLAT_MAX_VECTORS", "20000"))
+FAISS_HNSW_MAX_VECTORS = int(os.getenv("FAISS_HNSW_MAX_VECTORS", "200000"))
+FAISS_TRAIN_MAX_VECTORS = 65536   # échantillon d'entraînement IVF / PQ / SQ
+FAISS_HNSW_M = 32
+FAISS_HNSW_EF_CONSTRUCTION = 80
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+
+
+def choose_faiss_index_type(n_vectors: int, index_type: str = None) -> str:
+    kind = (index_type or FAISS_INDEX_TYPE).lower()
+    if kind != "auto":
+        return kind
+    if n_vectors <= FAISS_FLAT_MAX_VECTORS:
+        return "flat"
+    if n_vectors <= FAISS_HNSW_MAX_VECTORS:
+        return "hnsw"
+    return "ivf_sq8"
+
+
+def faiss_index_spec(kind: str, n_vectors: int, dim: int) -> dict:
+    """Chaîne index_factory + paramètres de recherche pour un type d'index."""
+    # ~4·√n listes, au moins 39 vecteurs d'entraînement par liste
+    nlist = max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+    if kind == "ivf_pq" and n_vectors < 256 * 39:
+        kind = "ivf_sq8"  # trop peu de vecteurs pour entraîner les codebooks PQ (256 centroïdes)
+
+    if kind == "hnsw":
+        return {"type": kind, "factory": f"HNSW{FAISS_HNSW_M}", "efSearch": FAISS_HNSW_EF_SEARCH}
+    if kind == "ivf":
+        return {"type": kind, "factory": f"IVF{nlist},Flat", "nprobe": min(FAISS_IVF_NPROBE, nlist)}
+    if kind == "ivf_sq8":
+        return {"type": kind, "factory": f"IVF{nlist},SQ8", "nprobe": min(FAISS_IVF_NPROBE, nlist)}
+    if kind == "ivf_pq":
+        # Sous-quantifieurs de 8 dimensions (48 octets par vecteur en 384d)
+        m = next(m for m in range(max(1, dim // 8), 0, -1) if dim % m == 0)
+        return {"type": kind, "factory": f"IVF{nlist},PQ{m}", "nprobe": min(FAISS_IVF_NPROBE, nlist)}
+    if kind == "sq8":
+        return {"type": kind, "factory": "SQ8"}
+    return {"type": "flat", "factory": "Flat"}
+
+
+def apply_faiss_search_params(index, spec: dict):
+    import faiss
+    if "nprobe" in spec:
+        faiss.extract_index_ivf(index).nprobe = spec["nprobe"]
+    if "efSearch" in spec:
+        index.hnsw.efSearch = spec["efSearch"]
+
+
+def create_faiss_index(embeddings: np.ndarray, spec: dict):
+    """Construit (entraînement compris) un index FAISS produit interne sur des vecteurs normalisés."""
+    import faiss
+    vectors = np.array(embeddings, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.index_factory(vectors.shape[1], spec["factory"], faiss.METRIC_INNER_PRODUCT)
+    if spec["type"] == "hnsw":
+        index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > FAISS_TRAIN_MAX_VECTORS:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), FAISS_TRAIN_MAX_VECTORS, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    apply_faiss_search_params(index, spec)
+    return index
+
+
+def build_faiss_index(chunks, file_key: str, embeddings: np.ndarray = None):
+    """
+    Construit un index FAISS à partir des embeddings des chunks.
+    Sauvegarde l'index (et ses paramètres, en JSON) sur disque pour éviter la reconstruction.
+    Les métadonnées sont les chunks eux-mêmes (ChunkStore du cache document).
+    """
+    try:
+        import faiss
+
+        kind = choose_faiss_index_type(len(chunks))
+        cache_key = f"faiss_{hashlib.md5(f'{file_key}|{EMBEDDING_MODEL_NAME}|{kind}'.encode()).hexdigest()}"
+        faiss_path = os.path.join(CACHE_DIR, f"{cache_key}.faiss")
+        params_path = os.path.join(CACHE_DIR, f"{cache_key}.json")
+
+        # Charge index existant (index entraîné + paramètres de recherche)
+        if os.path.exists(faiss_path) and os.path.exists(params_path):
+            with span("faiss_load", index_type=kind):
+                index = faiss.read_index(faiss_path)
+                with open(params_path, encoding="utf-8") as f:
+                    apply_faiss_search_params(index, json.load(f))
+            return index, chunks
+
+        # Construit l'index
+        if embeddings is None:
+            embeddings = build_embedding_matrix(chunks)
+        if embeddings is None or len(embeddings) == 0:
+            return None, None
+
+        spec = faiss_index_spec(kind, len(embeddings), embeddings.shape[1])
+        with span("faiss_build", vectors=len(embeddings), index_type=spec["type"]):
+            start = time.perf_counter()
+            index = create_faiss_index(embeddings, spec)
+
+            # Sauvegarde (index d'abord : le JSON marque un index complet)
+            faiss.write_index(index, faiss_path)
+            with open(params_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    **spec,
+                    "vectors": len(embeddings),
+                    "dim": int(embeddings.shape[1]),
+                    "build_s": round(time.perf_counter() - start, 3),
+                }, f)
+        return index, chunks
+
+    except ImportError:
+        return None, None  # Fallback linéaire si FAISS non installé
+
+
+def faiss_search(index, metadata: list, query_emb: np.ndarray, top_k: int) -> list:
+    """Recherche dans l'index FAISS. Retourne les top_k chunks les plus proches."""
+    return faiss_search_batch(index, metadata, [query_emb], top_k)[0]
+
+
+def faiss_search_batch(index, metadata: list, query_embs, top_k: int) -> list:
+    """Une seule recherche FAISS pour toutes les requêtes (une liste de chunks par requête)."""
+    try:
+        import faiss
+        queries = np.array(query_embs, dtype=np.float32)
+        faiss.normalize_L2(queries)
+        _, indices = index.search(queries, top_k)
+        return [[metadata[i] for i in row if 0 <= i < len(metadata)] for row in indices]
+    except Exception:
+        return [[] for _ in range(len(query_embs))]
+
+
+# ============================================================
+# AMÉLIORATION 8 — REGISTRE D'INDEX FAISS EN MÉMOIRE
+# Chaque index est chargé une seule fois par processus et partagé
+# entre les sessions, au lieu d'être relu sur disque à chaque question
+# ============================================================
+
+class FaissIndexRegistry:
+    """
+    Registre d'index FAISS partagé par toutes les sessions Streamlit.
+    - Clé : (document, modèle d'embeddings)
+    - Chargement unique par clé (disque ou construction)
+    - Éviction LRU dès que le budget mémoire est dépassé
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # clé → (index, metadata, taille en octets)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    @staticmethod
+    def _estimate_size(index, metadata) -> int:
+        # Les métadonnées (ChunkStore mmap) sont partagées avec le cache document
+        try:
+            per_vector = index.sa_code_size()  # Flat : 4·d, SQ8 : d, PQ : m (+ 1 pour IVF)
+        except RuntimeError:
+            per_vector = index.d * 4
+        if hasattr(index, "hnsw"):
+            per_vector += index.hnsw.nb_neighbors(0) * 4  # liens du graphe (niveau 0)
+        if hasattr(index, "nlist"):
+            per_vector += 8  # identifiants des listes inversées
+        return index.ntotal * per_vector
+
+    def get(self, key: tuple, loader):
+        """Retourne (index, metadata) ; appelle loader() uniquement si absent."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0], entry[1]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Un seul chargement par clé, même si plusieurs sessions demandent l'index
+        with load_lock:
+            try:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        self._entries.move_to_end(key)
+                        return entry[0], entry[1]
+
+                index, metadata = loader()
+                if index is None or metadata is None:
+                    return None, None
+
+                size = self._estimate_size(index, metadata)
+                with self._lock:
+                    self._entries[key] = (index, metadata, size)
+                    self.total_bytes += size
+                    self._evict()
+                return index, metadata
+            finally:
+                # Verrou retiré même en échec : pas d'accumulation pour les clés absentes
+                with self._lock:
+                    self._load_locks.pop(key, None)
+
+    def _evict(self):
+        # Garde toujours au moins l'index le plus récent
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"indexes": len(self._entries), "bytes": self.total_bytes}
+
+
+@st.cache_resource
+def get_faiss_registry() -> FaissIndexRegistry:
+    return FaissIndexRegistry(int(FAISS_REGISTRY_MAX_MB * 1024 * 1024))
+
+
+def get_faiss_index(chunks, file_key: str, embeddings: np.ndarray = None):
+    """Index FAISS du document via le registre partagé (chargé une seule fois)."""
+    return get_faiss_registry().get(
+        (file_key, EMBEDDING_MODEL_NAME),
+        lambda: build_faiss_index(chunks, file_key, embeddings)
+    )
+
+
+def merge_faiss_bm25(chunks, question: str, faiss_results: list, bm25_index: dict, top_k: int,
+                     with_scores: bool = False, allowed: np.ndarray = None) -> tuple:
+    """
+    Union FAISS + BM25 (dédupliquée par texte) → (context, source_pages, selected).
+    Avec with_scores=True, ajoute le score RRF de chaque chunk sélectionné.
+    """
+    with span("bm25_search", top_k=top_k):
+        bm25_top = [chunks[i] for _, i in bm25_search(bm25_index, question, top_k, allowed)]
+
+    def key_of(c):
+        return c.get("doc_id"), c["text"][:100]
+
+    seen = set()
+    combined = []
+    fused = {}
+    for ranked in (faiss_results, bm25_top):
+        for rank, c in enumerate(ranked):
+            key = key_of(c)
+            fused[key] = fused.get(key, 0.0) + rrf_score(rank)
+    for c in faiss_results + bm25_top:
+        key = key_of(c)
+        if key not in seen:
+            seen.add(key)
+            combined.append(c)
+
+    selected = combined[:top_k]
+    context = "\n\n---\n\n".join(c["text"] for c in selected)
+    all_pages = []
+    for c in selected:
+        all_pages.extend(c["pages"])
+    if with_scores:
+        return context, sorted(set(all_pages)), selected, [fused[key_of(c)] for c in selected]
+    return context, sorted(set(all_pages)), selected
+
+
+def retrieve_hybrid_faiss(chunks: list, question: str, top_k: int = 6, model=None, file_key: str = "",
+                          bm25_index: dict = None, emb_matrix: np.ndarray = None, with_scores: bool = False) -> tuple:
+    """
+    Hybrid retrieval avec FAISS si disponible, sinon fallback linéaire.
+    """
+    if bm25_index is None:
+        bm25_index = build_bm25_index(chunks)
+
+    # Tentative FAISS
+    if model is not None and file_key:
+        faiss_index, faiss_meta = get_faiss_index(chunks, file_key, emb_matrix)
+        if faiss_index is not None and faiss_meta is not None:
+            with span("query_encoding"):
+                query_emb = encode_query(model, question)
+
+            # Recherche FAISS (sémantique)
+            with span("faiss_search", top_k=top_k):
+                faiss_results = faiss_search(faiss_index, faiss_meta, query_emb, top_k)
+
+            # Recherche BM25 + fusion simple
+            return merge_faiss_bm25(chunks, question, faiss_results, bm25_index, top_k, with_scores)
+
+    # Fallback : hybrid retrieval linéaire (original)
+    return retrieve_hybrid(
+        chunks, question, top_k=top_k, model=model, bm25_index=bm25_index, emb_matrix=emb_matrix,
+        with_scores=with_scores
+    )
+
+
+def retrieve_hybrid_faiss_batch(chunks: list, questions: list, top_k: int = 6, model=None, file_key: str = "",
+                                bm25_index: dict = None, emb_matrix: np.ndarray = None,
+                                with_scores: bool = False) -> list:
+    """
+    Version par lot de retrieve_hybrid_faiss (mode batch, cf. batch_qa.py) :
+    un seul model.encode pour toutes les questions et une seule recherche FAISS.
+    Retourne un tuple (context, source_pages, selected) par question.
+    """
+    if bm25_index is None:
+        bm25_index = build_bm25_index(chunks)
+
+    query_embs = [None] * len(questions)
+    if model is not None and questions:
+        with span("query_encoding", queries=len(questions)):
+            query_embs = encode_queries(model, list(questions))
+
+        if file_key:
+            faiss_index, faiss_meta = get_faiss_index(chunks, file_key, emb_matrix)
+            if faiss_index is not None and faiss_meta is not None:
+                with span("faiss_search", top_k=top_k, queries=len(questions)):
+                    faiss_results = faiss_search_batch(faiss_index, faiss_meta, query_embs, top_k)
+                return [
+                    merge_faiss_bm25(chunks, q, res, bm25_index, top_k, with_scores)
+                    for q, res in zip(questions, faiss_results)
+                ]
+
+    # Fallback linéaire, avec les embeddings déjà calculés
+    return [
+        retrieve_hybrid(chunks, q, top_k=top_k, model=model, bm25_index=bm25_index,
+                        emb_matrix=emb_matrix, query_emb=emb, with_scores=with_scores)
+        for q, emb in zip(questions, query_embs)
+    ]
+
+
+# ============================================================
+# AMÉLIORATION 17 — CORPUS MULTI-DOCUMENTS (persistant, incrémental)
+# Tous les PDF importés partagent un index BM25 et un index FAISS ;
+# chaque chunk porte l'identifiant de son document. Ajouter un PDF
+# étend les index au lieu de les reconstruire.
+# ============================================================
+
+CORPUS_DIR = os.path.join(CACHE_DIR, "corpus")
+
+
+class CorpusChunks:
+    """
+    Vue en lecture seule sur les chunks de tous les documents (id global → chunk).
+    Les textes restent dans les ChunkStore mmap de chaque document. Un segment couvre
+    tout un cache document, ou seulement certaines lignes (rows) après une révision.
+    """
+
+    def __init__(self, stores: list, doc_ids: list, rows: list = None):
+        self.stores = stores
+        self.doc_ids = doc_ids
+        self.rows = rows if rows is not None else [None] * len(stores)
+        self.offsets = np.cumsum(
+            [0] + [len(s) if r is None else len(r) for s, r in zip(stores, self.rows)]
+        )
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        d = int(np.searchsorted(self.offsets, i, side="right")) - 1
+        local = i - int(self.offsets[d])
+        if self.rows[d] is not None:
+            local = int(self.rows[d][local])
+        chunk = dict(self.stores[d][local])
+        chunk["doc_id"] = self.doc_ids[d]
+        return chunk
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def segment_pages(self, d: int) -> np.ndarray:
+        """Page de chaque chunk du segment d."""
+        pages = chunk_first_pages(self.stores[d])
+        return pages if self.rows[d] is None else pages[self.rows[d]]
+
+    def allowed_mask(self, doc_ids) -> np.ndarray:
+        """Masque booléen des chunks appartenant aux documents demandés."""
+        mask = np.zeros(len(self), dtype=bool)
+        wanted = set(doc_ids)
+        for d, doc_id in enumerate(self.doc_ids):
+            if doc_id in wanted:
+                mask[self.offsets[d]:self.offsets[d + 1]] = True
+        return mask
+
+
+def faiss_filter_params(index, selector):
+    """Paramètres de recherche avec filtre d'ids, en conservant nprobe / efSearch de l'index."""
+    import faiss
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+CORPUS_COMPACT_RATIO = float(os.getenv("CORPUS_COMPACT_RATIO", "0.3"))  # part de tombstones avant compaction
+
+
+class Corpus:
+    """
+    Corpus persistant (CORPUS_DIR) :
+      - manifest.json : documents dans l'ordre d'ajout (doc_id = doc_key, nom, pages, chunks)
+        et leurs segments (cache document, lignes reprises, chunks remplacés)
+      - index.faiss   : index vectoriel partagé, ids = ids globaux des chunks
+    Chunks, embeddings et index BM25 par document restent dans le cache document
+    (doc_{doc_key}) ; l'index BM25 du corpus les sert en segments (cf. SegmentedBM25).
+    Une révision (cf. replace_document) marque les chunks de ses pages modifiées comme
+    remplacés (tombstones, exclus des recherches) et ajoute les nouveaux à la suite :
+    les ids globaux ne bougent jamais, l'index n'est pas reconstruit.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.documents = []
+        self.chunks = CorpusChunks([], [])
+        self.bm25 = SegmentedBM25()
+        self.index = None
+        self.index_spec = None
+        self.live = np.zeros(0, dtype=bool)  # False = chunk remplacé par une révision
+        self._segments = []     # {"doc_id", "key", "rows", "dead"} dans l'ordre des ids globaux
+        self._embeddings = []   # matrice par segment (None si non encodé)
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @property
+    def names(self) -> dict:
+        return {d["doc_id"]: d["name"] for d in self.documents}
+
+    @property
+    def live_chunks(self) -> int:
+        return int(self.live.sum())
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _load(self):
+        manifest = []
+        if os.path.exists(self._path("manifest.json")):
+            with open(self._path("manifest.json"), encoding="utf-8") as f:
+                manifest = json.load(f)["documents"]
+
+        for entry in manifest:
+            segments = entry.get("segments") or [{"key": entry["doc_id"], "rows": None, "dead": []}]
+            docs = [load_cached_document(seg["key"]) for seg in segments]
+            if any(doc is None for doc in docs):
+                continue  # cache document purgé : le document sort du corpus
+            self.documents.append(entry)
+            for seg, doc in zip(segments, docs):
+                self._append_segment(entry["doc_id"], seg["key"], doc, seg["rows"], seg["dead"])
+
+        self._load_vector_index()
+        if len(self.documents) != len(manifest):
+            self._save_manifest()
+
+    def _append_segment(self, doc_id: str, key: str, doc: dict, rows=None, dead=()):
+        """Ajoute les chunks d'un cache document (ou ses lignes rows) ; retourne leurs embeddings."""
+        store, embeddings, bm25 = doc["chunks"], doc["embeddings"], doc["bm25"]
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            if embeddings is not None:
+                embeddings = np.asarray(embeddings)[rows]
+            bm25 = build_bm25_index([store[int(r)] for r in rows])
+        live = np.ones(len(store) if rows is None else len(rows), dtype=bool)
+        live[list(dead)] = False
+
+        self._segments.append({"doc_id": doc_id, "key": key, "rows": rows, "dead": list(dead)})
+        self._embeddings.append(embeddings)
+        self.live = np.concatenate([self.live, live])
+        self.chunks = CorpusChunks(
+            self.chunks.stores + [store], self.chunks.doc_ids + [doc_id], self.chunks.rows + [rows]
+        )
+        self.bm25.add(bm25)  # en dernier : un résultat BM25 a toujours son chunk
+        if len(dead):
+            start = len(self.chunks) - len(live)
+            self.bm25.remove([self.chunks[start + int(j)]["text"] for j in dead])
+        return embeddings
+
+    def _load_vector_index(self):
+        try:
+            import faiss
+        except ImportError:
+            return
+        if os.path.exists(self._path("index.faiss")) and os.path.exists(self._path("index.json")):
+            with open(self._path("index.json"), encoding="utf-8") as f:
+                spec = json.load(f)
+            index = faiss.read_index(self._path("index.faiss"))
+            if index.ntotal == len(self.chunks):
+                apply_faiss_search_params(index, spec)
+                self.index, self.index_spec = index, spec
+                return
+        self._rebuild_vector_index()
+
+    def _embedding_matrix(self):
+        if not self._embeddings or any(e is None for e in self._embeddings):
+            return None
+        return np.concatenate([np.asarray(e) for e in self._embeddings])
+
+    def _rebuild_vector_index(self):
+        matrix = self._embedding_matrix()
+        if matrix is None or len(matrix) == 0:
+            self.index = self.index_spec = None
+            return
+        spec = faiss_index_spec(choose_faiss_index_type(len(matrix)), len(matrix), matrix.shape[1])
+        with span("faiss_build", vectors=len(matrix), index_type=spec["type"]):
+            self.index, self.index_spec = create_faiss_index(matrix, spec), spec
+        self._save_vector_index()
+
+    def _extend_vector_index(self, matrix):
+        """Ajout direct à l'index si son type reste adapté à la nouvelle taille, sinon reconstruction."""
+        kind = choose_faiss_index_type(len(self.chunks))
+        if self.index is not None and matrix is not None and self.index_spec["type"] == kind:
+            import faiss
+            vectors = np.array(matrix, dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            self.index.add(vectors)
+            self._save_vector_index()
+        else:
+            try:
+                self._rebuild_vector_index()
+            except ImportError:
+                self.index = None
+
+    def _save_vector_index(self):
+        import faiss
+        faiss.write_index(self.index, self._path("index.faiss"))
+        with open(self._path("index.json"), "w", encoding="utf-8") as f:
+            json.dump(self.index_spec, f)
+
+    def _save_manifest(self):
+        for entry in self.documents:
+            entry["segments"] = [
+                {"key": seg["key"], "rows": None if seg["rows"] is None else seg["rows"].tolist(),
+                 "dead": seg["dead"]}
+                for seg in self._segments if seg["doc_id"] == entry["doc_id"]
+            ]
+        tmp = self._path("manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"documents": self.documents}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self._path("manifest.json"))
+
+    def add_document(self, doc_key: str, name: str, doc: dict) -> bool:
+        """Ajoute un document ingéré (cf. ingest_pdf) ; False s'il est déjà dans le corpus."""
+        with self._lock:
+            if any(d["doc_id"] == doc_key for d in self.documents):
+                return False
+            with span("corpus_append", document=name, chunks=len(doc["chunks"])):
+                self.documents.append({
+                    "doc_id": doc_key,
+                    "name": name,
+                    "pages": len(doc["pages_text"]),
+                    "chunks": len(doc["chunks"]),
+                    "added": datetime.now().isoformat(timespec="seconds"),
+                })
+                self._extend_vector_index(self._append_segment(doc_key, doc_key, doc))
+                self._save_manifest()
+            return True
+
+    def replace_document(self, old_key: str, new_key: str, name: str, doc: dict):
+        """
+        Remplace old_key par sa nouvelle version new_key sans toucher aux pages inchangées :
+        les chunks des pages modifiées deviennent des tombstones, les nouveaux sont ajoutés
+        à l'index. Retourne {"changed_pages", "removed_chunks", "added_chunks"}, ou None
+        si old_key n'est pas dans le corpus, si new_key y est déjà, ou si les deux versions
+        ont moins de REVISION_MIN_OVERLAP pages en commun.
+        """
+        with self._lock:
+            entry = next((d for d in self.documents if d["doc_id"] == old_key), None)
+            if entry is None or any(d["doc_id"] == new_key for d in self.documents):
+                return None
+            old = load_cached_document(old_key)
+            new_hashes = doc.get("page_hashes") or page_hashes(doc["pages_text"])
+            if old is None or page_overlap(old["page_hashes"], new_hashes) < REVISION_MIN_OVERLAP:
+                return None
+            with span("corpus_revision", document=name):
+                changed = changed_pages(old["page_hashes"], new_hashes)
+                # Pages re-découpées avec les pages modifiées (doublons partagés)
+                changed_list = sorted(linked_pages(old["chunks"], changed))
+
+                # Tombstones : chunks encore vivants de l'ancienne version sur une page modifiée
+                removed = 0
+                for d, seg in enumerate(self._segments):
+                    if seg["doc_id"] != old_key:
+                        continue
+                    start = int(self.chunks.offsets[d])
+                    hit = np.isin(self.chunks.segment_pages(d), changed_list)
+                    dead = np.flatnonzero(hit & self.live[start:start + len(hit)])
+                    self.live[start + dead] = False
+                    self.bm25.remove([self.chunks[start + int(j)]["text"] for j in dead])
+                    seg["dead"] = sorted(set(seg["dead"]) | set(dead.tolist()))
+                    seg["doc_id"] = new_key
+                    removed += len(dead)
+                self.chunks = CorpusChunks(
+                    self.chunks.stores, [seg["doc_id"] for seg in self._segments], self.chunks.rows
+                )
+
+                # Seuls les chunks des pages modifiées entrent dans l'index, à la suite
+                rows = np.flatnonzero(np.isin(chunk_first_pages(doc["chunks"]), changed_list))
+                if len(rows):
+                    self._extend_vector_index(self._append_segment(new_key, new_key, doc, rows))
+                entry.update({
+                    "doc_id": new_key,
+                    "name": name,
+                    "pages": len(doc["pages_text"]),
+                    "chunks": len(doc["chunks"]),
+                    "revision_of": old_key,
+                    "updated": datetime.now().isoformat(timespec="seconds"),
+                })
+                if len(self.live) and (~self.live).mean() > CORPUS_COMPACT_RATIO:
+                    self._compact()
+                self._save_manifest()
+            return {"changed_pages": sorted(changed), "removed_chunks": removed, "added_chunks": len(rows)}
+
+    def _compact(self):
+        """Reconstruit le corpus sans tombstones : un segment complet par document."""
+        with span("corpus_compact", tombstones=int((~self.live).sum())):
+            documents = self.documents
+            self.documents, self._segments, self._embeddings = [], [], []
+            self.chunks, self.bm25, self.live = CorpusChunks([], []), SegmentedBM25(), np.zeros(0, dtype=bool)
+            for entry in documents:
+                doc = load_cached_document(entry["doc_id"])
+                if doc is None:
+                    continue
+                self.documents.append(entry)
+                self._append_segment(entry["doc_id"], entry["doc_id"], doc)
+            try:
+                self._rebuild_vector_index()
+            except ImportError:
+                self.index = None
+
+    def search_mask(self, doc_ids: list = None):
+        """Chunks interrogeables : documents demandés, hors tombstones (None = tout le corpus)."""
+        if doc_ids:
+            return self.chunks.allowed_mask(doc_ids) & self.live
+        return None if self.live.all() else self.live.copy()
+
+    def vector_search(self, query_emb, top_k: int, allowed: np.ndarray = None) -> list:
+        """Ids globaux des top_k chunks les plus proches (filtrés par allowed)."""
+        import faiss
+        query = np.array([query_emb], dtype=np.float32)
+        faiss.normalize_L2(query)
+        with self._lock:  # pas de recherche pendant un ajout à l'index
+            if self.index is None:
+                return []
+            params = None
+            if allowed is not None:
+                selector = faiss.IDSelectorBatch(np.flatnonzero(allowed).astype(np.int64))
+                params = faiss_filter_params(self.index, selector)
+            _, ids = self.index.search(query, top_k, params=params)
+        return [int(i) for i in ids[0] if i >= 0]
+
+    def embedding_matrix(self):
+        """Matrice complète (fallback linéaire sans FAISS) ; None si un document n'est pas encodé."""
+        return self._embedding_matrix()
+
+
+@st.cache_resource
+def get_corpus() -> Corpus:
+    return Corpus(CORPUS_DIR)
+
+
+def retrieve_corpus(corpus: Corpus, question: str, top_k: int = 6, model=None, doc_ids: list = None,
+                    with_scores: bool = False) -> tuple:
+    """
+    Hybrid retrieval sur tout le corpus ou sur un sous-ensemble de documents (doc_ids).
+    Même contrat que retrieve_hybrid_faiss ; chaque chunk porte son doc_id.
+    """
+    chunks, bm25_index = corpus.chunks, corpus.bm25
+    allowed = corpus.search_mask(doc_ids)
+
+    if model is not None and corpus.index is not None:
+        with span("query_encoding"):
+            query_emb = encode_query(model, question)
+        with span("faiss_search", top_k=top_k, corpus=True):
+            faiss_results = [chunks[i] for i in corpus.vector_search(query_emb, top_k, allowed)]
+        return merge_faiss_bm25(chunks, question, faiss_results, bm25_index, top_k, with_scores, allowed)
+
+    return retrieve_hybrid(
+        chunks, question, top_k=top_k, model=model, bm25_index=bm25_index,
+        emb_matrix=corpus.embedding_matrix() if model is not None else None,
+        with_scores=with_scores, allowed=allowed
+    )
+
+
+def corpus_sources(names: dict, chunks: list) -> list:
+    """Sources citables : [(nom du document, page)] triées."""
+    return sorted({(names.get(c["doc_id"], "?"), p) for c in chunks for p in c["pages"]})
+
+
+def session_corpus_names(corpus: Corpus) -> dict:
+    """
+    Documents du corpus importés par cette session : doc_id → nom donné par l'utilisateur
+    (st.session_state.session_docs). Le corpus et les caches sont partagés, mais une session
+    ne voit, n'ouvre et n'interroge que ses propres documents. Un document sorti du corpus
+    entre-temps (purge, révision du même PDF par une autre session) y est rajouté depuis
+    son cache document.
+    """
+    pending = st.session_state.get("ingest_jobs", {})
+    present = corpus.names
+    names = {}
+    for doc_id, name in st.session_state.get("session_docs", {}).items():
+        if doc_id in pending:
+            continue
+        if doc_id not in present:
+            doc = get_document_registry().get(doc_id)
+            if doc is None:
+                continue
+            corpus.add_document(doc_id, name, doc)
+        names[doc_id] = name
+    return names
+
+
+# ============================================================
+# AMÉLIORATION 18 — INGESTION EN ARRIÈRE-PLAN
+# Extraction et encodage tournent dans un pool de threads hors du
+# script Streamlit : l'upload ne bloque plus l'interface, un rerun
+# n'interrompt plus le travail, et le document est lisible (pages,
+# BM25) avant la fin des embeddings
+# ============================================================
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_POLL_S = float(os.getenv("INGEST_POLL_S", "1.0"))
+
+
+class IngestionJob:
+    """
+    État d'une ingestion, lu par l'UI à chaque rafraîchissement.
+    status : queued → extracting → encoding → done | error
+    """
+
+    def __init__(self, doc_key: str, name: str, tracer=None, previous_key: str = None):
+        self.doc_key = doc_key
+        self.name = name
+        self.tracer = tracer
+        self.previous_key = previous_key  # version précédente choisie explicitement par l'utilisateur
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = "En attente…"
+        self.readable = None    # document sans embeddings, publié avant l'encodage
+        self.pages = 0
+        self.chunks = 0
+        self.from_cache = False
+        self.revision = None    # {"changed_pages", ...} si une version précédente a été réutilisée
+        self.dedup = None       # {"duplicates", "embeddings_saved", "margin_lines", ...}
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+    @property
+    def milestone(self) -> str:
+        """Palier visible par l'UI : pending, readable, done ou error."""
+        if self.status in ("done", "error"):
+            return self.status
+        return "readable" if self.readable is not None else "pending"
+
+    def on_progress(self, stage: str, done: int, total: int):
+        # Extraction sur 0–50 %, encodage sur 50–95 %, le reste pour le cache et le corpus
+        if stage == "extraction":
+            self.progress = 0.5 * done / total
+            self.message = f"Extraction : {done}/{total} pages"
+        else:
+            self.progress = 0.5 + 0.45 * done / total
+            self.message = f"Encodage : {done}/{total} chunks"
+
+    def on_readable(self, doc: dict):
+        self.readable = doc
+        self.pages = len(doc["pages_text"])
+        self.chunks = len(doc["chunks"])
+        self.status = "encoding"
+        self.progress = max(self.progress, 0.5)
+        self.message = "Pages disponibles • encodage des chunks…"
+
+
+class IngestionQueue:
+    """
+    File d'ingestion partagée entre sessions (cf. get_ingestion_queue) : l'état des
+    jobs vit hors des reruns du script, un même PDF n'est ingéré qu'une fois.
+    Threads plutôt que processus : l'extraction des gros PDF a déjà son propre pool
+    de processus, et l'encodage libère le GIL.
+    """
+
+    def __init__(self, corpus: Corpus, max_workers: int = 1):
+        from concurrent.futures import ThreadPoolExecutor
+        self.corpus = corpus
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, pdf_bytes: bytes, doc_key: str, name: str, emb_model=None, tracer=None,
+               previous_key: str = None) -> IngestionJob:
+        """
+        Programme l'ingestion ; renvoie le job existant si ce document est déjà en cours ou fait.
+        previous_key : document que celui-ci remplace (révision), choisi dans la session.
+        """
+        with self._lock:
+            job = self._jobs.get(doc_key)
+            if job is not None and job.status != "error":
+                return job
+            job = IngestionJob(doc_key, name, tracer, previous_key if previous_key != doc_key else None)
+            self._jobs[doc_key] = job
+        self._executor.submit(self._run, job, pdf_bytes, emb_model)
+        return job
+
+    def get(self, doc_key: str):
+        return self._jobs.get(doc_key)
+
+    def pending(self) -> list:
+        return [j for j in list(self._jobs.values()) if j.status not in ("done", "error")]
+
+    def _run(self, job: IngestionJob, pdf_bytes: bytes, emb_model):
+        job.status = "extracting"
+        job.message = "Extraction des pages…"
+        previous_key = job.previous_key
+        try:
+            with activate(job.tracer), span("ingestion", document=job.name):
+                doc, from_cache = ingest_pdf(
+                    pdf_bytes, job.doc_key, emb_model,
+                    progress_callback=job.on_progress, on_readable=job.on_readable,
+                    previous_key=previous_key
+                )
+                if doc is None:
+                    job.error = "PDF vide ou non lisible (PDF scanné ?)."
+                else:
+                    job.message = "Ajout au corpus…"
+                    update = None
+                    if previous_key:
+                        update = self.corpus.replace_document(previous_key, job.doc_key, job.name, doc)
+                    if update is None:
+                        self.corpus.add_document(job.doc_key, job.name, doc)
+                    else:
+                        job.revision = {**doc.get("revision", {}), **update}
+                    job.pages = len(doc["pages_text"])
+                    job.chunks = len(doc["chunks"])
+                    job.dedup = doc.get("dedup")
+                    job.from_cache = from_cache
+        except Exception as e:
+            job.error = f"ingestion impossible : {e}"
+        job.readable = None  # le document complet se relit depuis le cache (mmap)
+        job.progress = 1.0
+        job.finished = time.time()
+        job.status = "error" if job.error else "done"
+
+
+@st.cache_resource
+def get_ingestion_queue() -> IngestionQueue:
+    return IngestionQueue(get_corpus(), INGEST_WORKERS)
+
+
+def load_document_state(doc_key: str, name: str, ready: bool = True):
+    """
+    Rend un document actif dans la session ; ready=False tant que ses embeddings manquent.
+    La session ne garde que la clé : le contenu est lu via session_document().
+    """
+    st.session_state.loaded_file = name
+    st.session_state.doc_key = doc_key
+    st.session_state.doc_ready = ready
+    st.session_state.setdefault("messages", [])
+
+
+def session_document():
+    """
+    Document actif de la session, partagé en lecture seule : le document lisible du job
+    d'ingestion tant que l'encodage tourne, sinon celui du registre. None si aucun.
+    """
+    doc_key = st.session_state.get("doc_key")
+    if not doc_key:
+        return None
+    if not st.session_state.get("doc_ready", True):
+        job = get_ingestion_queue().get(doc_key)
+        if job is not None and job.readable is not None:
+            return job.readable
+    return get_document_registry().get(doc_key)
+
 
-    return context, source_pages, selected
+def update_ingestion_jobs(queue: IngestionQueue) -> list:
+    """
+    Applique les paliers franchis depuis le dernier rerun par les jobs de la session
+    (st.session_state.ingest_jobs : doc_key → dernier palier vu).
+    Retourne les jobs terminés pendant l'intervalle.
+    """
+    seen = st.session_state.setdefault("ingest_jobs", {})
+    finished = []
+    for doc_key, last in list(seen.items()):
+        job = queue.get(doc_key)
+        if job is None:
+            del seen[doc_key]
+            continue
+        milestone = job.milestone
+        # Le document importé devient actif dès qu'il est lisible
+        if last == "pending" and milestone in ("readable", "done"):
+            st.session_state.active_doc = doc_key
+        if milestone in ("done", "error"):
+            del seen[doc_key]
+            finished.append(job)
+        else:
+            seen[doc_key] = milestone
+        if milestone == "error":
+            # Échec (éventuellement passager) : un nouvel import du même PDF relance l'ingestion
+            st.session_state.get("ingested", set()).discard(doc_key)
+            st.session_state.get("session_docs", {}).pop(doc_key, None)
+    return finished
+
+
+@st.fragment(run_every=INGEST_POLL_S)
+def render_ingestion_jobs():
+    """Progression des ingestions en cours ; relance le script complet à chaque palier."""
+    queue = get_ingestion_queue()
+    changed = False
+    for doc_key, last in st.session_state.get("ingest_jobs", {}).items():
+        job = queue.get(doc_key)
+        if job is None:
+            continue
+        name = st.session_state.get("session_docs", {}).get(doc_key, job.name)
+        st.progress(job.progress, text=f"{name} — {job.message}")
+        changed = changed or job.milestone != last
+    if changed:
+        st.rerun()
 
 
 # ============================================================
-# RERANKING (Cross-Encoder)
+# AMÉLIORATION 12 — CACHE SÉMANTIQUE DES RÉPONSES (persistant)
+# Une question identique ou paraphrasée sur le même document
+# réutilise la réponse stockée au lieu d'un aller-retour Mistral
 # ============================================================
 
-def rerank_chunks(chunks_selected: list, question: str, reranker, top_k: int = 3) -> list:
-    if reranker is None or not chunks_selected:
-        return chunks_selected
-    pairs = [(question, c["text"]) for c in chunks_selected]
-    scores = reranker.predict(pairs)
-    reranked = sorted(zip(scores, chunks_selected), key=lambda x: -x[0])
-    return [c for _, c in reranked[:top_k]]
+ANSWER_CACHE_DIR = os.path.join(CACHE_DIR, "answers")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "168")) * 3600
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+class AnswerCache:
+    """
+    Cache de réponses par document, persistant sur disque.
+    - Clé : (document, paramètres de retrieval) + embedding de la question
+    - Hit si similarité cosinus ≥ seuil (ou question identique sans modèle)
+    - Expiration TTL + éviction LRU (nombre max d'entrées par document)
+    """
+
+    def __init__(self, cache_dir: str, threshold: float, ttl_s: float, max_entries: int):
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._docs = {}  # doc_key → liste d'entrées
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, doc_key: str) -> str:
+        return os.path.join(self.cache_dir, f"{doc_key}.pkl")
+
+    def _entries(self, doc_key: str) -> list:
+        if doc_key not in self._docs:
+            entries = []
+            if os.path.exists(self._path(doc_key)):
+                try:
+                    with open(self._path(doc_key), "rb") as f:
+                        entries = pickle.load(f)
+                except Exception:
+                    entries = []
+            self._docs[doc_key] = entries
+        return self._docs[doc_key]
+
+    def _save(self, doc_key: str):
+        try:
+            with open(self._path(doc_key), "wb") as f:
+                pickle.dump(self._docs[doc_key], f)
+        except Exception:
+            pass  # cache best-effort
+
+    def lookup(self, doc_key: str, question: str, query_emb, params: tuple):
+        now = time.time()
+        with self._lock:
+            entries = self._entries(doc_key)
+            live = [e for e in entries if now - e["created"] <= self.ttl_s]
+            if len(live) != len(entries):
+                entries[:] = live
+                self._save(doc_key)
+
+            candidates = [e for e in live if e["params"] == params]
+            best = None
+            if candidates and query_emb is not None:
+                query = np.asarray(query_emb, dtype=np.float32)
+                query = query / (np.linalg.norm(query) or 1.0)
+                with_emb = [e for e in candidates if e["embedding"] is not None]
+                if with_emb:
+                    sims = np.stack([e["embedding"] for e in with_emb]) @ query
+                    i = int(np.argmax(sims))
+                    if sims[i] >= self.threshold:
+                        best = with_emb[i]
+            if best is None:
+                q_norm = normalize_question(question)
+                best = next((e for e in candidates if e["question_norm"] == q_norm), None)
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            best["last_used"] = now
+            self._save(doc_key)  # ordre LRU conservé d'un redémarrage à l'autre
+            return best
+
+    def store(self, doc_key: str, question: str, query_emb, params: tuple, answer: str, pages: list):
+        embedding = None
+        if query_emb is not None:
+            embedding = np.asarray(query_emb, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        now = time.time()
+        with self._lock:
+            entries = self._entries(doc_key)
+            entries.append({
+                "question": question,
+                "question_norm": normalize_question(question),
+                "embedding": embedding,
+                "params": params,
+                "answer": answer,
+                "pages": list(pages),
+                "created": now,
+                "last_used": now,
+            })
+            if len(entries) > self.max_entries:
+                entries.sort(key=lambda e: e["last_used"])
+                del entries[:len(entries) - self.max_entries]
+            self._save(doc_key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+@st.cache_resource
+def get_answer_cache() -> AnswerCache:
+    return AnswerCache(ANSWER_CACHE_DIR, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_S, ANSWER_CACHE_MAX_ENTRIES)
+
+
+def answer_cache_lookup(question: str) -> tuple:
+    """
+    Retourne (entrée en cache ou None, clé à réutiliser pour answer_cache_store).
+    """
+    doc_key = rag_scope_key()
+    if not doc_key:
+        return None, None
+    model = load_embedding_model()
+    query_emb = encode_query(model, question) if model is not None else None
+    params = (
+        st.session_state.get("top_k", 10),
+        st.session_state.get("context_budget", CONTEXT_TOKEN_BUDGET),
+        MISTRAL_MODEL,
+        "hybrid" if st.session_state.get("doc_ready", True) else "bm25",
+    )
+    key = (doc_key, question, query_emb, params)
+    return get_answer_cache().lookup(*key), key
+
+
+def answer_cache_store(key: tuple, answer: str, pages: list):
+    if key is None or not answer or answer.startswith("Erreur Mistral"):
+        return
+    get_answer_cache().store(*key, answer, pages)
 
 
 # ============================================================
-# AMÉLIORATION 4 — VECTOR DB FAISS (persistante + scalable)
-# Remplace la recherche linéaire en mémoire
+# AMÉLIORATION 20 — CONTEXTE SOUS BUDGET DE TOKENS
+# Le contexte envoyé au LLM est rempli par pertinence jusqu'à un
+# budget de tokens (tokenizer local), sans texte en double, au lieu
+# du document entier ou d'un nombre fixe de chunks
 # ============================================================
 
-FAISS_INDEX_PATH = os.path.join(CACHE_DIR, "faiss_index.pkl")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+CONTEXT_MIN_OVERLAP = 40        # caractères communs minimum pour retirer un recouvrement
+CONTEXT_SEPARATOR = "\n\n---\n\n"
 
 
-def build_faiss_index(chunks: list, file_key: str):
+@st.cache_resource
+def load_tokenizer():
     """
-    Construit un index FAISS à partir des embeddings des chunks.
-    Sauvegarde l'index sur disque pour éviter la reconstruction.
+    Tokenizer du modèle d'embeddings (fichiers du tokenizer seuls, sans les poids) ;
+    None → estimation à 4 caractères par token.
     """
     try:
-        import faiss
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(f"sentence-transformers/{EMBEDDING_MODEL_NAME}")
+    except Exception:
+        return None
 
-        cache_key = f"faiss_{hashlib.md5(file_key.encode()).hexdigest()}"
-        faiss_path = os.path.join(CACHE_DIR, f"{cache_key}.faiss")
-        meta_path = os.path.join(CACHE_DIR, f"{cache_key}_meta.pkl")
 
-        # Charge index existant
-        if os.path.exists(faiss_path) and os.path.exists(meta_path):
-            index = faiss.read_index(faiss_path)
-            with open(meta_path, "rb") as f:
-                metadata = pickle.load(f)
-            return index, metadata
+def count_tokens(texts: list) -> list:
+    tokenizer = load_tokenizer()
+    if tokenizer is None:
+        return [-(-len(t) // 4) for t in texts]
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=False, verbose=False)["input_ids"]]
 
-        # Construit l'index
-        embeddings = np.array([c["embedding"] for c in chunks if "embedding" in c], dtype=np.float32)
-        if len(embeddings) == 0:
-            return None, None
 
-        dim = embeddings.shape[1]
-        # IndexFlatIP + normalisation = cosine similarity via produit interne
-        faiss.normalize_L2(embeddings)
-        index = faiss.IndexFlatIP(dim)
-        index.add(embeddings)
+def edge_overlap(left: str, right: str, max_len: int = 2 * CHUNK_OVERLAP) -> int:
+    """Longueur du plus long suffixe de left qui est aussi un préfixe de right (0 si < CONTEXT_MIN_OVERLAP)."""
+    for k in range(min(len(left), len(right), max_len), CONTEXT_MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:k]):
+            return k
+    return 0
 
-        # Sauvegarde
-        faiss.write_index(index, faiss_path)
-        metadata = [{"text": c["text"], "pages": c["pages"]} for c in chunks if "embedding" in c]
-        with open(meta_path, "wb") as f:
-            pickle.dump(metadata, f)
 
-        return index, metadata
+def strip_overlap(text: str, kept: list) -> str:
+    """Retire de text ce qu'il partage avec les extraits déjà retenus (inclusion ou recouvrement de bord)."""
+    for other in kept:
+        if text in other:
+            return ""
+        text = text[edge_overlap(other, text):]
+        cut = edge_overlap(text, other)
+        if cut:
+            text = text[:-cut]
+    return text.strip()
 
-    except ImportError:
-        return None, None  # Fallback linéaire si FAISS non installé
 
+def pack_context(chunks: list, budget: int = CONTEXT_TOKEN_BUDGET, header=None) -> tuple:
+    """
+    Remplit le budget de tokens avec les chunks dans l'ordre de pertinence (glouton) :
+    recouvrements retirés, un chunk trop long pour le reste du budget est sauté
+    (un suivant plus court peut encore tenir). header(chunk) → en-tête de l'extrait,
+    compté dans le budget.
+    Retourne (contexte, chunks retenus, stats) ; stats["saved"] = tokens des candidats
+    non envoyés.
+    """
+    separator_tokens = count_tokens([CONTEXT_SEPARATOR])[0]
+    candidate_tokens = sum(count_tokens([c["text"] for c in chunks])) if chunks else 0
+    blocks, selected, kept, used = [], [], [], 0
+    for chunk in chunks:
+        text = strip_overlap(chunk["text"], kept)
+        if not text:
+            continue
+        block = f"{header(chunk)}\n{text}" if header else text
+        cost = count_tokens([block])[0] + (separator_tokens if blocks else 0)
+        if used + cost > budget:
+            continue
+        blocks.append(block)
+        selected.append({**chunk, "text": text})
+        kept.append(text)
+        used += cost
+
+    if not selected and chunks:
+        # Même le meilleur chunk dépasse le budget : il est tronqué plutôt qu'abandonné
+        chunk = chunks[0]
+        ratio = budget / max(1, count_tokens([chunk["text"]])[0])
+        text = chunk["text"][:int(len(chunk["text"]) * ratio)]
+        blocks.append(f"{header(chunk)}\n{text}" if header else text)
+        selected.append({**chunk, "text": text})
+        used = count_tokens(blocks)[0]
+
+    stats = {
+        "tokens": used,
+        "budget": budget,
+        "candidates": len(chunks),
+        "chunks": len(selected),
+        "candidate_tokens": candidate_tokens,
+        "saved": max(0, candidate_tokens - used),
+    }
+    return CONTEXT_SEPARATOR.join(blocks), selected, stats
 
-def faiss_search(index, metadata: list, query_emb: np.ndarray, top_k: int) -> list:
-    """Recherche dans l'index FAISS. Retourne les top_k chunks les plus proches."""
-    try:
-        import faiss
-        query = np.array([query_emb], dtype=np.float32)
-        faiss.normalize_L2(query)
-        _, indices = index.search(query, top_k)
-        return [metadata[i] for i in indices[0] if i < len(metadata)]
-    except Exception:
-        return []
 
+# ============================================================
+# PIPELINE RETRIEVAL COMPLET
+# ============================================================
+
+FULL_TEXT_MAX_CHARS = 25000  # synthèse : en dessous, le document entier en un seul appel
 
-def retrieve_hybrid_faiss(chunks: list, question: str, top_k: int = 6, model=None, file_key: str = "") -> tuple:
+def corpus_query_ids() -> list:
     """
-    Hybrid retrieval avec FAISS si disponible, sinon fallback linéaire.
+    Documents du corpus à interroger, ou [] pour le seul document actif
+    (sélection vide, ou réduite au document actif).
     """
-    # Tentative FAISS
-    if model is not None and file_key:
-        faiss_index, faiss_meta = build_faiss_index(chunks, file_key)
-        if faiss_index is not None and faiss_meta is not None:
-            query_emb = model.encode([question])[0]
+    if not st.session_state.get("doc_ready", True):
+        return []  # document actif pas encore dans le corpus (ingestion de fond en cours)
+    own = session_corpus_names(get_corpus())
+    doc_ids = [d for d in st.session_state.get("corpus_filter", []) if d in own]
+    if not doc_ids or doc_ids == [st.session_state.get("doc_key")]:
+        return []
+    return doc_ids
 
-            # Recherche FAISS (sémantique)
-            faiss_results = faiss_search(faiss_index, faiss_meta, query_emb, top_k)
-
-            # Recherche BM25
-            bm25_scores_list = [(bm25_score(c, question), i) for i, c in enumerate(chunks)]
-            bm25_top = [chunks[i] for _, i in sorted(bm25_scores_list, key=lambda x: -x[0])[:top_k]]
-
-            # Fusion simple : union des deux listes (dédupliquée par texte)
-            seen = set()
-            combined = []
-            for c in faiss_results + bm25_top:
-                key = c["text"][:100]
-                if key not in seen:
-                    seen.add(key)
-                    combined.append(c)
-
-            selected = combined[:top_k]
-            context = "\n\n---\n\n".join(c["text"] for c in selected)
-            all_pages = []
-            for c in selected:
-                all_pages.extend(c["pages"])
-            return context, sorted(set(all_pages)), selected
 
-    # Fallback : hybrid retrieval linéaire (original)
-    return retrieve_hybrid(chunks, question, top_k=top_k, model=model)
+def rag_scope_key() -> str:
+    """Clé des caches de réponses / scores : document actif ou sous-ensemble du corpus."""
+    doc_ids = corpus_query_ids()
+    if not doc_ids:
+        return st.session_state.get("doc_key", "")
+    return "corpus_" + hashlib.blake2b("|".join(sorted(doc_ids)).encode(), digest_size=16).hexdigest()
 
 
-# ============================================================
-# PIPELINE RETRIEVAL COMPLET
-# ============================================================
+def pack_ranked_context(question: str, candidates: list, fused_scores: list, header=None) -> tuple:
+    """Reranking de tous les candidats puis remplissage du budget de tokens par pertinence."""
+    with span("rerank", candidates=len(candidates)):
+        ranked = rerank_chunks(
+            candidates, question, load_reranker(), top_k=len(candidates),
+            fused_scores=fused_scores, doc_key=rag_scope_key()
+        )
+    budget = st.session_state.get("context_budget", CONTEXT_TOKEN_BUDGET)
+    with span("context_pack", budget=budget) as sp:
+        context, selected, stats = pack_context(ranked, budget, header)
+        if sp is not None:
+            sp.attributes.update(tokens=stats["tokens"], tokens_saved=stats["saved"])
+    st.session_state.last_context_stats = stats
+    return context, selected
+
+
+def prepare_corpus_context(question: str, doc_ids: list) -> tuple:
+    """Retrieval + reranking sur plusieurs documents ; sources = [(document, page)]."""
+    corpus = get_corpus()
+    with span("corpus_retrieval", documents=len(doc_ids)):
+        _, _, candidates, fused_scores = retrieve_corpus(
+            corpus, question, top_k=st.session_state.get("top_k", 10),
+            model=load_embedding_model(), doc_ids=doc_ids, with_scores=True
+        )
+
+    # Chaque extrait est annoncé par son document et ses pages, pour des citations précises
+    names = session_corpus_names(corpus)
+    context, selected = pack_ranked_context(
+        question, candidates, fused_scores,
+        header=lambda c: f"[{names.get(c['doc_id'], '?')} — page {', '.join(str(p) for p in c['pages'])}]"
+    )
+    return context, corpus_sources(names, selected)
+
+
+def prepare_rag_context(question: str) -> tuple:
+    """
+    Construit le contexte envoyé au LLM et les pages sources.
+    Retourne (None, []) si aucun document n'est chargé.
+    """
+    doc_ids = corpus_query_ids()
+    if doc_ids:
+        return prepare_corpus_context(question, doc_ids)
+
+    doc = session_document()
+    if doc is None:
+        return None, []
+    chunks = doc["chunks"]
+
+    # Embeddings encore en cours d'encodage (ingestion de fond) : BM25 seul en attendant
+    embedding_model = load_embedding_model() if st.session_state.get("doc_ready", True) else None
+
+    # Étape 1 : Hybrid retrieval (avec FAISS si dispo) — AMÉLIORATION 6 : 10 candidats par défaut
+    _, _, candidates, fused_scores = retrieve_hybrid_faiss(
+        chunks, question, top_k=st.session_state.get("top_k", 10), model=embedding_model,
+        file_key=st.session_state.get("doc_key", ""), bm25_index=doc["bm25"],
+        emb_matrix=doc["embeddings"], with_scores=True
+    )
+
+    if not candidates:
+        # Aucun terme commun et pas d'embeddings : début du document, dans l'ordre
+        candidates, fused_scores = list(chunks[:st.session_state.get("top_k", 10)]), None
+
+    # Étape 2 : Reranking cross-encoder, puis contexte rempli jusqu'au budget de tokens
+    context, selected = pack_ranked_context(question, candidates, fused_scores)
+    source_pages = sorted({p for c in selected for p in c["pages"]})
+    return context, source_pages
+
 
 def ask_full_or_rag(client, question: str) -> tuple:
-    full_text = st.session_state.get("full_text", "")
-    chunks = st.session_state.get("chunks", [])
-    file_key = st.session_state.get("loaded_file", "")
+    # Réponse servie depuis le cache : pas de contexte construit, pas de stats à afficher
+    st.session_state.last_context_stats = None
+    with span("answer_cache_lookup"):
+        cached, cache_key = answer_cache_lookup(question)
+    if cached is not None:
+        return cached["answer"], cached["pages"]
 
-    if not full_text:
+    context, source_pages = prepare_rag_context(question)
+    if context is None:
         return "Aucun document chargé.", []
+    response = ask_mistral(client, context, question)
+    answer_cache_store(cache_key, response, source_pages)
+    return response, source_pages
 
-    embedding_model = load_embedding_model()
-    reranker = load_reranker()
-
-    if len(full_text) <= 25000:
-        response = ask_mistral(client, full_text, question)
-        _, source_pages, _ = retrieve_hybrid_faiss(
-            chunks, question, top_k=3, model=embedding_model, file_key=file_key
-        )
-        return response, source_pages
-    else:
-        # AMÉLIORATION 6 — top_k_retrieve par défaut = 10 (plus large)
-        top_k_retrieve = st.session_state.get("top_k", 10)
-        top_k_rerank = st.session_state.get("top_k_rerank", 3)
 
-        # Étape 1 : Hybrid retrieval (avec FAISS si dispo)
-        context_raw, _, candidates = retrieve_hybrid_faiss(
-            chunks, question, top_k=top_k_retrieve, model=embedding_model, file_key=file_key
-        )
+def ask_full_or_rag_stream(client, question: str) -> tuple:
+    """
+    Variante streaming : le retrieval est fait avant de rendre la main,
+    la réponse arrive ensuite token par token.
+    Retourne (générateur de tokens, pages sources).
+    """
+    st.session_state.last_context_stats = None
+    with span("answer_cache_lookup"):
+        cached, cache_key = answer_cache_lookup(question)
+    if cached is not None:
+        return iter([cached["answer"]]), cached["pages"]
 
-        # Étape 2 : Reranking cross-encoder
-        reranked = rerank_chunks(candidates, question, reranker, top_k=top_k_rerank)
+    context, source_pages = prepare_rag_context(question)
+    if context is None:
+        return iter(["Aucun document chargé."]), []
 
-        context = "\n\n---\n\n".join(c["text"] for c in reranked)
-        all_pages = []
-        for c in reranked:
-            all_pages.extend(c["pages"])
-        source_pages = sorted(set(all_pages))
+    def stream_and_cache():
+        tokens, failed = [], False
+        for token in ask_mistral_stream(client, context, question):
+            failed = failed or isinstance(token, MistralStreamError)
+            tokens.append(token)
+            yield token
+        # Réponse tronquée par une erreur : jamais mise en cache
+        if not failed:
+            answer_cache_store(cache_key, "".join(tokens), source_pages)
 
-        response = ask_mistral(client, context, question)
-        return response, source_pages
+    return stream_and_cache(), source_pages
 
 
 # ============================================================
 # CLIENT MISTRAL
 # ============================================================
 
+MISTRAL_MODEL = "mistral-large-latest"
+MISTRAL_MAX_IN_FLIGHT = int(os.getenv("MISTRAL_MAX_IN_FLIGHT", "4"))
+MISTRAL_MAX_RETRIES = int(os.getenv("MISTRAL_MAX_RETRIES", "5"))
+MISTRAL_SERVER_URL = os.getenv("MISTRAL_SERVER_URL") or None
+
+
+@st.cache_resource
+def get_llm_pool(api_key: str, server_url: str = None, fake: bool = False):
+    """
+    Un pool par clé API, partagé entre toutes les sessions : la limite de
+    requêtes simultanées et les retries s'appliquent à l'ensemble de l'application.
+    """
+    if fake:
+        client = FakeMistralClient()
+    elif server_url:
+        client = Mistral(api_key=api_key, server_url=server_url)
+    else:
+        client = Mistral(api_key=api_key)
+    return MistralPool(client, max_in_flight=MISTRAL_MAX_IN_FLIGHT, max_retries=MISTRAL_MAX_RETRIES)
+
+
 def get_client():
+    # Client local sans réseau (tests hors ligne, démo)
+    if os.getenv("MISTRAL_FAKE") == "1":
+        return get_llm_pool("fake", fake=True)
     api_key = st.secrets.get("MISTRAL_API_KEY") or os.getenv("MISTRAL_API_KEY")
     if not api_key:
         return None
-    return Mistral(api_key=api_key)
+    return get_llm_pool(api_key, MISTRAL_SERVER_URL)
+
+
+def build_messages(context: str, question: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"CONTEXTE:\n{context}\n\nQUESTION: {question}"}
+    ]
+
+
+def mistral_request(context: str, question: str) -> dict:
+    return {
+        "model": MISTRAL_MODEL,
+        "messages": build_messages(context, question),
+        "temperature": 0,
+        "max_tokens": 1500,
+    }
+
+
+def judge_request(prompt: str, max_tokens: int) -> dict:
+    """Requête LLM-as-judge (évaluation RAG) : même modèle que les réponses évaluées."""
+    return {
+        "model": MISTRAL_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0,
+        "max_tokens": max_tokens,
+    }
 
 
 def ask_mistral(client, context: str, question: str) -> str:
     try:
-        response = client.chat.complete(
-            model="mistral-large-latest",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": f"CONTEXTE:\n{context}\n\nQUESTION: {question}"}
-            ],
-            temperature=0,
-            max_tokens=1500
-        )
+        with span("mistral_call", model=MISTRAL_MODEL, context_chars=len(context)):
+            response = client.chat.complete(**mistral_request(context, question))
         return response.choices[0].message.content
     except Exception as e:
         return f"Erreur Mistral : {e}"
 
 
+class MistralStreamError(str):
+    """Message d'erreur émis par ask_mistral_stream : reconnaissable même après des tokens valides."""
+
+
+def ask_mistral_stream(client, context: str, question: str):
+    """
+    Streaming token par token (client.chat.stream du SDK Mistral).
+    Le premier token s'affiche dès sa génération au lieu d'attendre la réponse complète.
+    En cas d'échec (même en cours de route), le dernier élément est une MistralStreamError.
+    """
+    try:
+        with span("mistral_call", model=MISTRAL_MODEL, context_chars=len(context), stream=True):
+            stream = client.chat.stream(**mistral_request(context, question))
+            for event in stream:
+                delta = event.data.choices[0].delta.content
+                if isinstance(delta, str) and delta:
+                    yield delta
+    except Exception as e:
+        yield MistralStreamError(f"Erreur Mistral : {e}")
+
+
+def format_page_list(pages) -> str:
+    """[1, 2, 3, 7, 9, 10] → « 1–3, 7, 9–10 » (un passage dédoublonné peut couvrir beaucoup de pages)."""
+    pages = sorted(set(pages))
+    runs = []
+    for p in pages:
+        if runs and p == runs[-1][1] + 1:
+            runs[-1][1] = p
+        else:
+            runs.append([p, p])
+    return ", ".join(str(a) if a == b else f"{a}–{b}" for a, b in runs)
+
+
 def format_sources(pages: list) -> str:
+    """Pages du document actif ([3, 5]) ou du corpus ([(document, page)])."""
     if not pages:
         return ""
+    if isinstance(pages[0], (list, tuple)):
+        by_doc = {}
+        for name, page in pages:
+            by_doc.setdefault(name, []).append(page)
+        return "📄 Sources : " + " • ".join(
+            f"{name} (p. {format_page_list(doc_pages)})" for name, doc_pages in by_doc.items()
+        )
     if len(pages) == 1:
         return f"📄 Source : Page {pages[0]}"
-    return f"📄 Sources : Pages {', '.join(str(p) for p in pages)}"
+    return f"📄 Sources : Pages {format_page_list(pages)}"
+
+
+def format_dedup_stats(stats: dict) -> str:
+    return (
+        f"♻️ Dédoublonnage : {stats['duplicates']} chunks en double retirés sur {stats['chunks_before']} "
+        f"({stats['embeddings_saved']} embeddings évités) • "
+        f"{stats['margin_lines']} lignes d'en-tête / pied de page retirées"
+    )
+
+
+def format_context_stats(stats: dict) -> str:
+    return (
+        f"🧮 Contexte : {stats['tokens']:,} tokens / {stats['budget']:,} • {stats['chunks']}/{stats['candidates']} "
+        f"extraits • {stats['saved']:,} tokens économisés"
+    )
+
+
+# ============================================================
+# AMÉLIORATION 13 — RÉSUMÉ MAP-REDUCE PARALLÈLE
+# Tout le document est lu : résumés partiels en parallèle (map),
+# fusion hiérarchique (reduce), résumés intermédiaires en cache disque
+# ============================================================
+
+SUMMARY_GROUP_CHARS = 12000   # taille max d'un groupe de chunks (étape map)
+SUMMARY_REDUCE_FAN_IN = 6     # résumés fusionnés par appel (étape reduce)
+SUMMARY_CACHE_DIR = os.path.join(CACHE_DIR, "summaries")
+
+SUMMARY_MAP_PROMPT = (
+    "Résume fidèlement cet extrait du document en conservant les faits, chiffres, "
+    "noms et conclusions importants. Réponds uniquement avec le résumé."
+)
+SUMMARY_REDUCE_PROMPT = (
+    "Ces textes sont des résumés partiels consécutifs d'un même document. "
+    "Fusionne-les en un seul résumé cohérent, sans perdre d'information importante."
+)
+
+
+def group_chunks(chunks, max_chars: int = SUMMARY_GROUP_CHARS) -> list:
+    """Regroupe les chunks consécutifs en groupes d'au plus max_chars caractères."""
+    groups, current, size = [], [], 0
+    for c in chunks:
+        if current and size + len(c["text"]) > max_chars:
+            groups.append(current)
+            current, size = [], 0
+        current.append(c)
+        size += len(c["text"])
+    if current:
+        groups.append(current)
+    return groups
+
+
+def ask_mistral_many(client, jobs: list, progress_callback=None) -> list:
+    """
+    Exécute [(context, question)] ; ordre conservé. Avec le pool Mistral, toutes
+    les requêtes sont soumises d'un coup : le pool borne la concurrence et gère les retries.
+    """
+    results = [None] * len(jobs)
+    if not isinstance(client, MistralPool):
+        for i, (ctx, q) in enumerate(jobs):
+            results[i] = ask_mistral(client, ctx, q)
+            if progress_callback:
+                progress_callback(i + 1, len(jobs))
+        return results
+
+    with span("mistral_fan_out", requests=len(jobs)):
+        futures = {client.submit(**mistral_request(ctx, q)): i for i, (ctx, q) in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                results[futures[future]] = future.result().choices[0].message.content
+            except Exception as e:
+                results[futures[future]] = f"Erreur Mistral : {e}"
+            if progress_callback:
+                progress_callback(done, len(jobs))
+    return results
+
+
+def build_intermediate_summaries(client, chunks, doc_key: str, progress_callback=None) -> list:
+    """
+    Map (un résumé par groupe de chunks) puis reduce hiérarchique jusqu'à
+    au plus SUMMARY_REDUCE_FAN_IN résumés. Indépendant du niveau Court/Moyen/Détaillé :
+    changer de niveau ou recliquer ne coûte que la fusion finale.
+    """
+    path = os.path.join(SUMMARY_CACHE_DIR, f"{doc_key}.json")
+    if doc_key and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            pass
+
+    groups = group_chunks(chunks)
+    summaries = ask_mistral_many(
+        client,
+        [("\n\n".join(c["text"] for c in g), SUMMARY_MAP_PROMPT) for g in groups],
+        progress_callback
+    )
+    while len(summaries) > SUMMARY_REDUCE_FAN_IN:
+        batches = [
+            summaries[i:i + SUMMARY_REDUCE_FAN_IN]
+            for i in range(0, len(summaries), SUMMARY_REDUCE_FAN_IN)
+        ]
+        summaries = ask_mistral_many(
+            client,
+            [("\n\n---\n\n".join(b), SUMMARY_REDUCE_PROMPT) for b in batches],
+            progress_callback
+        )
+
+    # Pas de cache si un appel a échoué (on retentera au prochain clic)
+    if doc_key and not any(s.startswith("Erreur Mistral") for s in summaries):
+        os.makedirs(SUMMARY_CACHE_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, ensure_ascii=False)
+    return summaries
+
+
+def summarize_map_reduce(client, chunks, doc_key: str, longueur: str, progress_callback=None) -> str:
+    summaries = build_intermediate_summaries(client, chunks, doc_key, progress_callback)
+    question = (
+        f"Fais un résumé structuré {longueur} de ce document, "
+        f"avec des sections claires."
+    )
+    return ask_mistral(client, "\n\n---\n\n".join(summaries), question)
+
+
+# ============================================================
+# AMÉLIORATION 23 — AUDIO PAR SEGMENTS (parallèle + cache disque)
+# La page est découpée aux fins de phrases, les segments sont
+# synthétisés en parallèle puis concaténés dans l'ordre ; le MP3
+# final est mis en cache par (document, page, langue)
+# ============================================================
+
+TTS_SEGMENT_CHARS = int(os.getenv("TTS_SEGMENT_CHARS", "400"))
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+TTS_CACHE_DIR = os.path.join(CACHE_DIR, "audio")
+
+
+def get_tts_class():
+    # Synthèse locale sans réseau (tests hors ligne, démo)
+    if os.getenv("TTS_FAKE") == "1":
+        from fake_tts import FakeTTS
+        return FakeTTS
+    return gTTS
+
+
+def split_sentences(text: str, max_chars: int = TTS_SEGMENT_CHARS) -> list:
+    """Segments d'au plus max_chars caractères, coupés aux fins de phrases (ou aux espaces si une phrase est trop longue)."""
+    sentences = re.split(r'(?<=[.!?…;:])\s+|\n{2,}', text.strip())
+    segments, current = [], ""
+    for sentence in sentences:
+        sentence = " ".join(sentence.split())
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                segments.append(current)
+                current = ""
+            segments.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            segments.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+def synthesize_segment(text: str, lang: str) -> bytes:
+    audio_io = BytesIO()
+    get_tts_class()(text=text, lang=lang).write_to_fp(audio_io)
+    return audio_io.getvalue()
+
+
+def tts_cache_path(doc_key: str, page: int, lang: str) -> str:
+    return os.path.join(TTS_CACHE_DIR, doc_key, f"p{page}_{lang}.mp3")
+
+
+def page_audio(doc_key: str, page: int, text: str, lang: str, on_segment=None) -> tuple:
+    """
+    MP3 de la page : (octets, depuis_le_cache). on_segment(i, n, mp3) est appelé
+    dans l'ordre dès que le segment i est prêt (lecture du début avant la fin).
+    Les trames MP3 se concatènent telles quelles (gTTS fait de même en interne).
+    """
+    path = tts_cache_path(doc_key, page, lang) if doc_key else None
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read(), True
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    segments = split_sentences(text)
+    if not segments:
+        return b"", False
+    parts = []
+    with span("tts", segments=len(segments), lang=lang):
+        with ThreadPoolExecutor(max_workers=max(1, min(TTS_WORKERS, len(segments))), thread_name_prefix="tts") as pool:
+            futures = [pool.submit(synthesize_segment, seg, lang) for seg in segments]
+            for i, future in enumerate(futures):
+                parts.append(future.result())
+                if on_segment:
+                    on_segment(i, len(segments), parts[-1])
+    audio = b"".join(parts)
+
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"  # sessions = threads du même processus
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+    return audio, False
 
 
 # ============================================================
@@ -569,12 +3367,9 @@ def evaluate_rag_answer(client, question: str, context: str, answer: str, chunks
             "context_recall : le contexte contient-il les infos nécessaires ? (1.0 = parfait)"
         )
         try:
-            raw = client.chat.complete(
-                model="mistral-large-latest",
-                messages=[{"role": "user", "content": cr_prompt}],
-                temperature=0,
-                max_tokens=200
-            ).choices[0].message.content.strip()
+            with span("mistral_call", model=MISTRAL_MODEL, judge="context_recall"):
+                response = client.chat.complete(**judge_request(cr_prompt, max_tokens=200))
+            raw = response.choices[0].message.content.strip()
             raw = re.sub(r"```(?:json)?", "", raw).strip("` \n")
             s, e = raw.find("{"), raw.rfind("}") + 1
             cr_data = json.loads(raw[s:e])
@@ -604,12 +3399,9 @@ def evaluate_rag_answer(client, question: str, context: str, answer: str, chunks
         "- context_recall : le contexte contient les infos pour répondre (1.0 = contexte complet)"
     )
     try:
-        raw = client.chat.complete(
-            model="mistral-large-latest",
-            messages=[{"role": "user", "content": eval_prompt}],
-            temperature=0,
-            max_tokens=500
-        ).choices[0].message.content.strip()
+        with span("mistral_call", model=MISTRAL_MODEL, judge="llm-as-judge"):
+            response = client.chat.complete(**judge_request(eval_prompt, max_tokens=500))
+        raw = response.choices[0].message.content.strip()
         raw = re.sub(r"```(?:json)?", "", raw).strip("` \n")
         start, end = raw.find("{"), raw.rfind("}") + 1
         result = json.loads(raw[start:end])
@@ -635,6 +3427,65 @@ def render_metric_bar(label: str, value: float, reason: str):
     """, unsafe_allow_html=True)
 
 
+# ============================================================
+# AMÉLIORATION 14 — TRACING PAR ÉTAPE (temps mural, CPU, mémoire)
+# Spans autour de l'ingestion et du chemin de question ; export
+# JSON lines / OTLP. Désactivé : aucun coût (contexte vide partagé)
+# ============================================================
+
+TRACE_ENABLED = os.getenv("INSIGHT_TRACE") == "1"
+TRACE_EXPORT_PATH = os.getenv("INSIGHT_TRACE_FILE")  # JSON lines, ajout en fin de fichier
+
+
+def new_tracer(name: str):
+    """Tracer pour une opération, ou None si le tracing est désactivé."""
+    if st.session_state.get("trace_enabled", TRACE_ENABLED):
+        return Tracer(name)
+    return None
+
+
+def finish_trace(tracer, state_key: str):
+    if tracer is None:
+        return
+    st.session_state[state_key] = tracer
+    if TRACE_EXPORT_PATH:
+        try:
+            with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                f.write(tracer.to_jsonl())
+        except OSError as e:
+            st.warning(f"⚠️ Export des traces impossible : {e}")
+
+
+def render_performance_panel(tracer, title: str, key: str):
+    spans = tracer.summary()
+    if not spans:
+        return
+    depth = {}
+    for sp in spans:
+        depth[sp["span_id"]] = depth.get(sp["parent_id"], -1) + 1 if sp["parent_id"] else 0
+
+    with st.expander(f"⏱️ Performance — {title}"):
+        import pandas as pd
+        df = pd.DataFrame([{
+            "étape": "　" * depth[sp["span_id"]] + sp["name"],
+            "mural (ms)": sp["wall_ms"],
+            "CPU (ms)": sp["cpu_ms"],
+            "Δ mémoire (Ko)": sp["mem_delta_kb"],
+        } for sp in spans])
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        col_a, col_b = st.columns(2)
+        with col_a:
+            st.download_button(
+                "⬇️ JSON lines", tracer.to_jsonl(), file_name="trace.jsonl",
+                mime="application/jsonl", key=f"dl_trace_jsonl_{key}"
+            )
+        with col_b:
+            st.download_button(
+                "⬇️ OpenTelemetry (OTLP)", json.dumps(tracer.to_otlp()), file_name="trace_otlp.json",
+                mime="application/json", key=f"dl_trace_otlp_{key}"
+            )
+
+
 # ============================================================
 # EXPORT PDF CONVERSATION
 # ============================================================
@@ -682,11 +3533,7 @@ def export_chat_to_pdf(messages: list, doc_name: str) -> bytes:
             if pages:
                 pdf.set_font("Helvetica", "I", 9)
                 pdf.set_text_color(100, 100, 200)
-                src = (
-                    f"Sources : Pages {', '.join(str(p) for p in pages)}"
-                    if len(pages) > 1 else f"Source : Page {pages[0]}"
-                )
-                pdf.cell(0, 6, clean(src), ln=True)
+                pdf.cell(0, 6, clean(format_sources(pages).replace("📄 ", "")), ln=True)
 
         pdf.ln(4)
 
@@ -731,44 +3578,95 @@ def create_pptx(data):
 # INTERFACE
 # ============================================================
 
-st.title("✨ Insight PDF Pro")
-st.caption(f"Développé par Herman Kandolo • {datetime.now().year}")
-
-client = get_client()
-if not client:
-    st.error("⚠️ Clé API Mistral manquante. Ajoutez MISTRAL_API_KEY dans les secrets Streamlit.")
-    st.stop()
-
-# --- SIDEBAR ---
-with st.sidebar:
-    st.subheader("📤 Importation")
-    uploaded_file = st.file_uploader("Choisir un PDF", type="pdf", label_visibility="collapsed")
-
-    if uploaded_file:
-        file_key = uploaded_file.name
-        if st.session_state.get("loaded_file") != file_key:
-            with st.spinner("Extraction et découpage du texte…"):
-                pages_text = extract_pdf_data(uploaded_file)
-                if not pages_text:
-                    st.error("Le PDF semble vide ou non lisible (PDF scanné ?).")
-                    st.stop()
-                # Semantic chunking
-                chunks, full_text = split_into_chunks(pages_text)
-
-                # Embeddings avec cache persistant
-                emb_model = load_embedding_model()
-                if emb_model:
-                    with st.spinner("Encodage sémantique des chunks (avec cache)…"):
-                        chunks = encode_chunks(chunks, emb_model, file_key)
-
-                st.session_state.pdf_pages = pages_text
-                st.session_state.full_text = full_text
-                st.session_state.chunks = chunks
-                st.session_state.messages = []
-                st.session_state.loaded_file = file_key
+def main():
+    st.set_page_config(page_title="Insight PDF Pro", page_icon="✨", layout="wide")
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+    st.title("✨ Insight PDF Pro")
+    st.caption(f"Développé par Herman Kandolo • {datetime.now().year}")
+
+    # Modèles chargés et préchauffés en arrière-plan dès la première session du processus
+    startup = start_model_warm_up() if MODEL_WARMUP else None
+
+    client = get_client()
+    if not client:
+        st.error("⚠️ Clé API Mistral manquante. Ajoutez MISTRAL_API_KEY dans les secrets Streamlit.")
+        st.stop()
+
+    # --- SIDEBAR ---
+    with st.sidebar:
+        st.subheader("📤 Importation")
+        uploaded_files = st.file_uploader(
+            "Choisir des PDF", type="pdf", accept_multiple_files=True, label_visibility="collapsed"
+        )
+        corpus = get_corpus()
+        queue = get_ingestion_queue()
+        ingested = st.session_state.setdefault("ingested", set())
+        jobs_seen = st.session_state.setdefault("ingest_jobs", {})
+        session_docs = st.session_state.setdefault("session_docs", {})
+
+        # Chaque nouveau PDF part en ingestion de fond : le script continue immédiatement
+        own_docs = session_corpus_names(corpus)
+        for uploaded_file in uploaded_files or []:
+            pdf_bytes = uploaded_file.getvalue()
+            emb_model = load_embedding_model()
+            doc_key = compute_doc_key(pdf_bytes, model_name=embedding_cache_name(emb_model))
+            if doc_key in ingested:
+                continue
+            # Révision seulement parmi les documents de la session, et sur choix explicite
+            previous_key = next(
+                (k for k, n in own_docs.items() if n == uploaded_file.name and k != doc_key), None
+            )
+            if previous_key is not None:
+                choice = st.radio(
+                    f"« {uploaded_file.name} » est déjà dans vos documents :",
+                    ["Nouvelle version (seules les pages modifiées sont recalculées)", "Document distinct"],
+                    index=None, key=f"revision_{doc_key}"
+                )
+                if choice is None:
+                    continue  # ingestion en attente du choix
+                if choice == "Document distinct":
+                    previous_key = None
+            ingested.add(doc_key)
+            session_docs[doc_key] = uploaded_file.name
+            if previous_key:
+                st.session_state.setdefault("revision_of", {})[doc_key] = previous_key
+            queue.submit(pdf_bytes, doc_key, uploaded_file.name, emb_model, tracer=new_tracer("ingestion"),
+                         previous_key=previous_key)
+            jobs_seen[doc_key] = "pending"
+
+        for job in update_ingestion_jobs(queue):
+            # Job partagé si un autre utilisateur a importé le même PDF : on affiche le nom de la session
+            name = session_docs.get(job.doc_key, job.name)
+            # Job partagé : seule la session qui a demandé la révision retire l'ancienne version
+            previous_key = st.session_state.get("revision_of", {}).pop(job.doc_key, None)
+            if job.status == "error":
+                st.error(f"{name} : {job.error}")
+                continue
+            finish_trace(job.tracer, "last_ingest_trace")
+            if job.revision and previous_key:
+                session_docs.pop(previous_key, None)
+            # Le document rejoint les documents interrogés dès que son index vectoriel est prêt
+            query_ids = st.session_state.get("corpus_filter", [])
+            if job.doc_key not in query_ids:
+                st.session_state.corpus_filter = query_ids + [job.doc_key]
+
+            if job.from_cache:
+                st.info(f"⚡ {name} chargé depuis le cache (aucun recalcul).")
+            if previous_key and previous_key == job.previous_key and not job.revision:
+                st.info(
+                    f"ℹ️ {name} diffère trop de la version précédente (moins de "
+                    f"{REVISION_MIN_OVERLAP:.0%} de pages identiques) : importé comme document distinct."
+                )
+            if job.revision:
+                rev = job.revision
+                st.info(
+                    f"♻️ Nouvelle version de {name} : {len(rev['changed_pages'])} pages modifiées • "
+                    f"{rev['added_chunks']} chunks réindexés, {rev.get('reused_chunks', 0)} repris tels quels."
+                )
 
             # Status des améliorations actives
-            emb_status = "✅ embeddings" if emb_model else "⚠️ BM25 only"
+            emb_status = "✅ embeddings" if load_embedding_model() else "⚠️ BM25 only"
             try:
                 import faiss
                 faiss_status = "✅ FAISS"
@@ -781,342 +3679,474 @@ with st.sidebar:
                 parser_status = "PyPDF2"
 
             st.success(
-                f"✅ {len(pages_text)} pages • {len(chunks)} chunks\n"
+                f"✅ {name} : {job.pages} pages • {job.chunks} chunks "
+                f"({job.finished - job.submitted:.1f}s)\n"
                 f"{emb_status} • {faiss_status} • parser: {parser_status}"
             )
-        else:
-            st.info(f"📄 {file_key} déjà chargé.")
-
-    if "pdf_pages" in st.session_state:
-        with st.expander("ℹ️ Détails & Paramètres RAG"):
-            st.metric("Pages", len(st.session_state.pdf_pages))
-            st.metric("Chunks RAG", len(st.session_state.get("chunks", [])))
-            st.metric("Caractères", f"{len(st.session_state.full_text):,}")
-            st.divider()
-            st.caption("🔍 Retrieval")
-            # AMÉLIORATION 6 — défaut = 10 (plus large pour meilleur recall)
-            st.session_state.top_k = st.slider(
-                "Chunks candidats (retrieval)", 3, 12,
-                st.session_state.get("top_k", 10),
-                help="Nombre de chunks récupérés avant reranking (recommandé : 8-12)"
-            )
-            st.caption("🏆 Reranking")
-            st.session_state.top_k_rerank = st.slider(
-                "Chunks finaux (après reranking)", 1, 5,
-                st.session_state.get("top_k_rerank", 3),
-                help="Chunks envoyés au LLM après cross-encoder (recommandé : 3-5)"
-            )
+            if job.dedup and not job.from_cache and (job.dedup["duplicates"] or job.dedup["margin_lines"]):
+                st.info(format_dedup_stats(job.dedup))
 
+        if jobs_seen:
+            render_ingestion_jobs()
 
-# --- ONGLETS ---
-if "pdf_pages" in st.session_state:
-    tabs = st.tabs([
-        "💬 Chat", "📝 Synthèse", "📊 Analyse",
-        "🔊 Audio", "🎯 Présentation", "📐 Évaluation RAG"
-    ])
-
-    # ── TAB 1 : CHAT ─────────────────────────────────────────
-    with tabs[0]:
-        is_long = len(st.session_state.full_text) > 25000
-        emb_ready = all("embedding" in c for c in st.session_state.get("chunks", []))
-        reranker_ready = load_reranker() is not None
-
-        col_info, col_export = st.columns([4, 1])
-        with col_info:
-            flags = []
-            if is_long:
-                flags.append(f"RAG actif ({len(st.session_state.chunks)} chunks)")
-            if emb_ready:
-                flags.append("embeddings ✅")
-            if reranker_ready:
-                flags.append("reranking ✅")
-            try:
-                import faiss
-                flags.append("FAISS ✅")
-            except ImportError:
-                pass
-            if flags:
-                st.caption("📚 " + " • ".join(flags))
+        # Documents de la session seulement ; lisibles dont les embeddings sont encore en cours
+        names = session_corpus_names(corpus)
+        readable = {
+            k: session_docs.get(k, queue.get(k).name) for k, m in jobs_seen.items() if m == "readable"
+        }
+        if names or readable:
+            st.subheader("📚 Corpus")
+            choices = {**names, **{k: f"⏳ {n}" for k, n in readable.items()}}
+            doc_ids = list(choices)
+            if st.session_state.get("active_doc") not in choices:
+                st.session_state.active_doc = doc_ids[-1]
+            active_doc = st.selectbox(
+                "Document actif", doc_ids, format_func=choices.get, key="active_doc",
+                help="Document utilisé par la synthèse, l'analyse, l'audio, la présentation et l'évaluation"
+            )
+            if names:
+                st.session_state.corpus_filter = [
+                    d for d in st.session_state.get("corpus_filter", list(names)) if d in names
+                ]
+                st.multiselect(
+                    "Documents interrogés (chat)", list(names), format_func=names.get, key="corpus_filter",
+                    help="Le chat cherche dans tous ces documents et cite document + page"
+                )
+                st.caption(f"{len(names)} documents")
 
-        with col_export:
-            if st.session_state.get("messages"):
-                pdf_bytes = export_chat_to_pdf(
-                    st.session_state.messages,
-                    st.session_state.get("loaded_file", "document")
+            # Un document en cours d'encodage est rechargé à chaque rerun jusqu'à ce qu'il soit complet
+            if st.session_state.get("doc_key") != active_doc or not st.session_state.get("doc_ready", True):
+                if active_doc in names:
+                    if get_document_registry().get(active_doc) is not None:
+                        load_document_state(active_doc, names[active_doc])
+                else:
+                    job = queue.get(active_doc)
+                    if job is not None and job.readable is not None:
+                        load_document_state(active_doc, readable[active_doc], ready=False)
+
+        doc = session_document()
+        if doc is not None:
+            with st.expander("ℹ️ Détails & Paramètres RAG"):
+                st.metric("Pages", len(doc["pages_text"]))
+                st.metric("Chunks RAG", len(doc["chunks"]))
+                st.metric("Caractères", f"{doc['pages_text'].char_count:,}")
+                st.divider()
+                st.caption("🔍 Retrieval")
+                # AMÉLIORATION 6 — défaut = 10 (plus large pour meilleur recall)
+                st.session_state.top_k = st.slider(
+                    "Chunks candidats (retrieval)", 3, 12,
+                    st.session_state.get("top_k", 10),
+                    help="Nombre de chunks récupérés avant reranking (recommandé : 8-12)"
+                )
+                st.caption("🏆 Reranking & contexte")
+                st.session_state.context_budget = st.slider(
+                    "Budget de contexte (tokens)", 1000, 12000,
+                    st.session_state.get("context_budget", CONTEXT_TOKEN_BUDGET), step=500,
+                    help="Les chunks reclassés sont ajoutés par pertinence jusqu'à ce budget (sans doublons)"
+                )
+                st.caption("⏱️ Performance")
+                st.session_state.trace_enabled = st.toggle(
+                    "Tracing par étape",
+                    st.session_state.get("trace_enabled", TRACE_ENABLED),
+                    help="Temps mural, CPU et mémoire de chaque étape (panneau Performance du chat)"
+                )
+                st.caption("💬 Réponses")
+                st.session_state.stream_answers = st.toggle(
+                    "Streaming token par token",
+                    st.session_state.get("stream_answers", True),
+                    help="Affiche la réponse au fil de sa génération (premier token en moins d'une seconde)"
                 )
-                st.download_button(
-                    label="⬇️ PDF",
-                    data=pdf_bytes,
-                    file_name="conversation.pdf",
-                    mime="application/pdf",
-                    key="dl_chat_pdf"
+                cache_stats = get_answer_cache().stats()
+                st.caption(
+                    f"♻️ Cache réponses : {cache_stats['hits']} hits • {cache_stats['misses']} misses "
+                    f"(seuil {ANSWER_CACHE_THRESHOLD:.2f})"
                 )
+                if doc.get("dedup"):
+                    st.caption(format_dedup_stats(doc["dedup"]))
+                qe_stats = get_query_embedding_cache().stats()
+                st.caption(
+                    f"🔢 Embeddings de questions en cache : {qe_stats['hits']} hits • "
+                    f"{qe_stats['misses']} encodages"
+                )
+                if startup is not None:
+                    st.caption(format_startup_report(startup))
+                rr_stats = get_rerank_cache().stats()
+                st.caption(
+                    f"🏁 Reranking : {rr_stats['early_exits']} early exits • "
+                    f"scores en cache {rr_stats['hits']} / {rr_stats['hits'] + rr_stats['misses']}"
+                )
+                reg = get_faiss_registry().stats()
+                st.caption(
+                    f"🧠 Index FAISS en mémoire : {reg['indexes']} • "
+                    f"{reg['bytes'] / 1e6:.1f} / {FAISS_REGISTRY_MAX_MB:.0f} Mo"
+                )
+                doc_reg = get_document_registry().stats()
+                st.caption(
+                    f"📚 Documents partagés en mémoire : {doc_reg['documents']} • "
+                    f"{doc_reg['bytes'] / 1e6:.1f} / {DOC_REGISTRY_MAX_MB:.0f} Mo"
+                )
+                if isinstance(client, MistralPool):
+                    pool_stats = client.stats
+                    st.caption(
+                        f"🚦 Pool Mistral : {pool_stats['requests']} requêtes • "
+                        f"{pool_stats['retries']} retries • {pool_stats['deduplicated']} dédupliquées • "
+                        f"max {MISTRAL_MAX_IN_FLIGHT} simultanées"
+                    )
+
+
+    # --- ONGLETS ---
+    if doc is not None:
+        tabs = st.tabs([
+            "💬 Chat", "📝 Synthèse", "📊 Analyse",
+            "🔊 Audio", "🎯 Présentation", "📐 Évaluation RAG"
+        ])
+
+        # ── TAB 1 : CHAT ─────────────────────────────────────────
+        with tabs[0]:
+            emb_ready = doc["embeddings"] is not None
+            reranker_ready = load_reranker() is not None
+
+            col_info, col_export = st.columns([4, 1])
+            with col_info:
+                flags = []
+                query_ids = corpus_query_ids()
+                if query_ids:
+                    flags.append(f"corpus : {len(query_ids)} documents interrogés")
+                else:
+                    flags.append(f"RAG actif ({len(doc['chunks'])} chunks)")
+                if emb_ready:
+                    flags.append("embeddings ✅")
+                elif not st.session_state.get("doc_ready", True):
+                    flags.append("⏳ embeddings en cours — BM25 seul")
+                if reranker_ready:
+                    flags.append("reranking ✅")
+                try:
+                    import faiss
+                    flags.append("FAISS ✅")
+                except ImportError:
+                    pass
+                if flags:
+                    st.caption("📚 " + " • ".join(flags))
+
+            with col_export:
+                if st.session_state.get("messages"):
+                    pdf_bytes = export_chat_to_pdf(
+                        st.session_state.messages,
+                        st.session_state.get("loaded_file", "document")
+                    )
+                    st.download_button(
+                        label="⬇️ PDF",
+                        data=pdf_bytes,
+                        file_name="conversation.pdf",
+                        mime="application/pdf",
+                        key="dl_chat_pdf"
+                    )
+
+            if "messages" not in st.session_state:
+                st.session_state.messages = []
 
-        if "messages" not in st.session_state:
-            st.session_state.messages = []
-
-        for msg in st.session_state.messages:
-            with st.chat_message(msg["role"]):
-                st.write(msg["content"])
-                if msg["role"] == "assistant" and msg.get("pages"):
-                    st.caption(format_sources(msg["pages"]))
-
-        if prompt := st.chat_input("Posez une question sur le document…"):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.write(prompt)
-            with st.chat_message("assistant", avatar="✨"):
-                with st.spinner("Recherche dans le document…"):
-                    response, source_pages = ask_full_or_rag(client, prompt)
-                    st.write(response)
+            for msg in st.session_state.messages:
+                with st.chat_message(msg["role"]):
+                    st.write(msg["content"])
+                    if msg["role"] == "assistant" and msg.get("pages"):
+                        st.caption(format_sources(msg["pages"]))
+                    if msg.get("context"):
+                        st.caption(format_context_stats(msg["context"]))
+
+            if prompt := st.chat_input("Posez une question sur le document…"):
+                st.session_state.messages.append({"role": "user", "content": prompt})
+                with st.chat_message("user"):
+                    st.write(prompt)
+                with st.chat_message("assistant", avatar="✨"):
+                    tracer = new_tracer("question")
+                    with activate(tracer), span("question"):
+                        if st.session_state.get("stream_answers", True):
+                            with st.spinner("Recherche dans le document…"):
+                                token_stream, source_pages = ask_full_or_rag_stream(client, prompt)
+                            response = st.write_stream(token_stream)
+                        else:
+                            with st.spinner("Recherche dans le document…"):
+                                response, source_pages = ask_full_or_rag(client, prompt)
+                            st.write(response)
+                    finish_trace(tracer, "last_trace")
                     if source_pages:
                         st.caption(format_sources(source_pages))
+                    context_stats = st.session_state.get("last_context_stats")
+                    if context_stats:
+                        st.caption(format_context_stats(context_stats))
                     st.session_state.messages.append({
                         "role": "assistant",
                         "content": response,
-                        "pages": source_pages
+                        "pages": source_pages,
+                        "context": context_stats,
                     })
 
-    # ── TAB 2 : SYNTHÈSE ────────────────────────────────────
-    with tabs[1]:
-        s_mode = st.select_slider(
-            "Niveau de précision",
-            options=["Court", "Moyen", "Détaillé"],
-            value="Moyen"
-        )
-        longueur = {
-            "Court": "en 5 phrases",
-            "Moyen": "en 10-15 phrases",
-            "Détaillé": "de manière exhaustive"
-        }
-
-        if st.button("📝 Rédiger le résumé", key="btn_resume"):
-            with st.spinner("Génération du résumé…"):
-                full_text = st.session_state.full_text
-                if len(full_text) > 25000:
-                    chunks = st.session_state.chunks
-                    step = max(1, len(chunks) // 8)
-                    sampled = chunks[::step][:8]
-                    context = "\n\n---\n\n".join(c["text"] for c in sampled)
-                    all_pages = []
-                    for c in sampled:
-                        all_pages.extend(c["pages"])
-                    source_pages = sorted(set(all_pages))
-                else:
-                    context = full_text
-                    source_pages = sorted(st.session_state.pdf_pages.keys())
+            if st.session_state.get("last_trace") is not None:
+                render_performance_panel(st.session_state.last_trace, "dernière question", "question")
+            if st.session_state.get("last_ingest_trace") is not None:
+                render_performance_panel(st.session_state.last_ingest_trace, "ingestion", "ingestion")
+
+        # ── TAB 2 : SYNTHÈSE ────────────────────────────────────
+        with tabs[1]:
+            s_mode = st.select_slider(
+                "Niveau de précision",
+                options=["Court", "Moyen", "Détaillé"],
+                value="Moyen"
+            )
+            longueur = {
+                "Court": "en 5 phrases",
+                "Moyen": "en 10-15 phrases",
+                "Détaillé": "de manière exhaustive"
+            }
+
+            if st.button("📝 Rédiger le résumé", key="btn_resume"):
+                with st.spinner("Génération du résumé…"):
+                    pages = doc["pages_text"]
+                    source_pages = sorted(pages.keys())
+                    if pages.char_count > FULL_TEXT_MAX_CHARS:
+                        # Map-reduce sur l'ensemble du document (résumés partiels en cache)
+                        progress = st.progress(0.0, text="Résumés partiels…")
+                        result = summarize_map_reduce(
+                            client, doc["chunks"], st.session_state.get("doc_key", ""),
+                            longueur[s_mode],
+                            progress_callback=lambda done, total: progress.progress(
+                                done / total, text=f"Résumés partiels : {done}/{total}"
+                            )
+                        )
+                        progress.empty()
+                    else:
+                        question = (
+                            f"Fais un résumé structuré {longueur[s_mode]} de ce document, "
+                            f"avec des sections claires."
+                        )
+                        result = ask_mistral(client, pages.full_text, question)
+                    st.info(result)
+                    st.caption(format_sources(source_pages))
 
-                question = (
-                    f"Fais un résumé structuré {longueur[s_mode]} de ce document, "
-                    f"avec des sections claires."
-                )
-                result = ask_mistral(client, context, question)
-                st.info(result)
-                st.caption(format_sources(source_pages))
-
-    # ── TAB 3 : ANALYSE ─────────────────────────────────────
-    with tabs[2]:
-        col1, col2 = st.columns(2)
-        words = re.findall(r'\b\w+\b', st.session_state.full_text.lower())
-        stop_words = {
-            "les", "des", "une", "que", "qui", "dans", "pour", "avec", "sur",
-            "par", "est", "sont", "this", "that", "from", "have", "been",
-            "will", "leur", "leurs", "mais", "donc", "comme", "plus", "aussi",
-            "tout", "tous", "très", "bien", "être", "avoir", "faire"
-        }
-        freq = Counter([w for w in words if len(w) > 3 and w not in stop_words])
-
-        with col1:
-            st.metric("Mots totaux", f"{len(words):,}")
-            st.metric("Pages analysées", len(st.session_state.pdf_pages))
-            st.metric("Chunks créés", len(st.session_state.get("chunks", [])))
-            st.subheader("🔑 Mots-clés fréquents")
-            for w, c in freq.most_common(10):
-                st.write(f"- **{w}** : {c} occurrences")
-
-        with col2:
-            if st.button("🔍 Analyse sémantique", key="btn_semantic"):
-                with st.spinner("Analyse en cours…"):
-                    question = (
-                        "Quels sont les thèmes principaux de ce document ? "
-                        "Liste-les et explique chacun brièvement."
+        # ── TAB 3 : ANALYSE ─────────────────────────────────────
+        with tabs[2]:
+            col1, col2 = st.columns(2)
+            # Précalculé à l'ingestion (cf. compute_document_analytics) : aucun calcul par rerun
+            analytics = doc.get("analytics") or compute_document_analytics(doc["pages_text"])
+
+            with col1:
+                st.metric("Mots totaux", f"{analytics['words']:,}")
+                st.metric("Pages analysées", len(doc["pages_text"]))
+                st.metric("Chunks créés", len(doc["chunks"]))
+                st.subheader("🔑 Mots-clés fréquents")
+                for w, c in analytics["keywords"][:10]:
+                    st.write(f"- **{w}** : {c} occurrences")
+                if analytics["key_phrases"]:
+                    st.subheader("🧩 Expressions clés (TF-IDF)")
+                    st.write(" • ".join(f"**{phrase}**" for phrase, _ in analytics["key_phrases"]))
+                with st.expander("📑 Termes fréquents par page"):
+                    t_page = st.number_input(
+                        "Page", min_value=1, max_value=max(1, len(doc["pages_text"])), value=1,
+                        key="analytics_page"
                     )
-                    result, source_pages = ask_full_or_rag(client, question)
-                    st.write(result)
-                    st.caption(format_sources(source_pages))
+                    terms = analytics["page_terms"].get(str(t_page), [])
+                    st.write(", ".join(f"{w} ({c})" for w, c in terms) or "Aucun terme sur cette page.")
+
+            with col2:
+                if st.button("🔍 Analyse sémantique", key="btn_semantic"):
+                    with st.spinner("Analyse en cours…"):
+                        question = (
+                            "Quels sont les thèmes principaux de ce document ? "
+                            "Liste-les et explique chacun brièvement."
+                        )
+                        result, source_pages = ask_full_or_rag(client, question)
+                        st.write(result)
+                        st.caption(format_sources(source_pages))
 
-    # ── TAB 4 : AUDIO ───────────────────────────────────────
-    with tabs[3]:
-        max_page = len(st.session_state.pdf_pages)
-        p_num = st.number_input("Numéro de page à lire", min_value=1, max_value=max_page, value=1)
-        lang = st.selectbox("Langue", ["fr", "en", "es", "de"], index=0)
+        # ── TAB 4 : AUDIO ───────────────────────────────────────
+        with tabs[3]:
+            max_page = len(doc["pages_text"])
+            p_num = st.number_input("Numéro de page à lire", min_value=1, max_value=max_page, value=1)
+            lang = st.selectbox("Langue", ["fr", "en", "es", "de"], index=0)
+
+            if st.button("🔊 Générer l'audio", key="btn_audio"):
+                page_text = doc["pages_text"].get(p_num, "")
+                if page_text:
+                    player = st.empty()
+                    status = st.empty()
+
+                    def show_first_segment(i, n, mp3):
+                        # Le début de la page est jouable pendant la synthèse du reste
+                        if i == 0 and n > 1:
+                            player.audio(mp3, format="audio/mp3")
+                        if n > 1:
+                            status.caption(f"⏳ Segment {i + 1}/{n} prêt…")
 
-        if st.button("🔊 Générer l'audio", key="btn_audio"):
-            page_text = st.session_state.pdf_pages.get(p_num, "")
-            if page_text:
-                with st.spinner("Génération audio…"):
                     try:
-                        tts = gTTS(text=page_text, lang=lang)
-                        audio_io = BytesIO()
-                        tts.write_to_fp(audio_io)
-                        audio_io.seek(0)
-                        st.audio(audio_io, format="audio/mp3")
-                        st.caption(f"📄 Page {p_num}")
+                        audio, from_cache = page_audio(
+                            st.session_state.get("doc_key"), p_num, page_text, lang, on_segment=show_first_segment
+                        )
+                        player.audio(audio, format="audio/mp3")
+                        status.caption(f"📄 Page {p_num}{' • depuis le cache' if from_cache else ''}")
                     except Exception as e:
+                        status.empty()
                         st.error(f"Erreur audio : {e}")
-            else:
-                st.warning("Aucun texte trouvé sur cette page.")
+                else:
+                    st.warning("Aucun texte trouvé sur cette page.")
 
-    # ── TAB 5 : PRÉSENTATION ────────────────────────────────
-    with tabs[4]:
-        n_slides = st.number_input("Nombre de slides", min_value=3, max_value=10, value=5)
+        # ── TAB 5 : PRÉSENTATION ────────────────────────────────
+        with tabs[4]:
+            n_slides = st.number_input("Nombre de slides", min_value=3, max_value=10, value=5)
 
-        if st.button("🎯 Générer la présentation PPTX", key="btn_pptx"):
-            with st.spinner("L'IA structure vos slides…"):
-                try:
-                    question = (
-                        f"Crée une structure pour exactement {n_slides} slides basées sur ce document. "
-                        f"Réponds UNIQUEMENT avec un JSON valide, sans texte avant ou après, "
-                        f'sans balises markdown : '
-                        f'{{ "slides": [ {{ "titre": "Titre de la slide", '
-                        f'"points": ["Point 1", "Point 2", "Point 3"] }} ] }}'
-                    )
-                    raw, source_pages = ask_full_or_rag(client, question)
-                    raw = raw.strip()
-                    if raw.startswith("```"):
-                        raw = re.sub(r"```(?:json)?", "", raw).strip("` \n")
-
-                    start = raw.find('{')
-                    end = raw.rfind('}') + 1
-
-                    if start != -1 and end > 0:
-                        data = json.loads(raw[start:end])
-                        ppt_bytes = create_pptx(data)
-                        st.download_button(
-                            label="📥 Télécharger la présentation",
-                            data=ppt_bytes,
-                            file_name="presentation.pptx",
-                            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
+            if st.button("🎯 Générer la présentation PPTX", key="btn_pptx"):
+                with st.spinner("L'IA structure vos slides…"):
+                    try:
+                        question = (
+                            f"Crée une structure pour exactement {n_slides} slides basées sur ce document. "
+                            f"Réponds UNIQUEMENT avec un JSON valide, sans texte avant ou après, "
+                            f'sans balises markdown : '
+                            f'{{ "slides": [ {{ "titre": "Titre de la slide", '
+                            f'"points": ["Point 1", "Point 2", "Point 3"] }} ] }}'
                         )
-                        st.success(f"✅ {len(data.get('slides', []))} slides générées !")
-                        st.caption(format_sources(source_pages))
-                    else:
-                        st.error("Format JSON invalide reçu.")
+                        raw, source_pages = ask_full_or_rag(client, question)
+                        raw = raw.strip()
+                        if raw.startswith("```"):
+                            raw = re.sub(r"```(?:json)?", "", raw).strip("` \n")
+
+                        start = raw.find('{')
+                        end = raw.rfind('}') + 1
+
+                        if start != -1 and end > 0:
+                            data = json.loads(raw[start:end])
+                            ppt_bytes = create_pptx(data)
+                            st.download_button(
+                                label="📥 Télécharger la présentation",
+                                data=ppt_bytes,
+                                file_name="presentation.pptx",
+                                mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
+                            )
+                            st.success(f"✅ {len(data.get('slides', []))} slides générées !")
+                            st.caption(format_sources(source_pages))
+                        else:
+                            st.error("Format JSON invalide reçu.")
+                            st.code(raw)
+                    except json.JSONDecodeError as e:
+                        st.error(f"Erreur JSON : {e}")
                         st.code(raw)
-                except json.JSONDecodeError as e:
-                    st.error(f"Erreur JSON : {e}")
-                    st.code(raw)
-                except Exception as e:
-                    st.error(f"Erreur : {e}")
-
-    # ── TAB 6 : ÉVALUATION RAG ──────────────────────────────
-    with tabs[5]:
-        st.subheader("📐 Évaluation RAG")
+                    except Exception as e:
+                        st.error(f"Erreur : {e}")
 
-        # Indique la méthode d'évaluation disponible
-        try:
-            import ragas
-            st.success("✅ Vraie lib **RAGAS** détectée — évaluation de haute fidélité activée.")
-        except ImportError:
-            st.info("ℹ️ RAGAS non installé. Utilisation du mode LLM-as-judge (approximation). "
-                    "`pip install ragas datasets` pour activer l'évaluation exacte.")
+        # ── TAB 6 : ÉVALUATION RAG ──────────────────────────────
+        with tabs[5]:
+            st.subheader("📐 Évaluation RAG")
 
-        st.caption(
-            "Évalue la qualité de ton pipeline RAG sur 3 métriques : "
-            "Faithfulness · Answer Relevance · Context Recall"
-        )
+            # Indique la méthode d'évaluation disponible
+            try:
+                import ragas
+                st.success("✅ Vraie lib **RAGAS** détectée — évaluation de haute fidélité activée.")
+            except ImportError:
+                st.info("ℹ️ RAGAS non installé. Utilisation du mode LLM-as-judge (approximation). "
+                        "`pip install ragas datasets` pour activer l'évaluation exacte.")
 
-        last_q, last_a = "", ""
-        if st.session_state.get("messages"):
-            msgs = st.session_state.messages
-            for i in range(len(msgs) - 1, -1, -1):
-                if msgs[i]["role"] == "assistant" and i > 0:
-                    last_a = msgs[i]["content"]
-                    last_q = msgs[i - 1]["content"]
-                    break
-
-        eval_q = st.text_area("Question à évaluer", value=last_q, height=80)
-        eval_a = st.text_area("Réponse à évaluer", value=last_a, height=120)
-
-        if st.button("📊 Lancer l'évaluation", key="btn_eval"):
-            if not eval_q or not eval_a:
-                st.warning("Renseigne une question et une réponse.")
-            else:
-                with st.spinner("Évaluation en cours…"):
-                    emb_model = load_embedding_model()
-                    file_key = st.session_state.get("loaded_file", "")
-                    context, source_pages, chunks_selected = retrieve_hybrid_faiss(
-                        st.session_state.chunks, eval_q,
-                        top_k=st.session_state.get("top_k", 10),
-                        model=emb_model,
-                        file_key=file_key
-                    )
-                    metrics = evaluate_rag_answer(
-                        client, eval_q, context, eval_a,
-                        chunks_selected=chunks_selected
-                    )
+            st.caption(
+                "Évalue la qualité de ton pipeline RAG sur 3 métriques : "
+                "Faithfulness · Answer Relevance · Context Recall"
+            )
 
-                if "error" in metrics:
-                    st.error(f"Erreur évaluation : {metrics['error']}")
+            last_q, last_a = "", ""
+            if st.session_state.get("messages"):
+                msgs = st.session_state.messages
+                for i in range(len(msgs) - 1, -1, -1):
+                    if msgs[i]["role"] == "assistant" and i > 0:
+                        last_a = msgs[i]["content"]
+                        last_q = msgs[i - 1]["content"]
+                        break
+
+            eval_q = st.text_area("Question à évaluer", value=last_q, height=80)
+            eval_a = st.text_area("Réponse à évaluer", value=last_a, height=120)
+
+            if st.button("📊 Lancer l'évaluation", key="btn_eval"):
+                if not eval_q or not eval_a:
+                    st.warning("Renseigne une question et une réponse.")
                 else:
-                    source_label = metrics.get("source", "llm-as-judge")
-                    st.caption(f"🔬 Méthode : **{source_label}**")
-
-                    st.markdown("### Résultats")
-                    col_m1, col_m2, col_m3 = st.columns(3)
-                    with col_m1:
-                        st.metric("Faithfulness", f"{metrics.get('faithfulness', 0):.2f}")
-                    with col_m2:
-                        st.metric("Answer Relevance", f"{metrics.get('answer_relevance', 0):.2f}")
-                    with col_m3:
-                        st.metric("Context Recall", f"{metrics.get('context_recall', 0):.2f}")
-
-                    st.divider()
-                    render_metric_bar(
-                        "Faithfulness",
-                        metrics.get("faithfulness", 0),
-                        metrics.get("faithfulness_reason", "")
-                    )
-                    render_metric_bar(
-                        "Answer Relevance",
-                        metrics.get("answer_relevance", 0),
-                        metrics.get("answer_relevance_reason", "")
-                    )
-                    render_metric_bar(
-                        "Context Recall",
-                        metrics.get("context_recall", 0),
-                        metrics.get("context_recall_reason", "")
-                    )
+                    with st.spinner("Évaluation en cours…"):
+                        emb_model = load_embedding_model()
+                        file_key = st.session_state.get("doc_key", "")
+                        context, source_pages, chunks_selected = retrieve_hybrid_faiss(
+                            doc["chunks"], eval_q,
+                            top_k=st.session_state.get("top_k", 10),
+                            model=emb_model,
+                            file_key=file_key,
+                            bm25_index=doc["bm25"],
+                            emb_matrix=doc["embeddings"]
+                        )
+                        metrics = evaluate_rag_answer(
+                            client, eval_q, context, eval_a,
+                            chunks_selected=chunks_selected
+                        )
 
-                    avg = np.mean([
-                        metrics.get("faithfulness", 0),
-                        metrics.get("answer_relevance", 0),
-                        metrics.get("context_recall", 0)
-                    ])
-                    color = "#4caf50" if avg >= 0.7 else "#ff9800" if avg >= 0.4 else "#f44336"
-                    st.markdown(
-                        f"<h3 style='color:{color}'>Score global : {avg:.2f} / 1.00</h3>",
-                        unsafe_allow_html=True
-                    )
-                    st.caption(format_sources(source_pages))
+                    if "error" in metrics:
+                        st.error(f"Erreur évaluation : {metrics['error']}")
+                    else:
+                        source_label = metrics.get("source", "llm-as-judge")
+                        st.caption(f"🔬 Méthode : **{source_label}**")
+
+                        st.markdown("### Résultats")
+                        col_m1, col_m2, col_m3 = st.columns(3)
+                        with col_m1:
+                            st.metric("Faithfulness", f"{metrics.get('faithfulness', 0):.2f}")
+                        with col_m2:
+                            st.metric("Answer Relevance", f"{metrics.get('answer_relevance', 0):.2f}")
+                        with col_m3:
+                            st.metric("Context Recall", f"{metrics.get('context_recall', 0):.2f}")
+
+                        st.divider()
+                        render_metric_bar(
+                            "Faithfulness",
+                            metrics.get("faithfulness", 0),
+                            metrics.get("faithfulness_reason", "")
+                        )
+                        render_metric_bar(
+                            "Answer Relevance",
+                            metrics.get("answer_relevance", 0),
+                            metrics.get("answer_relevance_reason", "")
+                        )
+                        render_metric_bar(
+                            "Context Recall",
+                            metrics.get("context_recall", 0),
+                            metrics.get("context_recall_reason", "")
+                        )
 
-                    if "eval_history" not in st.session_state:
-                        st.session_state.eval_history = []
-                    st.session_state.eval_history.append({
-                        "question": eval_q[:60] + "…",
-                        "faithfulness": metrics.get("faithfulness", 0),
-                        "answer_relevance": metrics.get("answer_relevance", 0),
-                        "context_recall": metrics.get("context_recall", 0),
-                        "avg": avg,
-                        "méthode": source_label
-                    })
+                        avg = np.mean([
+                            metrics.get("faithfulness", 0),
+                            metrics.get("answer_relevance", 0),
+                            metrics.get("context_recall", 0)
+                        ])
+                        color = "#4caf50" if avg >= 0.7 else "#ff9800" if avg >= 0.4 else "#f44336"
+                        st.markdown(
+                            f"<h3 style='color:{color}'>Score global : {avg:.2f} / 1.00</h3>",
+                            unsafe_allow_html=True
+                        )
+                        st.caption(format_sources(source_pages))
+
+                        if "eval_history" not in st.session_state:
+                            st.session_state.eval_history = []
+                        st.session_state.eval_history.append({
+                            "question": eval_q[:60] + "…",
+                            "faithfulness": metrics.get("faithfulness", 0),
+                            "answer_relevance": metrics.get("answer_relevance", 0),
+                            "context_recall": metrics.get("context_recall", 0),
+                            "avg": avg,
+                            "méthode": source_label
+                        })
+
+            if st.session_state.get("eval_history"):
+                st.divider()
+                st.subheader("📋 Historique des évaluations")
+                import pandas as pd
+                df = pd.DataFrame(st.session_state.eval_history)
+                st.dataframe(df, use_container_width=True)
+
+    else:
+        st.info("👈 Veuillez charger un fichier PDF dans la barre latérale pour commencer.")
 
-        if st.session_state.get("eval_history"):
-            st.divider()
-            st.subheader("📋 Historique des évaluations")
-            import pandas as pd
-            df = pd.DataFrame(st.session_state.eval_history)
-            st.dataframe(df, use_container_width=True)
 
-else:
-    st.info("👈 Veuillez charger un fichier PDF dans la barre latérale pour commencer.")
+# `streamlit run lecteur.py` exécute le script sous le nom "__main__" ;
+# un import (benchmark, CLI) n'exécute pas l'interface.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Pool asynchrone de requêtes Mistral.
+
+Toutes les requêtes d'un même client (donc d'une même clé API) passent par une
+boucle asyncio dédiée, dans un thread d'arrière-plan, qui garantit :
+  - un nombre borné de requêtes simultanées (sémaphore par pool / clé API)
+  - des retries avec backoff exponentiel + jitter sur 429 et 5xx
+    (en-tête Retry-After respecté) et sur erreurs réseau
+  - la déduplication des requêtes identiques en vol (un seul appel partagé)
+
+Interface synchrone compatible avec le SDK : pool.chat.complete(...) et
+pool.chat.stream(...), plus pool.submit(...) qui renvoie un
+concurrent.futures.Future pour les fonctionnalités qui parallélisent.
+"""
+
+import asyncio
+import json
+import random
+import threading
+
+try:
+    import httpx
+    NETWORK_ERRORS = (httpx.TransportError, asyncio.TimeoutError)
+except ImportError:
+    NETWORK_ERRORS = (asyncio.TimeoutError,)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def status_code(exc: Exception):
+    return getattr(exc, "status_code", None)
+
+
+def retry_after_seconds(exc: Exception):
+    response = getattr(exc, "raw_response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _ChatFacade:
+    """Même forme que client.chat du SDK, mais via le pool."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def complete(self, **request):
+        return self._pool.submit(**request).result()
+
+    def stream(self, **request):
+        # Les flux restent directs : longue durée, non dédupliquables
+        return self._pool.client.chat.stream(**request)
+
+
+class MistralPool:
+    def __init__(self, client, max_in_flight: int = 4, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 30.0):
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.chat = _ChatFacade(self)
+        self.stats = {
+            "requests": 0, "deduplicated": 0, "retries": 0,
+            "errors": 0, "in_flight": 0, "max_in_flight_seen": 0,
+        }
+        self._inflight = {}  # clé de requête → Task (accédé uniquement depuis la boucle)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="mistral-pool", daemon=True)
+        self._thread.start()
+        self._semaphore = self._run(self._make_semaphore()).result()
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.max_in_flight)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # --- API synchrone ---------------------------------------------------
+
+    def submit(self, **request):
+        """Planifie une requête chat.complete ; renvoie un concurrent.futures.Future."""
+        return self._run(self.complete_async(**request))
+
+    def complete_many(self, requests: list) -> list:
+        """Réponses dans l'ordre des requêtes (exception à la place d'une réponse en échec)."""
+        async def run():
+            return await asyncio.gather(*(self.complete_async(**r) for r in requests), return_exceptions=True)
+        return self._run(run()).result()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # --- Boucle asyncio --------------------------------------------------
+
+    async def complete_async(self, **request):
+        key = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["requests"] += 1
+            task = asyncio.ensure_future(self._complete_with_retry(request))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["deduplicated"] += 1
+        # shield : l'annulation d'un demandeur n'annule pas l'appel partagé
+        return await asyncio.shield(task)
+
+    async def _call(self, request: dict):
+        complete_async = getattr(self.client.chat, "complete_async", None)
+        if complete_async is not None:
+            return await complete_async(**request)
+        return await asyncio.to_thread(self.client.chat.complete, **request)
+
+    def _backoff(self, attempt: int, exc: Exception) -> float:
+        retry_after = retry_after_seconds(exc)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    async def _complete_with_retry(self, request: dict):
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                self.stats["in_flight"] += 1
+                self.stats["max_in_flight_seen"] = max(self.stats["max_in_flight_seen"], self.stats["in_flight"])
+                try:
+                    return await self._call(request)
+                except Exception as e:
+                    retryable = status_code(e) in RETRYABLE_STATUS or isinstance(e, NETWORK_ERRORS)
+                    if not retryable or attempt >= self.max_retries:
+                        self.stats["errors"] += 1
+                        raise
+                    delay = self._backoff(attempt, e)
+                finally:
+                    self.stats["in_flight"] -= 1
+            # Attente hors sémaphore : les autres requêtes continuent pendant le backoff
+            attempt += 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
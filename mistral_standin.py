@@ -0,0 +1,212 @@
+"""
+Stand-in HTTP local de l'API Mistral (POST /v1/chat/completions).
+
+Simule la latence, les 429 (avec Retry-After) et les 5xx pour tester le pool
+de requêtes (llm_pool.py) hors ligne. Supporte aussi le streaming SSE.
+
+    # Serveur seul (l'application s'y connecte avec MISTRAL_SERVER_URL)
+    python mistral_standin.py serve --port 8765 --latency 0.3 --fail-rate 0.2
+    MISTRAL_SERVER_URL=http://127.0.0.1:8765 MISTRAL_API_KEY=standin streamlit run lecteur.py
+
+    # Test de charge du pool contre le stand-in (rapport JSON)
+    python mistral_standin.py loadtest --requests 200 --max-in-flight 8 --fail-rate 0.2
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandinState:
+    def __init__(self, latency: float, fail_rate: float, seed: int = 0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.status_counts = {}
+
+    def enter(self) -> int:
+        with self.lock:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+            roll = self.rng.random()
+        if roll < self.fail_rate / 2:
+            return 429
+        if roll < self.fail_rate:
+            return 503
+        return 200
+
+    def leave(self, status: int):
+        with self.lock:
+            self.concurrent -= 1
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+
+def make_handler(state: StandinState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"message": "not found"})
+                return
+
+            status = state.enter()
+            try:
+                time.sleep(state.latency)
+                if status == 429:
+                    self._send_json(429, {"message": "Requests rate limit exceeded"}, {"Retry-After": "0.2"})
+                elif status != 200:
+                    self._send_json(status, {"message": "Service unavailable"})
+                elif request.get("stream"):
+                    self._stream(request)
+                else:
+                    self._send_json(200, self._completion(request))
+            finally:
+                state.leave(status)
+
+        def _answer(self, request: dict) -> str:
+            question = next(
+                (m.get("content", "") for m in reversed(request.get("messages", [])) if m.get("role") == "user"),
+                "",
+            )
+            return f"Réponse du stand-in ({len(question)} caractères reçus)."
+
+        def _completion(self, request: dict) -> dict:
+            content = self._answer(request)
+            return {
+                "id": f"standin-{random.getrandbits(32):08x}",
+                "object": "chat.completion",
+                "model": request.get("model", "standin"),
+                "created": int(time.time()),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(content.split()), "total_tokens": 0},
+            }
+
+        def _stream(self, request: dict):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i, word in enumerate(self._answer(request).split(" ")):
+                chunk = {
+                    "id": "standin-stream",
+                    "object": "chat.completion.chunk",
+                    "model": request.get("model", "standin"),
+                    "created": int(time.time()),
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return Handler
+
+
+def start_server(port: int, latency: float, fail_rate: float) -> tuple:
+    state = StandinState(latency, fail_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def loadtest(args) -> dict:
+    from mistralai import Mistral
+    from llm_pool import MistralPool
+
+    server, state = start_server(0, args.latency, args.fail_rate)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    pool = MistralPool(
+        Mistral(api_key="standin", server_url=url),
+        max_in_flight=args.max_in_flight, max_retries=args.max_retries, base_delay=0.05,
+    )
+
+    # Une partie des questions est répétée pour exercer la déduplication
+    distinct = max(1, int(args.requests * (1 - args.duplicate_rate)))
+    questions = [f"Question {i % distinct}" for i in range(args.requests)]
+
+    start = time.perf_counter()
+    futures = [
+        pool.submit(model="mistral-large-latest", messages=[{"role": "user", "content": q}], max_tokens=50)
+        for q in questions
+    ]
+    failures = sum(1 for f in as_completed(futures) if f.exception() is not None)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    return {
+        "requests": args.requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 2),
+        "failures": failures,
+        "pool": {k: v for k, v in pool.stats.items() if k != "in_flight"},
+        "server": {
+            "max_concurrent": state.max_concurrent,
+            "status_counts": {str(k): v for k, v in sorted(state.status_counts.items())},
+        },
+        "bounded": state.max_concurrent <= args.max_in_flight,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Stand-in local de l'API Mistral")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--latency", type=float, default=0.3)
+    serve.add_argument("--fail-rate", type=float, default=0.0)
+
+    load = sub.add_parser("loadtest")
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--max-in-flight", type=int, default=8)
+    load.add_argument("--max-retries", type=int, default=8)
+    load.add_argument("--latency", type=float, default=0.05)
+    load.add_argument("--fail-rate", type=float, default=0.2)
+    load.add_argument("--duplicate-rate", type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        server, _ = start_server(args.port, args.latency, args.fail_rate)
+        print(f"Stand-in Mistral sur http://127.0.0.1:{server.server_address[1]}", file=sys.stderr)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    report = loadtest(args)
+    print(json.dumps(report, indent=2))
+    return 0 if report["failures"] == 0 and report["bounded"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
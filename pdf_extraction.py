@@ -0,0 +1,64 @@
+"""
+Extraction de texte PDF par plages de pages.
+
+Module volontairement séparé de lecteur.py : les workers du pool de
+processus doivent pouvoir l'importer sans exécuter l'interface Streamlit.
+"""
+
+from io import BytesIO
+
+# Octets du PDF, transmis une seule fois à chaque worker (cf. init_worker)
+_PDF_BYTES = None
+
+
+def init_worker(pdf_bytes: bytes):
+    global _PDF_BYTES
+    _PDF_BYTES = pdf_bytes
+
+
+def count_pages(pdf_bytes: bytes) -> int:
+    """Nombre de pages ; fallback PyPDF2 si pdfplumber est absent ou n'ouvre pas le PDF."""
+    try:
+        import pdfplumber
+        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+            return len(pdf.pages)
+    except Exception:
+        import PyPDF2
+        return len(PyPDF2.PdfReader(BytesIO(pdf_bytes)).pages)
+
+
+def extract_page_range(start: int, end: int, pdf_bytes: bytes = None) -> tuple:
+    """
+    Extrait les pages [start, end) (index 0) avec pdfplumber,
+    fallback PyPDF2 sur la même plage si pdfplumber échoue.
+    Retourne (pages_text, parser, avertissement ou None) ;
+    les numéros de page de pages_text commencent à 1.
+    """
+    data = pdf_bytes if pdf_bytes is not None else _PDF_BYTES
+    warning = None
+
+    # Tentative pdfplumber (meilleure qualité)
+    try:
+        import pdfplumber
+        pages_text = {}
+        with pdfplumber.open(BytesIO(data)) as pdf:
+            for i in range(start, min(end, len(pdf.pages))):
+                text = pdf.pages[i].extract_text()
+                if text and text.strip():
+                    pages_text[i + 1] = text
+        if pages_text:
+            return pages_text, "pdfplumber", None
+    except ImportError:
+        warning = "⚠️ pdfplumber non installé. Fallback PyPDF2. `pip install pdfplumber` recommandé."
+    except Exception as e:
+        warning = f"⚠️ pdfplumber a échoué ({e}), fallback PyPDF2."
+
+    # Fallback PyPDF2
+    import PyPDF2
+    reader = PyPDF2.PdfReader(BytesIO(data))
+    pages_text = {}
+    for i in range(start, min(end, len(reader.pages))):
+        text = reader.pages[i].extract_text()
+        if text and text.strip():
+            pages_text[i + 1] = text
+    return pages_text, "PyPDF2", warning
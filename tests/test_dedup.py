@@ -0,0 +1,115 @@
+"""Dédoublonnage à l'ingestion (AMÉLIORATION 25) : marges de page et chunks répétés."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lecteur  # noqa: E402
+
+DISCLAIMER = (
+    "Ce document est fourni à titre informatif uniquement et ne constitue pas un conseil "
+    "en investissement. Les performances passées ne préjugent pas des performances futures. "
+    "Toute reproduction, même partielle, est interdite sans autorisation écrite préalable."
+)
+
+
+def chunk(text, page):
+    return {"text": text, "pages": [page]}
+
+
+def test_repeated_boilerplate_is_merged_and_keeps_every_page():
+    chunks = [chunk(f"Analyse propre à la page {p} du rapport annuel.", p) for p in range(1, 6)]
+    chunks += [chunk(DISCLAIMER, p) for p in range(1, 6)]
+    result, stats = lecteur.dedup_chunks(chunks, threshold=0.85)
+    assert stats["duplicates"] == 4
+    assert stats["embeddings_saved"] == 4
+    kept = [c for c in result if c["text"] == DISCLAIMER]
+    assert len(kept) == 1
+    assert kept[0]["pages"] == [1, 2, 3, 4, 5]
+
+
+def test_chunks_differing_only_by_figures_are_kept():
+    text = ("Le chiffre d'affaires du segment Europe atteint {} millions d'euros sur l'exercice, "
+            "porté par la croissance des ventes en ligne et la hausse des prix moyens.")
+    chunks = [chunk(text.format(12), 3), chunk(text.format(47), 9)]
+    result, stats = lecteur.dedup_chunks(chunks, threshold=0.85)
+    assert stats["duplicates"] == 0
+    assert [c["pages"] for c in result] == [[3], [9]]
+
+
+def test_figures_differing_on_many_pages_are_kept():
+    text = "Résultat trimestriel du segment Europe : {} millions d'euros, en ligne avec les prévisions du groupe."
+    chunks = [chunk(text.format(10 + p), p) for p in range(1, 6)]
+    _, stats = lecteur.dedup_chunks(chunks, threshold=0.85)
+    assert stats["duplicates"] == 0
+
+
+def test_near_duplicate_on_few_pages_is_kept():
+    variant = DISCLAIMER.replace("informatif", "indicatif")
+    chunks = [chunk(DISCLAIMER, 1), chunk(variant, 2)]
+    assert lecteur.minhash_signatures([DISCLAIMER, variant])[0].shape == (2, lecteur.MINHASH_PERMUTATIONS)
+    _, stats = lecteur.dedup_chunks(chunks, threshold=0.5)
+    assert stats["duplicates"] == 0
+
+
+def test_exact_duplicate_on_few_pages_is_merged():
+    chunks = [chunk(DISCLAIMER, 1), chunk("  " + DISCLAIMER.upper(), 2)]
+    result, stats = lecteur.dedup_chunks(chunks, threshold=0.85)
+    assert stats["duplicates"] == 1
+    assert result[0]["pages"] == [1, 2]
+
+
+def test_chunk_with_embedding_is_kept_first():
+    chunks = [chunk(DISCLAIMER, p) for p in range(1, 4)]
+    chunks[2] = dict(chunks[2], embedding=[0.0])
+    result, stats = lecteur.dedup_chunks(chunks, threshold=0.85)
+    assert len(result) == 1
+    assert "embedding" in result[0]
+    assert result[0]["pages"] == [3, 1, 2]
+    assert stats["embeddings_saved"] == 2
+
+
+def test_dedup_disabled():
+    chunks = [chunk(DISCLAIMER, p) for p in range(1, 4)]
+    result, stats = lecteur.dedup_chunks(chunks, threshold=0)
+    assert result == chunks
+    assert stats["duplicates"] == 0
+
+
+def test_minhash_signatures_stay_below_prime():
+    signatures, valid = lecteur.minhash_signatures([DISCLAIMER, "", "un deux"])
+    assert valid.tolist() == [True, False, True]
+    assert int(signatures[valid].max()) < lecteur._MINHASH_PRIME
+
+
+BODIES = [
+    "La croissance organique reste soutenue.\nLes marges progressent en Europe.\nLa dette nette recule.",
+    "Le conseil propose un dividende stable.\nLes investissements se poursuivent.\nLe carnet de commandes grossit.",
+    "Les ventes en Asie ralentissent.\nLes coûts logistiques baissent.\nLa trésorerie reste solide.",
+    "Les effectifs augmentent légèrement.\nLa transition énergétique avance.\nLes perspectives sont confirmées.",
+]
+
+
+def test_strip_page_margins_removes_numbered_header_and_footer():
+    pages = {p: f"Rapport annuel 2023\n{BODIES[p - 1]}\nPage {p} / 4" for p in range(1, 5)}
+    stripped, removed = lecteur.strip_page_margins(pages)
+    assert removed == 8
+    assert stripped == {p: BODIES[p - 1] for p in range(1, 5)}
+
+
+def test_strip_page_margins_keeps_lines_that_do_not_repeat():
+    pages = {p: f"Rapport annuel 2023\n{BODIES[(p - 1) % 4]}\nPage {p}" for p in range(1, 7)}
+    pages[1] = f"Annexe technique\n{BODIES[0]}\nPage 1"
+    stripped, removed = lecteur.strip_page_margins(pages)
+    assert removed == 5 + 6
+    assert stripped[1] == f"Annexe technique\n{BODIES[0]}"
+
+
+def test_strip_page_margins_drops_emptied_page_and_skips_short_documents():
+    pages = {p: f"En-tête\nCorps {p}\nPied" for p in range(1, 5)}
+    pages[4] = "En-tête\nPied"
+    stripped, _ = lecteur.strip_page_margins(pages)
+    assert 4 not in stripped
+    short = {1: "En-tête\nA\nPied", 2: "En-tête\nB\nPied"}
+    assert lecteur.strip_page_margins(short) == (short, 0)
@@ -0,0 +1,48 @@
+"""Parité des backends d'embeddings (AMÉLIORATION 24) : ONNX et ONNX int8 face à PyTorch."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lecteur  # noqa: E402
+
+MIN_COSINE = 0.99  # même seuil que benchmark.py --min-cosine
+
+TEXTS = [
+    "Le chiffre d'affaires du segment Europe atteint 47 millions d'euros.",
+    "Quels sont les risques identifiés pour l'exercice 2024 ?",
+    "Les performances passées ne préjugent pas des performances futures.",
+    "La dette nette recule grâce à la génération de trésorerie. " * 20,
+    "Audit",
+    "Le conseil d'administration propose un dividende stable, les investissements "
+    "dans les infrastructures et la transition énergétique se poursuivent.",
+]
+
+
+def load_backend(name: str):
+    try:
+        return lecteur.create_embedding_backend(name)
+    except Exception as e:  # runtime absent, modèle non téléchargé (hors ligne)…
+        pytest.skip(f"backend {name} indisponible : {e}")
+
+
+def normalized(backend) -> np.ndarray:
+    embeddings = np.asarray(backend.encode(TEXTS), dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def reference() -> np.ndarray:
+    pytest.importorskip("onnxruntime")  # avant de charger le modèle PyTorch
+    pytest.importorskip("sentence_transformers")
+    return normalized(load_backend("torch"))
+
+
+@pytest.mark.parametrize("name", ["onnx", "onnx_int8"])
+def test_backend_matches_torch(reference, name):
+    cosines = np.sum(normalized(load_backend(name)) * reference, axis=1)
+    assert cosines.min() >= MIN_COSINE, f"{name} : cosinus min {cosines.min():.5f} < {MIN_COSINE}"
@@ -0,0 +1,167 @@
+"""
+Tracing par étape du pipeline (ingestion et questions).
+
+Chaque span mesure le temps mural, le temps CPU du processus et la variation
+de mémoire résidente (RSS). Export en JSON lines ou au format OTLP/JSON
+d'OpenTelemetry (importable par un collecteur OTel, sans dépendance).
+
+Sans tracer actif, span() renvoie un contexte vide partagé : le coût se
+limite à la lecture d'une ContextVar.
+
+    tracer = Tracer("question")
+    with activate(tracer):
+        with span("faiss_search", top_k=10):
+            ...
+    tracer.to_jsonl()
+"""
+
+import contextvars
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+_ACTIVE_TRACER = contextvars.ContextVar("insight_active_tracer", default=None)
+_CURRENT_SPAN = contextvars.ContextVar("insight_current_span", default=None)
+_NOOP = nullcontext()
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes() -> int:
+    """RSS courant (Linux : /proc/self/statm), sinon pic de RSS."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Span:
+    __slots__ = (
+        "name", "span_id", "parent_id", "attributes",
+        "start_ns", "end_ns", "wall_ms", "cpu_ms", "mem_delta_kb",
+        "_cpu_start", "_perf_start", "_rss_start",
+    )
+
+    def __init__(self, name: str, parent_id: str, attributes: dict):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.end_ns = None
+        self.wall_ms = self.cpu_ms = self.mem_delta_kb = None
+
+    def start(self):
+        self.start_ns = time.time_ns()
+        self._rss_start = current_rss_bytes()
+        self._cpu_start = time.process_time()
+        self._perf_start = time.perf_counter()
+
+    def finish(self):
+        self.wall_ms = (time.perf_counter() - self._perf_start) * 1000
+        self.cpu_ms = (time.process_time() - self._cpu_start) * 1000
+        self.mem_delta_kb = (current_rss_bytes() - self._rss_start) / 1024
+        self.end_ns = time.time_ns()
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "wall_ms": round(self.wall_ms, 3),
+            "cpu_ms": round(self.cpu_ms, 3),
+            "mem_delta_kb": round(self.mem_delta_kb, 1),
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    def __init__(self, name: str, service_name: str = "insight-pdf-pro"):
+        self.name = name
+        self.service_name = service_name
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _CURRENT_SPAN.get()
+        s = Span(name, parent.span_id if parent is not None else None, attributes)
+        token = _CURRENT_SPAN.set(s)
+        s.start()
+        try:
+            yield s
+        finally:
+            s.finish()
+            try:
+                _CURRENT_SPAN.reset(token)
+            except ValueError:
+                pass  # générateur repris dans un autre contexte (streaming)
+            self.spans.append(s)
+
+    def summary(self) -> list:
+        """Spans terminés, dans l'ordre de démarrage."""
+        return [s.to_dict() for s in sorted(self.spans, key=lambda s: s.start_ns)]
+
+    def to_jsonl(self) -> str:
+        return "\n".join(
+            json.dumps({"trace_id": self.trace_id, "trace": self.name, **d}, ensure_ascii=False)
+            for d in self.summary()
+        ) + "\n"
+
+    def to_otlp(self) -> dict:
+        """Format OTLP/JSON (ExportTraceServiceRequest)."""
+        def attr(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = []
+        for s in self.spans:
+            attributes = [attr(k, v) for k, v in s.attributes.items()]
+            attributes += [
+                attr("insight.cpu_ms", s.cpu_ms),
+                attr("insight.mem_delta_kb", s.mem_delta_kb),
+            ]
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": attributes,
+            })
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [attr("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "insight_pdf.tracing"}, "spans": spans}],
+            }]
+        }
+
+
+@contextmanager
+def activate(tracer):
+    """Active un tracer pour le bloc (None = tracing désactivé)."""
+    token = _ACTIVE_TRACER.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _ACTIVE_TRACER.reset(token)
+
+
+def span(name: str, **attributes):
+    tracer = _ACTIVE_TRACER.get()
+    if tracer is None:
+        return _NOOP
+    return tracer.span(name, **attributes)